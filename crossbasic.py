@@ -8,22 +8,57 @@ Version: 1.0
 """
 
 import re
+import io
 import math
+import array
+import operator
+import hashlib
+import json
+import bisect
 import random
 import sys
 import os
 from typing import Dict, List, Any, Optional, Union
+from collections.abc import MutableMapping
 from enum import Enum
 import warnings
+import contextlib
 import platform
-
-# Suppress the pkg_resources deprecation warning from pygame
-warnings.filterwarnings("ignore", message="pkg_resources is deprecated as an API.*", category=UserWarning)
-
-import pygame
+import queue
 import threading
 import time
 
+# pygame and NumPy are imported on first use (load_pygame, load_numpy), so
+# text-only programs start without loading SDL or NumPy
+pygame = None
+numpy = None
+_numpy_loaded = False
+
+def load_pygame():
+    """Imports pygame the first time graphics are used and returns it"""
+    global pygame
+    if pygame is None:
+        # Suppress the pkg_resources deprecation warning from pygame
+        warnings.filterwarnings("ignore", message="pkg_resources is deprecated as an API.*",
+                                category=UserWarning)
+        # The import banner would land in the middle of the program's output
+        os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+        import pygame as module
+        pygame = module
+    return pygame
+
+def load_numpy():
+    """Imports NumPy on first use; None if it is not installed (array loops are then not vectorized)"""
+    global numpy, _numpy_loaded
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
 class ColorManager:
     """Handles cross-platform terminal color output"""
     
@@ -143,6 +178,92 @@ class ColorManager:
         
         return f"{color_start}{text}{color_end}"
 
+class OutputBuffer:
+    """Buffered console output for PRINT, shared by all engines
+    
+    PRINT appends lines here instead of calling print() per statement. Colors
+    are tracked as terminal state: an ANSI sequence is only written when the
+    foreground/background actually changes, and release() writes one reset at
+    the end. Flush policies:
+    
+    - 'line': after every line (the default when stdout is a terminal)
+    - 'size': once BUFFER_SIZE characters are pending (the default when piped)
+    - 'input': only when the program waits for INPUT, reports an error or ends
+    
+    With colors disabled the bytes written are exactly those of print().
+    """
+    
+    POLICIES = ('auto', 'line', 'size', 'input')
+    BUFFER_SIZE = 64 * 1024
+    
+    def __init__(self, color_manager: ColorManager, policy: str = 'auto'):
+        self.color_manager = color_manager
+        self.policy = policy
+        self._parts = []
+        self._pending = 0      # characters in _parts
+        self._limit = -1       # flush when _pending exceeds this; -1: policy not resolved yet
+        self._colors = None    # (fg, bg) in effect on the terminal, None after a reset
+    
+    def print_line(self, text: str = ''):
+        """Writes text and a newline in the current text colors"""
+        color_manager = self.color_manager
+        if text and color_manager.colors_enabled:
+            colors = (color_manager.current_fg_color, color_manager.current_bg_color)
+            if colors != self._colors:
+                self._colors = colors
+                self._parts.append(color_manager.get_color_escape_sequence())
+        self._parts.append(text)
+        self._parts.append('\n')
+        self._pending += len(text) + 1
+        if self._pending > self._limit:
+            self._overflow()
+    
+    def _overflow(self):
+        if self._limit < 0:
+            # First output since release(): stdout may have been redirected since
+            policy = self.policy
+            if policy == 'auto':
+                isatty = getattr(sys.stdout, 'isatty', None)
+                policy = 'line' if isatty is not None and isatty() else 'size'
+            self._limit = {'line': 0, 'size': self.BUFFER_SIZE}.get(policy, sys.maxsize)
+            if self._pending <= self._limit:
+                return
+        self.flush()
+    
+    def flush(self):
+        """Writes the pending text to stdout
+        
+        While text colors are in effect, a final newline stays pending so that
+        release() can reset the colors before it.
+        """
+        parts = self._parts
+        if parts:
+            held = self._colors is not None and parts[-1] == '\n'
+            if held:
+                parts.pop()
+            sys.stdout.write(''.join(parts))
+            parts.clear()
+            self._pending = 0
+            if held:
+                parts.append('\n')
+                self._pending = 1
+    
+    def release(self):
+        """Resets the colors and flushes everything; call before anything else writes to the console"""
+        if self._colors is not None:
+            # Reset before a pending newline: terminals fill a scrolled-in line
+            # with the current background, which would color the next message
+            parts = self._parts
+            reset = self.color_manager.reset_colors()
+            if parts and parts[-1] == '\n':
+                parts.insert(len(parts) - 1, reset)
+            else:
+                parts.append(reset)
+            self._colors = None
+        self.flush()
+        sys.stdout.flush()
+        self._limit = -1
+
 class TokenType(Enum):
     """Token types for the lexer"""
     NUMBER = "NUMBER"
@@ -173,10 +294,10 @@ class BasicLexer:
         'PRINT', 'LET', 'IF', 'THEN', 'ELSE', 'FOR', 'TO', 'STEP', 'NEXT',
         'WHILE', 'WEND', 'GOTO', 'GOSUB', 'RETURN', 'END', 'INPUT', 'DIM',
         'AND', 'OR', 'NOT', 'MOD', 'REM', 'DATA', 'READ', 'RESTORE', 'CLS', 'STOP',
-        'RUN', 'LIST', 'NEW', 'SAVE', 'LOAD', 'POKE', 'PEEK', 'SYS',
+        'RUN', 'LIST', 'NEW', 'SAVE', 'LOAD', 'POKE', 'PEEK', 'SYS', 'PARALLEL',
         # Graphics commands
         'GRAPHICS', 'PLOT', 'LINE', 'CIRCLE', 'RECT', 'FILL', 'COLOR', 'PSET',
-        'SCREEN', 'LOCATE', 'POINT', 'PAINT',
+        'SCREEN', 'LOCATE', 'POINT', 'PAINT', 'FLIP', 'AUTOFLIP',
         # Text color commands
         'TEXTCOLOR', 'TEXTBG', 'RESETCOLOR'
     }
@@ -446,10 +567,20 @@ class BasicParser:
             return self.parse_let()
         elif keyword == 'INPUT':
             return self.parse_input()
+        elif keyword == 'DIM':
+            return self.parse_dim()
+        elif keyword == 'DATA':
+            return self.parse_data()
+        elif keyword == 'READ':
+            return self.parse_read()
+        elif keyword == 'RESTORE':
+            return self.parse_restore()
         elif keyword == 'IF':
             return self.parse_if()
         elif keyword == 'FOR':
             return self.parse_for()
+        elif keyword == 'PARALLEL':
+            return self.parse_parallel()
         elif keyword == 'NEXT':
             return self.parse_next()
         elif keyword == 'WHILE':
@@ -486,9 +617,15 @@ class BasicParser:
             return self.parse_textbg()
         elif keyword == 'RESETCOLOR':
             return ('RESETCOLOR',)
+        elif keyword == 'FLIP':
+            return ('FLIP',)
+        elif keyword == 'AUTOFLIP':
+            return self.parse_autoflip()
         else:
-            # Possibly an assignment without LET
-            if self.match(TokenType.OPERATOR) and self.current_token.value == '=':
+            # Possibly an assignment without LET (to a variable or an array element)
+            if self.match(TokenType.OPERATOR) and (
+                    self.current_token.value == '=' or
+                    (self.current_token.value == '(' and self.tokens[self.pos - 1].type == TokenType.IDENTIFIER)):
                 self.pos -= 1  # Back to variable name
                 self.current_token = self.tokens[self.pos]
                 return self.parse_assignment()
@@ -519,12 +656,89 @@ class BasicParser:
     def parse_assignment(self):
         """Parst Zuweisung"""
         var_name = self.consume(TokenType.IDENTIFIER, "Expected variable name").value
+        if self.match(TokenType.OPERATOR) and self.current_token.value == '(':
+            # Array element: A(I) = expr
+            subscripts = self.parse_subscripts()
+            if not (self.match(TokenType.OPERATOR) and self.current_token.value == '='):
+                self.error("Expected '='")
+            self.advance()
+            return ('LET_ARRAY', var_name, subscripts, self.parse_expression())
         if not (self.match(TokenType.OPERATOR) and self.current_token.value == '='):
             self.error("Expected '='")
         self.advance()
         expr = self.parse_expression()
         return ('LET', var_name, expr)
     
+    def parse_subscripts(self):
+        """Parses parenthesized subscripts: (expr) or (expr, expr, ...)"""
+        self.advance()  # consume '('
+        subscripts = [self.parse_expression()]
+        while self.match(TokenType.OPERATOR) and self.current_token.value == ',':
+            self.advance()
+            subscripts.append(self.parse_expression())
+        if not (self.match(TokenType.OPERATOR) and self.current_token.value == ')'):
+            self.error("Expected ')'")
+        self.advance()
+        return subscripts
+    
+    def parse_dim(self):
+        """Parses DIM statement: DIM A(10), B(N, M), N$(5)"""
+        arrays = []
+        while True:
+            name = self.consume(TokenType.IDENTIFIER, "Expected array name").value
+            if not (self.match(TokenType.OPERATOR) and self.current_token.value == '('):
+                self.error("Expected '('")
+            arrays.append((name, self.parse_subscripts()))
+            if not (self.match(TokenType.OPERATOR) and self.current_token.value == ','):
+                break
+            self.advance()
+        return ('DIM', arrays)
+    
+    def parse_data(self):
+        """Parses DATA statement: DATA 1, -2.5, "TEXT", WORD (values are converted here, once)"""
+        values = []
+        while True:
+            sign = 1
+            if self.match(TokenType.OPERATOR) and self.current_token.value in ('-', '+'):
+                sign = -1 if self.current_token.value == '-' else 1
+                self.advance()
+                if not self.match(TokenType.NUMBER):
+                    self.error("Expected number")
+            if self.match(TokenType.NUMBER):
+                text = self.current_token.value
+                values.append(sign * (float(text) if '.' in text else int(text)))
+            elif self.match(TokenType.STRING, TokenType.IDENTIFIER, TokenType.KEYWORD):
+                values.append(self.current_token.value)
+            else:
+                self.error("Expected DATA value")
+            self.advance()
+            if not (self.match(TokenType.OPERATOR) and self.current_token.value == ','):
+                break
+            self.advance()
+        return ('DATA', values)
+    
+    def parse_read(self):
+        """Parses READ statement: READ A, N$, T(I)"""
+        targets = []
+        while True:
+            name = self.consume(TokenType.IDENTIFIER, "Expected variable name").value
+            if self.match(TokenType.OPERATOR) and self.current_token.value == '(':
+                targets.append(('FUNCTION', name, self.parse_subscripts()))
+            else:
+                targets.append(('VARIABLE', name))
+            if not (self.match(TokenType.OPERATOR) and self.current_token.value == ','):
+                break
+            self.advance()
+        return ('READ', targets)
+    
+    def parse_restore(self):
+        """Parses RESTORE statement: RESTORE or RESTORE line"""
+        if self.match(TokenType.NUMBER):
+            line_number = self.current_token.value
+            self.advance()
+            return ('RESTORE', int(line_number))
+        return ('RESTORE', None)
+    
     def parse_input(self):
         """Parst INPUT-Statement"""
         prompt = ""
@@ -617,6 +831,13 @@ class BasicParser:
         
         return ('FOR', var_name, start_expr, end_expr, step_expr)
     
+    def parse_parallel(self):
+        """Parses PARALLEL FOR: a FOR loop whose passes may run in worker processes (ParallelLoop)"""
+        if not (self.match(TokenType.KEYWORD) and self.current_token.value == 'FOR'):
+            self.error("Expected FOR")
+        self.advance()
+        return ('PARALLEL', self.parse_for())
+    
     def parse_next(self):
         """Parst NEXT-Statement"""
         var_name = None
@@ -648,6 +869,14 @@ class BasicParser:
             self.advance()
         return ('GRAPHICS', mode)
     
+    def parse_autoflip(self):
+        """Parses AUTOFLIP statement: AUTOFLIP ON, AUTOFLIP OFF or AUTOFLIP fps"""
+        if self.match(TokenType.IDENTIFIER, TokenType.KEYWORD) and self.current_token.value in ('ON', 'OFF'):
+            mode = self.current_token.value
+            self.advance()
+            return ('AUTOFLIP', mode, None)
+        return ('AUTOFLIP', 'FPS', self.parse_expression())
+    
     def parse_plot(self):
         """Parst PLOT-Statement"""
         x = self.parse_expression()
@@ -860,17 +1089,327 @@ class BasicParser:
             self.consume(TokenType.OPERATOR, "Expected ')'")
             return expr
         
+        elif self.match(TokenType.KEYWORD) and self.current_token.value == 'POINT':
+            # POINT(x, y): color of a pixel
+            self.advance()
+            self.consume(TokenType.OPERATOR, "Expected '('")
+            args = [self.parse_expression()]
+            self.consume(TokenType.OPERATOR, "Expected ','")
+            args.append(self.parse_expression())
+            self.consume(TokenType.OPERATOR, "Expected ')'")
+            return ('FUNCTION', 'POINT', args)
+        
         else:
             self.error(f"Unexpected token: {self.current_token}")
 
+class DisplayList:
+    """Graphics primitives recorded by GraphicsEngine, replayable without the BASIC program
+    
+    Commands live in two typed arrays: one opcode byte per command in ops,
+    and the integer arguments of all commands one after another in args
+    (ARGUMENTS gives the count per opcode). Coordinates are stored as the
+    engine draws them, after int(), in 64 bits (larger values are clamped);
+    COLOR stores the palette index.
+    replay() draws the list onto any surface, scaled to its size; at the
+    recorded size the result is pixel for pixel what the engine drew.
+    """
+    
+    CLS, COLOR, PSET, LINE, CIRCLE, RECT = range(6)
+    ARGUMENTS = (0, 1, 2, 4, 3, 4)
+    NAMES = ('CLS', 'COLOR', 'PSET', 'LINE', 'CIRCLE', 'RECT')
+    MAGIC = b'CROSSBASIC-DISPLAY-LIST 1\n'
+    # Shorter stretches of PSET/COLOR commands are replayed one by one
+    NUMPY_RUN = 64
+    
+    def __init__(self, width: int, height: int, palette: Dict[int, tuple], background: tuple):
+        self.width = width
+        self.height = height
+        self.palette = dict(palette)
+        self.background = tuple(background)
+        self.ops = array.array('B')
+        self.args = array.array('q')
+    
+    def __len__(self) -> int:
+        return len(self.ops)
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, DisplayList):
+            return NotImplemented
+        return ((self.width, self.height, self.palette, self.background, self.ops, self.args) ==
+                (other.width, other.height, other.palette, other.background, other.ops, other.args))
+    
+    def add(self, op: int, *values):
+        """Appends a command; values are converted with int() like the engine does"""
+        values = [int(value) for value in values]
+        length = len(self.args)
+        try:
+            self.args.extend(values)
+        except OverflowError:
+            del self.args[length:]  # The values before the large one went in
+            self.args.extend([self._clamp(value) for value in values])
+        self.ops.append(op)
+    
+    def pset(self, x, y):
+        """Appends a PSET command (the most frequent one, without add()'s generality)"""
+        x = int(x)
+        y = int(y)
+        try:
+            self.args.append(x)
+        except OverflowError:
+            self.args.append(self._clamp(x))
+        try:
+            self.args.append(y)
+        except OverflowError:
+            self.args.append(self._clamp(y))
+        self.ops.append(self.PSET)
+    
+    @staticmethod
+    def _clamp(value: int) -> int:
+        """Limits a value to the 64-bit range of args"""
+        return max(-2 ** 63, min(value, 2 ** 63 - 1))
+    
+    def extend(self, other: 'DisplayList'):
+        """Appends the commands of another list"""
+        self.ops.extend(other.ops)
+        self.args.extend(other.args)
+    
+    def commands(self):
+        """Yields each command as (op, argument tuple)"""
+        args = self.args
+        position = 0
+        for op in self.ops:
+            count = self.ARGUMENTS[op]
+            yield op, tuple(args[position:position + count])
+            position += count
+    
+    def first_difference(self, other: 'DisplayList') -> Optional[int]:
+        """Returns the number of the first command that differs from other's, None if none does
+        
+        A list that is a prefix of the other differs at its end.
+        """
+        for number, (mine, theirs) in enumerate(zip(self.commands(), other.commands())):
+            if mine != theirs:
+                return number
+        if len(self) != len(other):
+            return min(len(self), len(other))
+        return None
+    
+    def format_command(self, number: int) -> str:
+        """Returns command number as text, e.g. 'LINE 0, 0, 100, 50'"""
+        for current, (op, values) in enumerate(self.commands()):
+            if current == number:
+                return f"{self.NAMES[op]} {', '.join(map(str, values))}".rstrip()
+        raise IndexError(number)
+    
+    def save(self, filename: str):
+        """Writes the list to a file: a JSON header line, then the arrays (little-endian)"""
+        header = {'width': self.width, 'height': self.height,
+                  'palette': [self.palette[index] for index in sorted(self.palette)],
+                  'background': self.background,
+                  'commands': len(self.ops), 'arguments': len(self.args)}
+        args = self.args
+        if sys.byteorder == 'big':
+            args = array.array('q', args)
+            args.byteswap()
+        with open(filename, 'wb') as file:
+            file.write(self.MAGIC)
+            file.write(json.dumps(header).encode('ascii') + b'\n')
+            self.ops.tofile(file)
+            args.tofile(file)
+    
+    @classmethod
+    def load(cls, filename: str) -> 'DisplayList':
+        """Reads a list written by save()"""
+        with open(filename, 'rb') as file:
+            if file.readline() != cls.MAGIC:
+                raise ValueError(f"{filename} is not a CrossBasic display list")
+            header = json.loads(file.readline())
+            display_list = cls(header['width'], header['height'],
+                               {index: tuple(color) for index, color in enumerate(header['palette'])},
+                               header['background'])
+            try:
+                display_list.ops.fromfile(file, header['commands'])
+                display_list.args.fromfile(file, header['arguments'])
+            except EOFError:
+                raise ValueError(f"{filename} is truncated")
+        if sys.byteorder == 'big':
+            display_list.args.byteswap()
+        return display_list
+    
+    def replay(self, surface):
+        """Draws the commands onto a pygame surface, scaled to its size"""
+        load_pygame()
+        surface_width, surface_height = surface.get_size()
+        scale_x = surface_width / self.width
+        scale_y = surface_height / self.height
+        colors = {index: surface.map_rgb(color) for index, color in self.palette.items()}
+        background = surface.map_rgb(self.background)
+        exact = scale_x == 1 and scale_y == 1
+        if exact and load_numpy() is not None and surface.get_bytesize() in (1, 2, 4):
+            pset_runs = self._pset_runs()
+        else:
+            pset_runs = {}
+        
+        color = colors[1]  # The engine starts with white
+        args = self.args
+        position = 0
+        number = 0
+        ops = self.ops
+        count = len(ops)
+        while number < count:
+            op = ops[number]
+            run = pset_runs.get(number)
+            if run is not None:
+                # A stretch of PSET and COLOR commands, written at once with NumPy
+                number, position, color = self._replay_psets(surface, colors, color, number, *run)
+                continue
+            if op == self.PSET:
+                # The 2x2 pixels of the point, scaled and clipped to the surface
+                x, y = args[position], args[position + 1]
+                x0 = int((x - 1) * scale_x)
+                y0 = int((y - 1) * scale_y)
+                x1 = max(x0 + 1, int((x + 1) * scale_x))
+                y1 = max(y0 + 1, int((y + 1) * scale_y))
+                x0, y0 = max(x0, 0), max(y0, 0)
+                x1, y1 = min(x1, surface_width), min(y1, surface_height)
+                if x0 < x1 and y0 < y1:
+                    surface.fill(color, (x0, y0, x1 - x0, y1 - y0))
+            elif op == self.COLOR:
+                color = colors.get(args[position], color)
+            elif op == self.LINE:
+                x1, y1, x2, y2 = args[position:position + 4]
+                if not exact:
+                    x1, y1, x2, y2 = x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y
+                pygame.draw.line(surface, color, (x1, y1), (x2, y2))
+            elif op == self.CIRCLE:
+                x, y, radius = args[position:position + 3]
+                if not exact:
+                    x, y, radius = x * scale_x, y * scale_y, radius * (scale_x + scale_y) / 2
+                pygame.draw.circle(surface, color, (x, y), radius, 1)
+            elif op == self.RECT:
+                x, y, width, height = args[position:position + 4]
+                if not exact:
+                    x, y, width, height = x * scale_x, y * scale_y, width * scale_x, height * scale_y
+                pygame.draw.rect(surface, color, (x, y, width, height), 1)
+            elif op == self.CLS:
+                surface.fill(background)
+            position += self.ARGUMENTS[op]
+            number += 1
+    
+    def _pset_runs(self) -> Dict[int, tuple]:
+        """Finds stretches of PSET/COLOR commands: first command -> (end, first argument)"""
+        ops = numpy.frombuffer(self.ops, dtype=numpy.uint8)
+        if not len(ops):
+            return {}
+        counts = numpy.array(self.ARGUMENTS, dtype=numpy.int64)[ops]
+        positions = numpy.cumsum(counts) - counts
+        plain = ((ops == self.PSET) | (ops == self.COLOR)).astype(numpy.int8)
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([0], plain, [0]))))
+        return {start: (end, int(positions[start]))
+                for start, end in zip(edges[::2].tolist(), edges[1::2].tolist())
+                if end - start >= self.NUMPY_RUN}
+    
+    def _replay_psets(self, surface, colors: Dict[int, int], color: int,
+                      start: int, end: int, position: int) -> tuple:
+        """Writes commands start..end-1 (PSET and COLOR only) into the surface's pixels
+        
+        Returns (next command, its argument position, current color). Each
+        PSET covers the same 2x2 pixels as GraphicsEngine.plot_point; where
+        points overlap the later one wins, as when drawing them one by one.
+        """
+        ops = numpy.frombuffer(self.ops, dtype=numpy.uint8)[start:end]
+        counts = numpy.array(self.ARGUMENTS, dtype=numpy.int64)[ops]
+        end_position = position + int(counts.sum())
+        args = numpy.frombuffer(self.args, dtype=numpy.int64)[position:end_position]
+        offsets = numpy.cumsum(counts) - counts
+        
+        # Mapped color of every command: that of the last COLOR up to it
+        is_color = ops == self.COLOR
+        lookup = numpy.zeros(max(self.palette) + 1, dtype=numpy.int64)
+        for index, value in colors.items():
+            lookup[index] = value
+        set_colors = numpy.zeros(len(ops), dtype=numpy.int64)
+        set_colors[is_color] = lookup[args[offsets[is_color]]]
+        last_color = numpy.maximum.accumulate(numpy.where(is_color, numpy.arange(len(ops)), -1))
+        command_colors = numpy.where(last_color >= 0, set_colors[last_color], color)
+        
+        is_pset = ~is_color
+        x = args[offsets[is_pset]]
+        y = args[offsets[is_pset] + 1]
+        xs = numpy.stack((x - 1, x, x - 1, x), axis=1).ravel()
+        ys = numpy.stack((y - 1, y - 1, y, y), axis=1).ravel()
+        pixel_colors = numpy.repeat(command_colors[is_pset], 4)
+        width, height = surface.get_size()
+        inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        xs, ys, pixel_colors = xs[inside], ys[inside], pixel_colors[inside]
+        # Keep the last write of every pixel
+        _, last = numpy.unique((ys * width + xs)[::-1], return_index=True)
+        keep = len(xs) - 1 - last
+        pixels = pygame.surfarray.pixels2d(surface)
+        try:
+            pixels[xs[keep], ys[keep]] = pixel_colors[keep]
+        finally:
+            del pixels
+        return end, end_position, int(command_colors[-1])
+
 class GraphicsEngine:
-    """Graphics module with Pygame"""
+    """Graphics module with Pygame
+    
+    Drawing primitives only record the rectangles they changed; present()
+    shows them (FLIP). With auto-flip on (the default, AUTOFLIP ON/OFF/fps)
+    they are presented at most DEFAULT_FPS times per second while drawing,
+    and the interpreter presents the rest before INPUT and when the program ends.
+    
+    PSET/PLOT write premapped palette colors straight into a PixelArray that
+    keeps the screen locked until the next present(); POINT reads it back.
+    
+    In headless mode (headless=True or CROSSBASIC_HEADLESS=1) the program draws
+    into an off-screen surface: no window, no event pumping and no flips.
+    checksum() and save_image() give access to the result.
     
-    def __init__(self, width: int = 800, height: int = 600):
+    start_recording() keeps every primitive in a DisplayList as well, or
+    instead of drawing it (draw=False: no window and no pygame at all).
+    
+    With threaded=True (or CROSSBASIC_RENDER_THREAD=1) a render thread draws
+    and presents; the primitives only queue commands (see start_render_thread).
+    """
+    
+    DEFAULT_FPS = 60
+    # More dirty rectangles than this are presented with one full flip
+    DIRTY_LIMIT = 256
+    # Render thread: commands per batch, and batches that may wait in the queue
+    RENDER_BATCH = 4096
+    RENDER_QUEUE = 8
+    
+    def __init__(self, width: int = 800, height: int = 600, headless: bool = None,
+                 threaded: bool = None):
         self.width = width
         self.height = height
         self.screen = None
         self.running = False
+        if headless is None:
+            headless = os.environ.get('CROSSBASIC_HEADLESS', '') not in ('', '0')
+        self.headless = headless
+        self.dirty = []               # Rectangles changed since the last present()
+        self.auto_flip = True
+        self.flip_interval = 1.0 / self.DEFAULT_FPS
+        self._last_present = 0.0
+        self.pixels = None            # Locked PixelArray of the screen for PSET/POINT
+        self._pixel_area = None       # [x0, y0, x1, y1] written through pixels, not yet presented
+        self.pixel_colors = {}        # Palette index -> mapped pixel value of the screen
+        self._color_indices = {}      # Mapped pixel value -> palette index
+        self.current_pixel = 0
+        self.display_list = None      # DisplayList being recorded, see start_recording()
+        self.drawing = True           # False: primitives are only recorded
+        if threaded is None:
+            threaded = os.environ.get('CROSSBASIC_RENDER_THREAD', '') not in ('', '0')
+        # macOS only lets the main thread present: no render thread there
+        self.threaded = threaded and sys.platform != 'darwin'
+        self.color_index = 1          # Palette index of current_color
+        self._batch = None            # DisplayList filled for the render thread
+        self._render_queue = None
+        self._render_thread = None
+        self._render_error = None     # Exception raised in the render thread
         self.current_color = (255, 255, 255)  # White
         self.background_color = (0, 0, 0)     # Black
         
@@ -896,7 +1435,18 @@ class GraphicsEngine:
     
     def init_graphics(self, mode: int = 0):
         """Initializes the graphics system"""
+        if not self.running and not self.drawing:
+            # Recording only: there is nothing to draw on
+            self.running = True
+            return
         if not self.running:
+            load_pygame()
+        if not self.running and self.headless:
+            # Off-screen surface in memory, no display needed
+            self.screen = pygame.Surface((self.width, self.height))
+            self.screen.fill(self.background_color)
+            self.running = True
+        elif not self.running:
             pygame.init()
             
             # Set window to always stay on top
@@ -957,17 +1507,178 @@ class GraphicsEngine:
             self.screen.fill(self.background_color)
             pygame.display.flip()
             self.running = True
+        self._map_palette()
+        if self.threaded and self._render_thread is None and self.screen is not None:
+            self.start_render_thread()
     
-    def _handle_events(self):
-        """Handle pygame events - must be called from main thread on macOS"""
-        if self.running:
+    def _map_palette(self):
+        """Maps the palette to pixel values of the screen"""
+        if self.screen is None:
+            return
+        self.pixel_colors = {index: self.screen.map_rgb(color) for index, color in self.colors.items()}
+        # The first index wins for colors listed twice
+        self._color_indices = {pixel: index for index, pixel in reversed(self.pixel_colors.items())}
+        self.current_pixel = self.screen.map_rgb(self.current_color)
+    
+    def _unlock(self):
+        """Releases the pixel buffer, unlocking the screen"""
+        if self.pixels is not None:
+            self.pixels.close()
+            self.pixels = None
+    
+    def start_render_thread(self):
+        """Moves drawing and presenting to a render thread fed with batches of draw commands
+        
+        The primitives append their commands to a DisplayList batch, which is
+        queued when RENDER_BATCH commands are collected, on present() (FLIP,
+        INPUT, program end) and, with auto-flip on, on every pump_events().
+        The render thread replays the batches onto the screen and presents
+        them, at most at the auto-flip rate unless it has caught up with the
+        queue. At most RENDER_QUEUE batches wait: a full queue blocks the
+        interpreter until the render thread has drawn one (back-pressure), so
+        commands are never dropped and memory stays bounded. point(),
+        checksum() and save_image() wait for the queue to drain (sync).
+        Window events are still handled on the main thread.
+        """
+        if self._render_thread is not None or self.screen is None:
+            return
+        self._unlock()
+        self._render_queue = queue.Queue(maxsize=self.RENDER_QUEUE)
+        self._batch = self._new_batch()
+        self._render_thread = threading.Thread(target=self._render_loop, name="CrossBasic render",
+                                               daemon=True)
+        self._render_thread.start()
+    
+    def stop_render_thread(self):
+        """Draws what is still queued and ends the render thread"""
+        if self._render_thread is None:
+            return
+        self._send_batch(flip=True, check=False)
+        self._render_queue.put((None, False))
+        self._render_thread.join()
+        self._render_thread = self._render_queue = self._batch = None
+        self._render_error = None
+    
+    def _new_batch(self) -> DisplayList:
+        batch = DisplayList(self.width, self.height, self.colors, self.background_color)
+        batch.add(DisplayList.COLOR, self.color_index)
+        return batch
+    
+    def _send_batch(self, flip: bool = False, check: bool = True):
+        """Queues the current batch for the render thread; blocks while the queue is full"""
+        if check and self._render_error is not None:
+            error, self._render_error = self._render_error, None
+            raise error
+        batch = self._batch
+        if len(batch.ops) > 1 or flip:
+            self._batch = self._new_batch()
+            self._render_queue.put((batch, flip))
+    
+    def sync(self):
+        """Waits until the render thread has drawn all commands so far"""
+        if self._render_thread is not None:
+            self._send_batch()
+            self._render_queue.join()
+            self._send_batch()  # Raises an error of the last batches
+    
+    def _render_loop(self):
+        """Render thread: replays the queued batches onto the screen and presents them"""
+        batches = self._render_queue
+        screen = self.screen
+        while True:
+            batch, flip = batches.get()
+            try:
+                if batch is None:
+                    return
+                batch.replay(screen)
+                if not self.headless and (flip or self.auto_flip and (
+                        batches.empty() or time.perf_counter() - self._last_present >= self.flip_interval)):
+                    pygame.display.flip()
+                    self._last_present = time.perf_counter()
+            except Exception as error:
+                self._render_error = error
+            finally:
+                batches.task_done()
+    
+    def pump_events(self):
+        """Handles pending window events - must be called from main thread on macOS
+        
+        Drawing does not poll; the interpreter calls this regularly while a
+        program runs (BasicInterpreter.poll_events).
+        """
+        if self._batch is not None and self.auto_flip:
+            self._send_batch()
+        if self.running and self.screen is not None and not self.headless:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.running = False
     
+    def set_auto_flip(self, enabled: bool, fps: float = None):
+        """Switches automatic presentation on or off; fps caps the refresh rate"""
+        self.auto_flip = enabled
+        if fps is not None:
+            if isinstance(fps, str) or not fps > 0:
+                raise ValueError(f"Illegal refresh rate: {fps}")
+            self.flip_interval = 1.0 / fps
+    
+    def _mark(self, rect):
+        """Records a changed rectangle; presents the changes when auto-flip is due"""
+        if self.headless:
+            return
+        self.dirty.append(rect)
+        if self.auto_flip and time.perf_counter() - self._last_present >= self.flip_interval:
+            self.present()
+    
+    def present(self):
+        """Shows all changes since the last present() in the window (FLIP)"""
+        if self._batch is not None:
+            self.dirty.clear()
+            self._send_batch(flip=True)
+            return
+        if self.screen is None or self.headless:
+            return
+        self._unlock()
+        area = self._pixel_area
+        if area is not None:
+            self.dirty.append(pygame.Rect(area[0], area[1], area[2] - area[0], area[3] - area[1]))
+            self._pixel_area = None
+        if not self.dirty:
+            return
+        if len(self.dirty) > self.DIRTY_LIMIT:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.dirty)
+        self.dirty.clear()
+        self._last_present = time.perf_counter()
+    
+    def checksum(self) -> Optional[str]:
+        """Returns the SHA-256 of the framebuffer's RGB pixels, None without graphics"""
+        if self.screen is None:
+            return None
+        self.sync()
+        self._unlock()
+        to_bytes = getattr(pygame.image, 'tobytes', None) or pygame.image.tostring
+        return hashlib.sha256(to_bytes(self.screen, 'RGB')).hexdigest()
+    
+    def save_image(self, filename: str) -> bool:
+        """Saves the framebuffer as an image (format from the file extension)"""
+        if self.screen is None:
+            return False
+        self.sync()
+        self._unlock()
+        pygame.image.save(self.screen, filename)
+        return True
+    
     def close(self):
         """Closes the graphics window"""
-        if self.running:
+        self.stop_render_thread()
+        self._unlock()
+        self._pixel_area = None
+        if self.running and (self.headless or self.screen is None):
+            self.running = False
+            self.screen = None
+        elif self.running:
+            self.dirty.clear()
             self.running = False
             # Quit pygame
             try:
@@ -984,60 +1695,2332 @@ class GraphicsEngine:
             self.close()
         
         # Kurz warten damit Pygame richtig cleanup macht
-        import time
-        time.sleep(0.1)
+        if not self.headless and self.drawing:
+            time.sleep(0.1)
         
         # Neues Fenster öffnen
         self.init_graphics()
     
+    def _queue(self, op: int, *values):
+        """Adds a command to the render thread's batch"""
+        self._batch.add(op, *values)
+        if len(self._batch.ops) >= self.RENDER_BATCH:
+            self._send_batch()
+    
+    def start_recording(self, draw: bool = True) -> DisplayList:
+        """Records all following primitives into a new DisplayList and returns it
+        
+        With draw=False they are only recorded; call this before GRAPHICS.
+        """
+        self.display_list = DisplayList(self.width, self.height, self.colors, self.background_color)
+        self.display_list.add(DisplayList.COLOR, self.color_index)
+        self.drawing = draw
+        return self.display_list
+    
+    def stop_recording(self) -> Optional[DisplayList]:
+        """Ends recording (and drawing only into it); returns the recorded DisplayList"""
+        display_list = self.display_list
+        self.display_list = None
+        self.drawing = True
+        return display_list
+    
+    def replay(self, display_list: DisplayList):
+        """Draws a recorded DisplayList onto the screen, scaled to its size
+        
+        While recording, the commands are appended to the recording too.
+        """
+        if self.display_list is not None and self.display_list is not display_list:
+            self.display_list.extend(display_list)
+        if self.screen is None:
+            return
+        self.sync()
+        self._unlock()
+        display_list.replay(self.screen)
+        self._mark(self.screen.get_rect())
+    
+    def attach(self, surface):
+        """Draws into an existing surface instead of a window (PARALLEL FOR workers)"""
+        self._unlock()
+        self.screen = surface
+        self.width, self.height = surface.get_size()
+        self.headless = True
+        self.running = True
+        self._map_palette()
+    
+    def copy_to(self, surface):
+        """Copies the screen onto a surface of the same size"""
+        self.sync()
+        self._unlock()
+        surface.blit(self.screen, (0, 0))
+    
+    def copy_from(self, surface):
+        """Copies a surface of the same size onto the screen"""
+        self.sync()
+        self._unlock()
+        self.screen.blit(surface, (0, 0))
+        self._mark(self.screen.get_rect())
+    
     def clear_screen(self):
         """Löscht den Bildschirm"""
-        if self.screen:
-            self._handle_events()  # Handle events on main thread
+        if self.display_list is not None and self.running:
+            self.display_list.add(DisplayList.CLS)
+        if self._batch is not None:
+            self._queue(DisplayList.CLS)
+        elif self.screen:
             self.screen.fill(self.background_color)
-            pygame.display.flip()
+            self._mark(self.screen.get_rect())
     
     def set_color(self, color_index: int):
         """Setzt die aktuelle Farbe"""
         if color_index in self.colors:
             self.current_color = self.colors[color_index]
+            self.color_index = color_index
+            if self.display_list is not None:
+                self.display_list.add(DisplayList.COLOR, color_index)
+            if self._batch is not None:
+                self._queue(DisplayList.COLOR, color_index)
+            if self.screen is not None:
+                self.current_pixel = self.pixel_colors[color_index]
     
     def plot_point(self, x: int, y: int):
-        """Zeichnet einen Punkt"""
-        if self.screen:
-            self._handle_events()  # Handle events on main thread
-            pygame.draw.circle(self.screen, self.current_color, (int(x), int(y)), 1)
-            pygame.display.flip()
+        """Zeichnet einen Punkt: die 2x2 Pixel links oberhalb von (x, y)"""
+        if self.display_list is not None and self.running:
+            self.display_list.pset(x, y)
+        batch = self._batch
+        if batch is not None:
+            batch.pset(x, y)
+            if len(batch.ops) >= self.RENDER_BATCH:
+                self._send_batch()
+            return
+        if self.screen is None:
+            return
+        pixels = self.pixels
+        if pixels is None:
+            pixels = self.pixels = pygame.PixelArray(self.screen)
+        x = int(x)
+        y = int(y)
+        # Same pixels as pygame.draw.circle with radius 1, clipped to the screen
+        x0 = x - 1 if x > 0 else 0
+        y0 = y - 1 if y > 0 else 0
+        x1 = x + 1 if x < self.width else self.width
+        y1 = y + 1 if y < self.height else self.height
+        if x0 >= x1 or y0 >= y1:
+            return
+        pixels[x0:x1, y0:y1] = self.current_pixel
+        if self.headless:
+            return
+        area = self._pixel_area
+        if area is None:
+            self._pixel_area = [x0, y0, x1, y1]
+        else:
+            if x0 < area[0]:
+                area[0] = x0
+            if y0 < area[1]:
+                area[1] = y0
+            if x1 > area[2]:
+                area[2] = x1
+            if y1 > area[3]:
+                area[3] = y1
+        if self.auto_flip and time.perf_counter() - self._last_present >= self.flip_interval:
+            self.present()
+    
+    def point(self, x: int, y: int) -> int:
+        """Returns the palette index of the pixel at (x, y), -1 outside the screen or without graphics"""
+        if self.screen is None:
+            return -1
+        x = int(x)
+        y = int(y)
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return -1
+        if self._render_thread is not None:
+            self.sync()
+            return self._color_indices.get(self.screen.map_rgb(self.screen.get_at((x, y))), -1)
+        pixels = self.pixels
+        if pixels is None:
+            pixels = self.pixels = pygame.PixelArray(self.screen)
+        return self._color_indices.get(pixels[x, y], -1)
     
     def draw_line(self, x1: int, y1: int, x2: int, y2: int):
         """Zeichnet eine Linie"""
-        if self.screen:
-            self._handle_events()  # Handle events on main thread
-            pygame.draw.line(self.screen, self.current_color, 
-                           (int(x1), int(y1)), (int(x2), int(y2)))
-            pygame.display.flip()
+        if self.display_list is not None and self.running:
+            self.display_list.add(DisplayList.LINE, x1, y1, x2, y2)
+        if self._batch is not None:
+            self._queue(DisplayList.LINE, x1, y1, x2, y2)
+        elif self.screen:
+            self._mark(pygame.draw.line(self.screen, self.current_color,
+                                        (int(x1), int(y1)), (int(x2), int(y2))))
     
     def draw_circle(self, x: int, y: int, radius: int):
         """Zeichnet einen Kreis"""
-        if self.screen:
-            self._handle_events()  # Handle events on main thread
-            pygame.draw.circle(self.screen, self.current_color, 
-                             (int(x), int(y)), int(radius), 1)
-            pygame.display.flip()
+        if self.display_list is not None and self.running:
+            self.display_list.add(DisplayList.CIRCLE, x, y, radius)
+        if self._batch is not None:
+            self._queue(DisplayList.CIRCLE, x, y, radius)
+        elif self.screen:
+            self._mark(pygame.draw.circle(self.screen, self.current_color,
+                                          (int(x), int(y)), int(radius), 1))
     
     def draw_rect(self, x: int, y: int, width: int, height: int):
         """Zeichnet ein Rechteck"""
-        if self.screen:
-            self._handle_events()  # Handle events on main thread
-            pygame.draw.rect(self.screen, self.current_color, 
-                           (int(x), int(y), int(width), int(height)), 1)
-            pygame.display.flip()
+        if self.display_list is not None and self.running:
+            self.display_list.add(DisplayList.RECT, x, y, width, height)
+        if self._batch is not None:
+            self._queue(DisplayList.RECT, x, y, width, height)
+        elif self.screen:
+            self._mark(pygame.draw.rect(self.screen, self.current_color,
+                                        (int(x), int(y), int(width), int(height)), 1))
+
+class Unset(int):
+    """The value of a variable slot that was never assigned (UNSET): 0 in every calculation
+    
+    The engines read unset variables as this 0 without any check; VariableStore
+    tells assigned from unassigned slots by identity (value is UNSET).
+    Calculations give plain numbers, and the engines store a plain 0 where
+    an assignment copies an unset variable (LET Y = X, FOR I = X TO ...),
+    so only slots that were never written hold UNSET.
+    """
+    
+    __slots__ = ()
+    
+    def __new__(cls):
+        return int.__new__(cls, 0)
+    
+    def __repr__(self) -> str:
+        return '0'
+    
+    def __reduce__(self):
+        return 'UNSET'  # The module constant, also in worker processes
+
+UNSET = Unset()
+
+class VariableStore(MutableMapping):
+    """BASIC variables, resolved to integer slots in a flat list of values
+    
+    ProgramIndex attaches each variable's slot to the run-time statements,
+    and the engines read and write values[slot] directly. By name, the store
+    is a normal mapping view on the same values, for immediate mode and
+    other callers. Slots are never given up, so compiled code stays valid:
+    a slot holds UNSET (read as 0) until its variable is assigned, and
+    deleting a name sets it back to UNSET; the mapping only shows assigned
+    variables. Names starting with % are the optimizer's temporaries (see
+    LoopOptimizer): they have slots but are never part of the mapping.
+    """
+    
+    def __init__(self, initial: Dict[str, Any] = None):
+        self.slots = {}
+        self.values = []
+        self.hidden = []  # Slots of the % temporaries
+        if initial:
+            self.update(initial)
+    
+    def slot(self, name: str) -> int:
+        """Returns the slot of a variable, assigning one on first use"""
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.values)
+            self.values.append(UNSET)
+            if name.startswith('%'):
+                self.hidden.append(slot)
+        return slot
+    
+    def _visible(self, name: str, slot: int) -> bool:
+        return self.values[slot] is not UNSET and not name.startswith('%')
+    
+    def __getitem__(self, name: str):
+        slot = self.slots[name]
+        if not self._visible(name, slot):
+            raise KeyError(name)
+        return self.values[slot]
+    
+    def get(self, name: str, default=None):
+        slot = self.slots.get(name)
+        return default if slot is None or not self._visible(name, slot) else self.values[slot]
+    
+    def __contains__(self, name) -> bool:
+        slot = self.slots.get(name)
+        return slot is not None and self._visible(name, slot)
+    
+    def __setitem__(self, name: str, value):
+        self.values[self.slot(name)] = value
+    
+    def __delitem__(self, name: str):
+        slot = self.slots[name]
+        if not self._visible(name, slot):
+            raise KeyError(name)
+        self.values[slot] = UNSET
+    
+    def __iter__(self):
+        return (name for name, slot in self.slots.items() if self._visible(name, slot))
+    
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+    
+    def clear(self):
+        """Unassigns all variables, keeping their slots (the list object stays the same)"""
+        self.values[:] = [UNSET] * len(self.values)
+    
+    def clear_hidden(self):
+        """Unassigns the optimizer's temporaries"""
+        values = self.values
+        for slot in self.hidden:
+            values[slot] = UNSET
+    
+    def copy(self) -> Dict[str, Any]:
+        """Returns the assigned variables as a plain dict"""
+        return {name: self.values[slot] for name, slot in self.slots.items() if self._visible(name, slot)}
+    
+    def __repr__(self) -> str:
+        return f"VariableStore({self.copy()!r})"
+    
+    def resolve_statement(self, statement):
+        """Returns the statement with slots attached to its variables
+        
+        ('VARIABLE', name, slot); LET, FOR and INPUT get the slot of the
+        assigned variable as an extra last element.
+        """
+        if not isinstance(statement, tuple) or not statement:
+            return statement
+        cmd = statement[0]
+        if cmd == 'MULTI_STATEMENT':
+            return (cmd, [self.resolve_statement(s) for s in statement[1]]) + statement[2:]
+        if cmd == 'IF':
+            parts = list(statement)
+            parts[1] = self.resolve_expression(parts[1])
+            for i in (2, 3):
+                if i < len(parts):
+                    parts[i] = self.resolve_statement(parts[i])
+            return tuple(parts)
+        
+        statement = ExpressionOptimizer.map_statement(statement, self.resolve_expression)
+        if cmd in ('LET', 'FOR'):
+            return statement + (self.slot(statement[1]),)
+        if cmd == 'INPUT':
+            return statement + (self.slot(statement[2]),)
+        return statement
+    
+    def resolve_expression(self, expr):
+        """Returns the expression with slots attached to its variables"""
+        if not isinstance(expr, tuple) or not expr:
+            return expr
+        expr_type = expr[0]
+        if expr_type == 'VARIABLE':
+            return ('VARIABLE', expr[1], self.slot(expr[1]))
+        if expr_type == 'BINOP':
+            return ('BINOP', self.resolve_expression(expr[1]), expr[2], self.resolve_expression(expr[3]))
+        if expr_type == 'UNOP':
+            return ('UNOP', expr[1], self.resolve_expression(expr[2]))
+        if expr_type == 'FUNCTION':
+            return ('FUNCTION', expr[1], [self.resolve_expression(arg) for arg in expr[2]])
+        return expr
+
+class BasicArray:
+    """A DIM array: numbers in a typed array.array buffer, strings in a list
+    
+    A(I, J) parses like a function call; a name that is not a built-in function
+    refers to the array. Elements are stored row-major, every dimension running
+    from 0 to its DIM bound. Numeric arrays hold 64-bit integers ('q') until a
+    float is stored, then the whole array holds doubles ('d'): 8 bytes per
+    element either way. Names ending in $ are string arrays. Errors are raised
+    as IndexError/TypeError with the BASIC message; the engines report them.
+    """
+    
+    __slots__ = ('name', 'bounds', 'strides', 'data', 'floats', 'strings')
+    
+    # Largest magnitude an integer element can hold (int64); bigger values make the array float
+    INT_LIMIT = 2 ** 63
+    
+    def __init__(self, name: str, bounds: List[int]):
+        self.name = name
+        self.bounds = tuple(bounds)
+        # Row-major: the last subscript is contiguous
+        strides = []
+        count = 1
+        for bound in reversed(self.bounds):
+            strides.append(count)
+            count *= bound + 1
+        self.strides = tuple(reversed(strides))
+        self.floats = False
+        self.strings = name.endswith('$')
+        if self.strings:
+            self.data = [''] * count
+        else:
+            self.data = array.array('q', [0]) * count
+    
+    def offset(self, subscripts) -> int:
+        """Returns the element index for a list of subscript values"""
+        if len(subscripts) != len(self.bounds):
+            raise IndexError(f"Wrong number of subscripts: {self.name}")
+        offset = 0
+        for index, bound, stride in zip(subscripts, self.bounds, self.strides):
+            if type(index) is not int:
+                if isinstance(index, str):
+                    raise TypeError(f"Type mismatch in subscript: {self.name}")
+                if not math.isfinite(index):
+                    raise IndexError(f"Subscript out of range: {self.format(subscripts)}")
+                index = int(index)
+            if not 0 <= index <= bound:
+                raise IndexError(f"Subscript out of range: {self.format(subscripts)}")
+            offset += index * stride
+        return offset
+    
+    def format(self, subscripts) -> str:
+        """Returns the element as written in BASIC, e.g. A(3, 4)"""
+        return f"{self.name}({', '.join(str(index) for index in subscripts)})"
+    
+    def get(self, subscripts):
+        """Returns an element as a Python int, float or str"""
+        return self.data[self.offset(subscripts)]
+    
+    def set(self, subscripts, value):
+        """Stores a value in an element"""
+        index = self.offset(subscripts)
+        if isinstance(value, str) != self.strings:
+            raise TypeError(f"Type mismatch: {self.name}")
+        if not self.strings and not self.floats and (
+                isinstance(value, float) or not -self.INT_LIMIT <= value < self.INT_LIMIT):
+            self.promote()
+        self.data[index] = value
+    
+    def promote(self):
+        """Turns the array into a float array"""
+        if not self.floats:
+            self.floats = True
+            self.data = array.array('d', self.data)
+    
+    def vector(self):
+        """Returns a NumPy view on the elements of a numeric array (needs NumPy)"""
+        return numpy.frombuffer(self.data, dtype=numpy.float64 if self.floats else numpy.int64)
+    
+    def store_vector(self, values, floats: bool):
+        """Replaces all elements with a NumPy vector of int64 or (floats) float64 values"""
+        if floats == self.floats:
+            self.vector()[:] = values
+        else:
+            self.floats = floats
+            self.data = array.array('d' if floats else 'q', values.tobytes())
+
+class ExpressionOptimizer:
+    """Constant folding and algebraic simplification of parsed expressions
+    
+    Runs between parsing and execution on the run-time copy of the program
+    (ProgramIndex.statements); the listed program keeps its original form.
+    Rewrites never change what the interpreter computes or reports:
+    
+    - constant subexpressions are folded, unless evaluating them fails
+      (division by zero, type errors, ...), so the error still happens at run time
+    - RND, TIME and unknown functions are never folded
+    - x*1 and 1*x become x, x+0, 0+x and x-0 only for integer-valued x
+      (for floats, -0.0 + 0 is 0.0)
+    - x^2 becomes x*x only for integer variables (both are exact); for floats
+      x*x turns into infinity where x^2 reports an overflow. A variable the
+      program may read before assigning it is not known to be an integer
+    - NOT NOT x becomes x for comparisons and logical operations (values 1/0)
+    """
+    
+    # Built-in functions without side effects that may be evaluated while optimizing
+    PURE_FUNCTIONS = ('ABS', 'INT', 'SQR', 'SIN', 'COS', 'TAN', 'LEN', 'CHR', 'ASC')
+    
+    # Operators whose result is always 1 or 0
+    BOOLEAN_OPERATORS = ('=', '<>', '!=', '<', '>', '<=', '>=', 'AND', 'OR')
+    
+    # Statement fields holding expressions
+    EXPRESSION_FIELDS = {
+        'LET': (2,), 'IF': (1,), 'FOR': (2, 3, 4), 'WHILE': (1,),
+        'PLOT': (1, 2), 'PSET': (1, 2), 'LINE': (1, 2, 3, 4), 'CIRCLE': (1, 2, 3),
+        'RECT': (1, 2, 3, 4), 'COLOR': (1,), 'TEXTCOLOR': (1,), 'TEXTBG': (1,),
+        'AUTOFLIP': (2,),
+    }
+    
+    # Value kinds of expressions: 'int', 'num' (int or float) or None (unknown, may be a string)
+    _FUNCTION_KINDS = {'INT': 'int', 'LEN': 'int', 'ASC': 'int', 'SQR': 'num', 'SIN': 'num',
+                       'COS': 'num', 'TAN': 'num', 'RND': 'num', 'TIME': 'num',
+                       'POINT': 'int'}
+    
+    def __init__(self, builtin_functions: Dict[str, Any]):
+        self.builtin_functions = builtin_functions
+        self.variable_kinds = {}
+    
+    def optimize_program(self, statements: Dict[int, Any]) -> Dict[int, Any]:
+        """Returns the statements with all expressions optimized"""
+        self.variable_kinds = self._infer_variable_kinds(statements)
+        return {line_num: self.optimize_statement(statement)
+                for line_num, statement in statements.items()}
+    
+    def optimize_statement(self, statement):
+        """Optimizes the expressions of a statement (and of statements nested in it)"""
+        return self.map_statement(statement, self.optimize_expression)
+    
+    @classmethod
+    def map_statement(cls, statement, function):
+        """Returns the statement with function applied to each of its expressions"""
+        if not isinstance(statement, tuple) or not statement:
+            return statement
+        cmd = statement[0]
+        if cmd == 'MULTI_STATEMENT':
+            return (cmd, [cls.map_statement(s, function) for s in statement[1]]) + statement[2:]
+        if cmd == 'PRINT':
+            return (cmd, [function(item) for item in statement[1]]) + statement[2:]
+        if cmd == 'DIM':
+            return (cmd, [(name, [function(size) for size in sizes]) for name, sizes in statement[1]])
+        if cmd == 'READ':
+            return (cmd, [function(target) for target in statement[1]])
+        if cmd == 'LET_ARRAY':
+            return ((cmd, statement[1], [function(index) for index in statement[2]], function(statement[3]))
+                    + statement[4:])
+        
+        fields = cls.EXPRESSION_FIELDS.get(cmd)
+        if fields is None:
+            return statement
+        parts = list(statement)
+        for i in fields:
+            if i < len(parts):
+                parts[i] = function(parts[i])
+        if cmd == 'IF':
+            for i in (2, 3):
+                if i < len(parts):
+                    parts[i] = cls.map_statement(parts[i], function)
+        return tuple(parts)
+    
+    def optimize_expression(self, expr):
+        """Returns an equivalent, simplified expression tuple"""
+        if not isinstance(expr, tuple) or not expr:
+            return expr
+        expr_type = expr[0]
+        
+        if expr_type == 'BINOP':
+            left = self.optimize_expression(expr[1])
+            op = expr[2]
+            right = self.optimize_expression(expr[3])
+            if self._is_constant(left) and self._is_constant(right):
+                folded = self._fold(self._binary_value, left[1], op, right[1])
+                if folded is not None:
+                    return folded
+            return self._simplify_binary(left, op, right)
+        
+        elif expr_type == 'UNOP':
+            op = expr[1]
+            operand = self.optimize_expression(expr[2])
+            if self._is_constant(operand):
+                folded = self._fold(self._unary_value, op, operand[1])
+                if folded is not None:
+                    return folded
+            if (op == 'NOT' and operand[0] == 'UNOP' and operand[1] == 'NOT'
+                    and self._is_boolean(operand[2])):
+                return operand[2]
+            return ('UNOP', op, operand)
+        
+        elif expr_type == 'FUNCTION':
+            name = expr[1]
+            args = [self.optimize_expression(arg) for arg in expr[2]]
+            if (name in self.PURE_FUNCTIONS and name in self.builtin_functions
+                    and args and all(self._is_constant(arg) for arg in args)):
+                folded = self._fold(self.builtin_functions[name], *[arg[1] for arg in args])
+                if folded is not None:
+                    return folded
+            return ('FUNCTION', name, args)
+        
+        return expr
+    
+    def _simplify_binary(self, left, op, right):
+        """Applies the algebraic identities to a binary operation"""
+        if op == '*':
+            if self._is_int_constant(right, 1):
+                return left
+            if self._is_int_constant(left, 1):
+                return right
+        elif op == '+':
+            if self._is_int_constant(right, 0) and self.kind(left) == 'int':
+                return left
+            if self._is_int_constant(left, 0) and self.kind(right) == 'int':
+                return right
+        elif op == '-':
+            if self._is_int_constant(right, 0) and self.kind(left) == 'int':
+                return left
+        elif op == '^':
+            if (self._is_int_constant(right, 2) and left[0] == 'VARIABLE'
+                    and self.kind(left) == 'int'):
+                return ('BINOP', left, '*', left)
+        return ('BINOP', left, op, right)
+    
+    @staticmethod
+    def _is_constant(expr) -> bool:
+        return expr[0] in ('NUMBER', 'STRING')
+    
+    @staticmethod
+    def _is_int_constant(expr, value: int) -> bool:
+        return expr[0] == 'NUMBER' and type(expr[1]) is int and expr[1] == value
+    
+    def _is_boolean(self, expr) -> bool:
+        """True if the expression always yields 1 or 0"""
+        return ((expr[0] == 'BINOP' and expr[2] in self.BOOLEAN_OPERATORS) or
+                (expr[0] == 'UNOP' and expr[1] == 'NOT'))
+    
+    @staticmethod
+    def _fold(function, *args):
+        """Evaluates a constant operation; None if it fails or yields a non-BASIC value"""
+        try:
+            value = function(*args)
+        except Exception:
+            return None
+        if type(value) in (int, float):
+            return ('NUMBER', value)
+        if type(value) is str:
+            return ('STRING', value)
+        return None
+    
+    @staticmethod
+    def _binary_value(left, op, right):
+        """Binary operator as in BasicInterpreter.apply_binary_operator, raising on errors"""
+        if op == '+':
+            return left + right
+        elif op == '-':
+            return left - right
+        elif op == '*':
+            return left * right
+        elif op == '/':
+            if right == 0:
+                raise ZeroDivisionError(op)
+            return left / right
+        elif op == 'MOD':
+            if right == 0:
+                raise ZeroDivisionError(op)
+            return left % right
+        elif op == '^':
+            # Do not build huge integers while optimizing
+            if type(left) is int and type(right) is int and abs(left) > 1 and right > 64:
+                raise OverflowError(op)
+            return left ** right
+        elif op == '=':
+            return 1 if left == right else 0
+        elif op in ('<>', '!='):
+            return 1 if left != right else 0
+        elif op == '<':
+            return 1 if left < right else 0
+        elif op == '>':
+            return 1 if left > right else 0
+        elif op == '<=':
+            return 1 if left <= right else 0
+        elif op == '>=':
+            return 1 if left >= right else 0
+        elif op == 'AND':
+            return 1 if left and right else 0
+        elif op == 'OR':
+            return 1 if left or right else 0
+        raise ValueError(f"Unknown binary operator: {op}")
+    
+    @staticmethod
+    def _unary_value(op, operand):
+        """Unary operator as in BasicInterpreter.apply_unary_operator, raising on errors"""
+        if op == '+':
+            return +operand
+        elif op == '-':
+            return -operand
+        elif op == 'NOT':
+            return 1 if not operand else 0
+        raise ValueError(f"Unknown unary operator: {op}")
+    
+    @staticmethod
+    def _join(a: Optional[str], b: Optional[str]) -> Optional[str]:
+        if a is None or b is None:
+            return None
+        return 'int' if a == b == 'int' else 'num'
+    
+    def kind(self, expr, variable_kinds: Dict[str, Optional[str]] = None) -> Optional[str]:
+        """Returns 'int', 'num' or None (unknown) for the value of an expression"""
+        if variable_kinds is None:
+            variable_kinds = self.variable_kinds
+        if not expr:
+            return 'int'
+        expr_type = expr[0]
+        if expr_type == 'NUMBER':
+            return 'int' if type(expr[1]) is int else 'num'
+        elif expr_type == 'VARIABLE':
+            return variable_kinds.get(expr[1])
+        elif expr_type == 'BINOP':
+            op = expr[2]
+            if op in self.BOOLEAN_OPERATORS:
+                return 'int'
+            left = self.kind(expr[1], variable_kinds)
+            right = self.kind(expr[3], variable_kinds)
+            if op in ('+', '-', '*', 'MOD'):
+                return self._join(left, right)
+            if op in ('/', '^'):
+                return self._join(left, right) and 'num'
+        elif expr_type == 'UNOP':
+            if expr[1] == 'NOT':
+                return 'int'
+            return self.kind(expr[2], variable_kinds)
+        elif expr_type == 'FUNCTION':
+            if expr[1] == 'ABS' and len(expr[2]) == 1:
+                return self.kind(expr[2][0], variable_kinds)
+            return self._FUNCTION_KINDS.get(expr[1])
+        return None
+    
+    @staticmethod
+    def _assigned_first(statements: Dict[int, Any]) -> set:
+        """Variables the program assigns before it can read them
+        
+        Every other variable may still hold a value from outside the program
+        (immediate mode shares the variables) when it is first read. The lines
+        are scanned in order up to the first line a GOTO or GOSUB may jump to
+        or the first statement that branches; FOR/NEXT loops do not end the
+        scan, as their passes only repeat what came before in line order.
+        """
+        targets = [stmt[1] for statement in statements.values()
+                   for stmt in ProgramIndex._flatten(statement) if stmt[0] in ('GOTO', 'GOSUB')]
+        first_target = min(targets, default=None)
+        assigned = set()
+        read_first = set()
+        
+        def read(node):
+            if isinstance(node, (tuple, list)):
+                if len(node) >= 2 and node[0] == 'VARIABLE' and node[1] not in assigned:
+                    read_first.add(node[1])
+                for child in node:
+                    read(child)
+        
+        def assign(name):
+            if name not in read_first:
+                assigned.add(name)
+        
+        for line_num in sorted(statements):
+            if first_target is not None and line_num >= first_target:
+                break
+            statement = statements[line_num]
+            subs = statement[1] if statement and statement[0] == 'MULTI_STATEMENT' else [statement]
+            for stmt in subs:
+                if not stmt:
+                    continue
+                cmd = stmt[0]
+                if cmd in ('IF', 'GOTO', 'GOSUB', 'RETURN', 'WHILE', 'WEND', 'END'):
+                    return assigned
+                if cmd in ('LET', 'FOR'):
+                    read(stmt[2:])
+                    assign(stmt[1])
+                elif cmd == 'INPUT':
+                    assign(stmt[2])
+                elif cmd == 'READ':
+                    for target in stmt[1]:
+                        if target[0] == 'VARIABLE':
+                            assign(target[1])
+                        else:
+                            read(target)
+                else:
+                    read(stmt)
+        return assigned
+    
+    def _infer_variable_kinds(self, statements: Dict[int, Any]) -> Dict[str, Optional[str]]:
+        """Derives the value kind of every variable from all assignments in the program"""
+        assignments = {}
+        # A variable read before the program assigns it starts with a value of any kind
+        assigned_first = self._assigned_first(statements)
+        for statement in statements.values():
+            for stmt in ProgramIndex._flatten(statement):
+                if stmt[0] == 'LET':
+                    assignments.setdefault(stmt[1], []).append(stmt[2])
+                elif stmt[0] == 'FOR':
+                    # The loop variable runs through start + k * step
+                    assignments.setdefault(stmt[1], []).extend((stmt[2], stmt[4]))
+                elif stmt[0] == 'INPUT':
+                    assignments.setdefault(stmt[2], []).append(None)
+                elif stmt[0] == 'READ':
+                    for target in stmt[1]:
+                        if target[0] == 'VARIABLE':
+                            assignments.setdefault(target[1], []).append(None)
+        for name, exprs in assignments.items():
+            if name not in assigned_first:
+                exprs.append(None)
+        
+        # Start optimistic and widen until nothing changes (loops like X = X + 1)
+        kinds = {name: 'int' for name in assignments}
+        changed = True
+        while changed:
+            changed = False
+            for name, exprs in assignments.items():
+                kind = kinds[name]
+                for expr in exprs:
+                    if kind is None:
+                        break
+                    kind = self._join(kind, None if expr is None else self.kind(expr, kinds))
+                if kind != kinds[name]:
+                    kinds[name] = kind
+                    changed = True
+        return kinds
+
+class ForFrame:
+    """An open FOR loop on the interpreter's for_stack, shared by all engines"""
+    
+    __slots__ = ('var', 'slot', 'end', 'step', 'line', 'pc', 'direction')
+    
+    def __init__(self, var: str, slot: int, start, end, step, line: int, pc: int = None):
+        self.var = var
+        self.slot = slot
+        self.end = end
+        self.step = step
+        self.line = line
+        self.pc = pc  # Resume address in the VM, None for the other engines
+        # Integer counters test one bound: 1 counts up, -1 counts down, 0 needs more()
+        if type(start) is int and type(end) is int and type(step) is int and step:
+            self.direction = 1 if step > 0 else -1
+        else:
+            self.direction = 0
+    
+    def more(self, value) -> bool:
+        """General loop test: True if the loop runs again with its variable at value"""
+        step = self.step
+        return (step > 0 and value <= self.end) or (step < 0 and value >= self.end)
+    
+    def __repr__(self):
+        return f"ForFrame({self.var!r}, end={self.end!r}, step={self.step!r}, line={self.line!r})"
+
+class ProgramIndex:
+    """Run-time index of a loaded program, built once per program change"""
+    
+    def __init__(self, program: Dict[Any, Any], variables: VariableStore,
+                 optimizer: 'ExpressionOptimizer' = None):
+        # Executable statements keyed by line number; PARALLEL FOR runs as a
+        # FOR everywhere, its lines are remembered for parallel_loops
+        self.statements = {}
+        self.parallel_lines = parallel_lines = set()
+        for line_num, value in program.items():
+            if isinstance(line_num, int):
+                statement = value[0]
+                if statement and statement[0] == 'PARALLEL':
+                    parallel_lines.add(line_num)
+                self.statements[line_num] = self._unwrap_parallel(statement)
+        # Optional constant folding; the program itself keeps the statements as entered
+        self.optimized = optimizer is not None
+        if optimizer is not None:
+            self.statements = optimizer.optimize_program(self.statements)
+        self.line_numbers = sorted(self.statements)
+        self.first_line = self.line_numbers[0] if self.line_numbers else None
+        # Line number -> its position in line_numbers
+        self.position = {line_num: i for i, line_num in enumerate(self.line_numbers)}
+        
+        # Successor table: line number -> next line number (None after the last line)
+        self.next_line = {}
+        for i, line_num in enumerate(self.line_numbers):
+            self.next_line[line_num] = self.line_numbers[i + 1] if i + 1 < len(self.line_numbers) else None
+        
+        # Pre-resolved jump targets: GOTO/GOSUB target -> target line, or None if missing
+        self.jump_targets = {}
+        # RETURN resumes at the line following the GOSUB line
+        self.return_lines = {}
+        for line_num, statement in self.statements.items():
+            for stmt in self._flatten(statement):
+                if stmt[0] in ('GOTO', 'GOSUB'):
+                    target = stmt[1]
+                    self.jump_targets[target] = target if target in self.statements else None
+                    if stmt[0] == 'GOSUB':
+                        self.return_lines[line_num] = self.next_line[line_num]
+        
+        # DATA values of all lines in program order, converted by the parser, and
+        # line number -> offset of the first value on that line or after it (RESTORE)
+        self.data = []
+        self.data_offsets = {}
+        for line_num in self.line_numbers:
+            self.data_offsets[line_num] = len(self.data)
+            for stmt in self._flatten(self.statements[line_num]):
+                if stmt[0] == 'DATA':
+                    self.data.extend(stmt[1])
+        
+        # Compiled forms of the program, keyed by engine name
+        self.compiled = {}
+        
+        self.has_graphics = any(
+            stmt[0] in ['GRAPHICS', 'PLOT', 'LINE', 'CIRCLE', 'RECT', 'COLOR', 'PSET', 'CLS',
+                        'FLIP', 'AUTOFLIP']
+            for statement in self.statements.values()
+            for stmt in self._flatten(statement)
+        )
+        
+        # Loop optimizations need the jump tables above; they only add
+        # assignments to existing lines, so the tables stay valid
+        # Only loops that assign array elements can be vectorized: NumPy is not
+        # even imported for other programs
+        vectorizer = None
+        if (optimizer is not None
+                and any(stmt[0] == 'LET_ARRAY'
+                        for statement in self.statements.values()
+                        for stmt in self._flatten(statement))
+                and load_numpy() is not None):
+            vectorizer = LoopVectorizer(self, optimizer.builtin_functions)
+        if optimizer is not None:
+            self.statements = LoopOptimizer(self, optimizer, vectorizer).optimize()
+        
+        # Variables are looked up by slot at run time (see VariableStore)
+        self.statements = {
+            line_num: variables.resolve_statement(statement)
+            for line_num, statement in self.statements.items()
+        }
+        
+        # Static FOR/NEXT pairs of the final statements, innermost first (see for_loops)
+        self.loops = self.for_loops()
+        # FOR line -> VectorLoop for loops that run as NumPy array operations
+        self.vector_loops = vectorizer.plans() if vectorizer is not None else {}
+        # FOR line -> ParallelLoop for PARALLEL FOR loops whose passes can run in worker processes
+        self.parallel_loops = {}
+        for for_line, next_line in self.loops:
+            if for_line in parallel_lines:
+                plan = ParallelLoop.plan(self, program, for_line, next_line)
+                if plan is not None:
+                    self.parallel_loops[for_line] = plan
+        # FOR line -> plan the engines offer the whole loop to (VectorLoop or ParallelLoop)
+        self.loop_plans = {**self.parallel_loops, **self.vector_loops}
+        
+        # WHILE/WEND matching in both directions: every line holding a WHILE ->
+        # its WEND line (None if unmatched), and WEND line -> WHILE line
+        self.wend_of = {}
+        self.while_of = {}
+        self._match_while_wend()
+    
+    # Statements that move execution to another line
+    CONTROL_STATEMENTS = ('GOTO', 'GOSUB', 'RETURN', 'NEXT', 'WHILE', 'WEND')
+    
+    @staticmethod
+    def _flatten(statement):
+        """Yields a statement and all statements nested inside it (IF branches, multi-statements)"""
+        if not isinstance(statement, tuple) or not statement:
+            return
+        yield statement
+        if statement[0] == 'MULTI_STATEMENT':
+            for sub_statement in statement[1]:
+                yield from ProgramIndex._flatten(sub_statement)
+        elif statement[0] == 'IF':
+            yield from ProgramIndex._flatten(statement[2])
+            if len(statement) > 3:
+                yield from ProgramIndex._flatten(statement[3])
+    
+    @classmethod
+    def _unwrap_parallel(cls, statement):
+        """Returns the statement with every ('PARALLEL', FOR) replaced by the FOR"""
+        if not isinstance(statement, tuple) or not statement:
+            return statement
+        if statement[0] == 'PARALLEL':
+            return statement[1]
+        if statement[0] == 'MULTI_STATEMENT':
+            return (statement[0], [cls._unwrap_parallel(s) for s in statement[1]]) + statement[2:]
+        if statement[0] == 'IF':
+            return statement[:2] + tuple(cls._unwrap_parallel(s) for s in statement[2:])
+        return statement
+    
+    @classmethod
+    def jumps_mid_line(cls, statement) -> bool:
+        """True if a line can transfer control and still have statements left to run
+        
+        Compiling engines hand such lines (and lines with WHILE/WEND nested in
+        IF or multi-statements) to the tree-walker as a whole.
+        """
+        def has_control(stmt):
+            return any(s[0] in cls.CONTROL_STATEMENTS for s in cls._flatten(stmt))
+        
+        def check(stmt, tail):
+            if not stmt:
+                return False
+            cmd = stmt[0]
+            if cmd == 'MULTI_STATEMENT':
+                subs = stmt[1]
+                return (any(has_control(s) for s in subs[:-1]) or
+                        (bool(subs) and check(subs[-1], tail)))
+            if cmd == 'IF':
+                else_stmt = stmt[3] if len(stmt) > 3 else None
+                return check(stmt[2], tail) or check(else_stmt, tail)
+            return cmd in cls.CONTROL_STATEMENTS and not tail
+        
+        if statement and statement[0] not in ('WHILE', 'WEND') and any(
+                s[0] in ('WHILE', 'WEND') for s in cls._flatten(statement)):
+            return True
+        return check(statement, True)
+    
+    @classmethod
+    def split_loop_line(cls, statement, cmd: str) -> Optional[tuple]:
+        """Splits a FOR or NEXT line into (statements before, the FOR/NEXT, statements after)
+        
+        Returns None unless the line holds exactly one top-level cmd and nothing
+        else that moves execution; a NEXT has to end its line.
+        """
+        if not statement:
+            return None
+        if statement[0] == cmd:
+            return [], statement, []
+        if statement[0] != 'MULTI_STATEMENT':
+            return None
+        subs = statement[1]
+        positions = [i for i, sub in enumerate(subs) if sub and sub[0] == cmd]
+        if len(positions) != 1 or (cmd == 'NEXT' and positions[0] != len(subs) - 1):
+            return None
+        i = positions[0]
+        for sub in subs[:i] + subs[i + 1:]:
+            if any(s[0] in cls.CONTROL_STATEMENTS or s[0] == 'FOR' for s in cls._flatten(sub)):
+                return None
+        return subs[:i], subs[i], subs[i + 1:]
+    
+    def for_loops(self) -> List[tuple]:
+        """Pairs FOR and NEXT lines statically; returns (for_line, next_line), innermost first
+        
+        Pairing follows execute_next, which continues the innermost open loop
+        whatever variable the NEXT names.
+        """
+        pairs = []
+        open_fors = []
+        for line_num in self.line_numbers:
+            statement = self.statements[line_num]
+            if self.split_loop_line(statement, 'FOR') is not None:
+                open_fors.append(line_num)
+            elif self.split_loop_line(statement, 'NEXT') is not None and open_fors:
+                pairs.append((open_fors.pop(), line_num))
+        position = self.position
+        return sorted(pairs, key=lambda pair: position[pair[1]] - position[pair[0]])
+    
+    def entry_lines(self) -> set:
+        """Returns the lines execution can reach other than from the line before
+        
+        These are the first line, GOTO/GOSUB targets, where RETURN resumes and
+        where lines that jump mid-line continue; NEXT and WEND are not included.
+        """
+        entries = {self.first_line}
+        for line_num, statement in self.statements.items():
+            for stmt in self._flatten(statement):
+                if stmt[0] in ('GOTO', 'GOSUB'):
+                    entries.add(self.resolve_jump(stmt[1]))
+                if stmt[0] == 'GOSUB':
+                    entries.add(self.return_line(line_num))
+            if self.jumps_mid_line(statement):
+                entries.add(self.line_after(line_num))
+        entries.discard(None)
+        return entries
+    
+    def _match_while_wend(self):
+        """Fills wend_of/while_of in one backward pass
+        
+        A false WHILE continues at the first later line where top-level WENDs
+        outnumber top-level WHILEs (WHILE/WEND nested in IF or multi-statements
+        are not counted). after[i] is that line when scanning from position i.
+        """
+        lines = self.line_numbers
+        statements = self.statements
+        after = [None] * len(lines)
+        for i in range(len(lines) - 2, -1, -1):
+            stmt = statements[lines[i + 1]]
+            cmd = stmt[0] if stmt else None
+            if cmd == 'WEND':
+                after[i] = lines[i + 1]
+            elif cmd == 'WHILE':
+                # Skip the nested loop, then keep scanning behind its WEND
+                inner = after[i + 1]
+                after[i] = None if inner is None else after[self.position[inner]]
+            else:
+                after[i] = after[i + 1]
+        
+        for i, line_num in enumerate(lines):
+            statement = statements[line_num]
+            if any(stmt[0] == 'WHILE' for stmt in self._flatten(statement)):
+                self.wend_of[line_num] = after[i]
+                if statement[0] == 'WHILE' and after[i] is not None:
+                    self.while_of[after[i]] = line_num
+    
+    def matching_wend(self, line_num: int) -> Optional[int]:
+        """Returns the WEND line a false WHILE on line_num continues at, or None"""
+        if line_num in self.wend_of:
+            return self.wend_of[line_num]
+        # Not a WHILE line of the program (e.g. immediate mode): scan
+        depth = 1
+        for other in self.line_numbers[bisect.bisect_right(self.line_numbers, line_num):]:
+            stmt = self.statements[other]
+            if stmt and stmt[0] == 'WHILE':
+                depth += 1
+            elif stmt and stmt[0] == 'WEND':
+                depth -= 1
+                if depth == 0:
+                    return other
+        return None
+    
+    def resolve_jump(self, target: int) -> Optional[int]:
+        """Returns the line a GOTO/GOSUB to target lands on, or None if it does not exist"""
+        if target in self.jump_targets:
+            return self.jump_targets[target]
+        return target if target in self.statements else None
+    
+    def resume_line(self, line_num: int) -> Optional[int]:
+        """Returns the line a RETURN resumes at for a GOSUB issued on line_num"""
+        if line_num in self.return_lines:
+            return self.return_lines[line_num]
+        return self.line_after(line_num)
+    
+    def return_line(self, gosub_line: int) -> Optional[int]:
+        """Returns the line executed next after a RETURN to gosub_line, or None to stop
+        
+        Like the run loop: RETURN moves to the resume line, which then counts as
+        executed and is stepped past.
+        """
+        resume_line = self.resume_line(gosub_line)
+        return None if resume_line is None else self.line_after(resume_line)
+    
+    def line_after(self, line_num: int) -> Optional[int]:
+        """Returns the first line number greater than line_num, or None"""
+        if line_num in self.next_line:
+            return self.next_line[line_num]
+        i = bisect.bisect_right(self.line_numbers, line_num)
+        return self.line_numbers[i] if i < len(self.line_numbers) else None
+
+class LoopOptimizer:
+    """Optimizes FOR/NEXT loops in the run-time statements, after ExpressionOptimizer
+    
+    Only loops paired by ProgramIndex.for_loops are touched, and only if
+    nothing jumps into them and their body moves execution nowhere but
+    through nested loops. Results live in hidden variables %1, %2, ...
+    (not valid BASIC names, left out of the variable mapping and unassigned
+    after the run):
+    
+    - invariant hoisting: expressions that use nothing assigned in the loop
+      and cannot fail are computed once on the FOR line
+    - strength reduction: V*K for an integer loop variable V and an invariant
+      integer K becomes a variable that the NEXT line advances by K*STEP
+      (integers only, so the sums stay exact)
+    - unrolling: loops with constant bounds, at most UNROLL_TRIPS passes and a
+      short body that cannot fail are expanded on the FOR line
+    
+    A body that assigns its loop variable (LET ITER = MAX_ITER) is neither
+    strength-reduced nor unrolled. Loops the LoopVectorizer takes are left as they are.
+    """
+    
+    UNROLL_TRIPS = 4
+    UNROLL_STATEMENTS = 16
+    
+    def __init__(self, index: ProgramIndex, optimizer: ExpressionOptimizer,
+                 vectorizer: 'LoopVectorizer' = None):
+        self.index = index
+        self.optimizer = optimizer
+        self.vectorizer = vectorizer
+        self.kinds = dict(optimizer.variable_kinds)
+        self.temp_count = 0
+    
+    def optimize(self) -> Dict[int, Any]:
+        """Returns the statements with all eligible loops optimized"""
+        index = self.index
+        self.statements = dict(index.statements)
+        loops = index.for_loops()
+        loop_lines = {line_num for pair in loops for line_num in pair}
+        entries = index.entry_lines()
+        position = index.position
+        
+        for for_line, next_line in loops:
+            body = index.line_numbers[position[for_line] + 1:position[next_line]]
+            if next_line in entries or any(line_num in entries for line_num in body):
+                continue
+            if self.vectorizer is not None and self.vectorizer.is_candidate(self.statements, for_line, next_line):
+                continue
+            if any(line_num not in loop_lines and self._moves_execution(self.statements[line_num])
+                   for line_num in body):
+                continue
+            # A PARALLEL FOR keeps its loop, so ProgramIndex can still plan it
+            nested = any(line_num in loop_lines for line_num in body)
+            if nested or for_line in index.parallel_lines or not self._unroll(for_line, next_line, body):
+                self._reduce_and_hoist(for_line, next_line, body)
+        return self.statements
+    
+    @staticmethod
+    def _moves_execution(statement) -> bool:
+        return any(stmt[0] in ProgramIndex.CONTROL_STATEMENTS or stmt[0] == 'FOR'
+                   for stmt in ProgramIndex._flatten(statement))
+    
+    def _new_temp(self, expr) -> str:
+        self.temp_count += 1
+        name = f"%{self.temp_count}"
+        self.kinds[name] = self.optimizer.kind(expr, self.kinds)
+        return name
+    
+    def _kind(self, expr) -> Optional[str]:
+        return self.optimizer.kind(expr, self.kinds)
+    
+    @staticmethod
+    def _assigned(statements) -> set:
+        """Variables assigned by the statements"""
+        names = set()
+        for statement in statements:
+            for stmt in ProgramIndex._flatten(statement):
+                if stmt[0] in ('LET', 'FOR'):
+                    names.add(stmt[1])
+                elif stmt[0] == 'INPUT':
+                    names.add(stmt[2])
+                elif stmt[0] == 'READ':
+                    names.update(target[1] for target in stmt[1] if target[0] == 'VARIABLE')
+        return names
+    
+    @staticmethod
+    def _variables_in(expr) -> set:
+        names = set()
+        
+        def walk(node):
+            if isinstance(node, (tuple, list)):
+                if len(node) == 2 and node[0] == 'VARIABLE':
+                    names.add(node[1])
+                for child in node:
+                    walk(child)
+        
+        walk(expr)
+        return names
+    
+    def _safe(self, expr) -> bool:
+        """True if evaluating the expression cannot report an error"""
+        if not expr:
+            return True
+        expr_type = expr[0]
+        if expr_type in ('NUMBER', 'STRING', 'VARIABLE'):
+            return True
+        if expr_type == 'UNOP':
+            if not self._safe(expr[2]):
+                return False
+            return expr[1] == 'NOT' or (expr[1] in ('+', '-') and self._kind(expr[2]) is not None)
+        if expr_type == 'BINOP':
+            left, op, right = expr[1], expr[2], expr[3]
+            if not (self._safe(left) and self._safe(right)):
+                return False
+            if op in ('AND', 'OR'):
+                return True
+            numeric = self._kind(left) is not None and self._kind(right) is not None
+            if op in ('+', '-', '*', '=', '<>', '!=', '<', '>', '<=', '>='):
+                return numeric
+            if op in ('/', 'MOD'):
+                return numeric and right[0] == 'NUMBER' and right[1] != 0
+            return False
+        if expr_type == 'FUNCTION':
+            args = expr[2]
+            return (expr[1] == 'ABS' and len(args) == 1 and self._safe(args[0])
+                    and self._kind(args[0]) is not None)
+        return False
+    
+    def _safe_statement(self, statement) -> bool:
+        """True if the statement only assigns, prints or branches and cannot fail"""
+        if not statement:
+            return True
+        cmd = statement[0]
+        if cmd == 'COMMENT':
+            return True
+        if cmd == 'LET':
+            return self._safe(statement[2])
+        if cmd == 'PRINT':
+            return all(self._safe(item) for item in statement[1])
+        if cmd == 'MULTI_STATEMENT':
+            return all(self._safe_statement(sub) for sub in statement[1])
+        if cmd == 'IF':
+            else_stmt = statement[3] if len(statement) > 3 else None
+            return (self._safe(statement[1]) and self._safe_statement(statement[2])
+                    and self._safe_statement(else_stmt))
+        return False
+    
+    def _unroll(self, for_line: int, next_line: int, body: List[int]) -> bool:
+        """Expands a short loop with constant bounds on its FOR line; False if not possible"""
+        statements = self.statements
+        for_stmt = statements[for_line]
+        next_split = ProgramIndex.split_loop_line(statements[next_line], 'NEXT')
+        if for_stmt[0] != 'FOR':
+            return False
+        var, start, end, step = for_stmt[1:5]
+        if not all(expr and expr[0] == 'NUMBER' for expr in (start, end, step)):
+            return False
+        
+        body_statements = [statements[line_num] for line_num in body] + list(next_split[0])
+        if var in self._assigned(body_statements):
+            return False
+        if not all(self._safe_statement(statement) for statement in body_statements):
+            return False
+        
+        # Same arithmetic as execute_next, so the values are exactly those of the loop
+        values = [start[1]]
+        step_value, end_value = step[1], end[1]
+        while True:
+            new_value = values[-1] + step_value
+            if not ((step_value > 0 and new_value <= end_value) or
+                    (step_value < 0 and new_value >= end_value)):
+                break
+            if len(values) == self.UNROLL_TRIPS:
+                return False
+            values.append(new_value)
+        
+        flat = []
+        for statement in body_statements:
+            if statement and statement[0] == 'MULTI_STATEMENT':
+                flat.extend(sub for sub in statement[1] if sub)
+            elif statement:
+                flat.append(statement)
+        if len(flat) * len(values) > self.UNROLL_STATEMENTS:
+            return False
+        
+        unrolled = []
+        for value in values:
+            unrolled.append(('LET', var, ('NUMBER', value)))
+            unrolled.extend(flat)
+        unrolled.append(('LET', var, ('NUMBER', new_value)))
+        statements[for_line] = ('MULTI_STATEMENT', unrolled)
+        for line_num in body + [next_line]:
+            statements[line_num] = ('COMMENT', 'unrolled')
+        return True
+    
+    def _reduce_and_hoist(self, for_line: int, next_line: int, body: List[int]):
+        statements = self.statements
+        before, for_stmt, after = ProgramIndex.split_loop_line(statements[for_line], 'FOR')
+        next_before, next_stmt, _ = ProgramIndex.split_loop_line(statements[next_line], 'NEXT')
+        
+        # Everything assigned while the loop runs, including by FOR and NEXT themselves
+        assigned = self._assigned([statements[line_num] for line_num in body] +
+                                  list(before) + [for_stmt] + list(after) + list(next_before))
+        body_lines = body + [next_line]
+        
+        def invariant(expr):
+            return not (self._variables_in(expr) & assigned) and self._safe(expr)
+        
+        # Strength reduction: V*K -> %n, advanced by K*STEP before NEXT
+        var, step = for_stmt[1], for_stmt[4]
+        reduced = {}
+        others = [statements[line_num] for line_num in body] + list(before) + list(after) + list(next_before)
+        if (self.kinds.get(var) == 'int' and var not in self._assigned(others)
+                and step and step[0] == 'NUMBER' and type(step[1]) is int):
+            loop_var = ('VARIABLE', var)
+            
+            def reduce(expr):
+                if not isinstance(expr, tuple) or not expr:
+                    return expr
+                if expr[0] == 'BINOP':
+                    if expr[2] == '*':
+                        for factor, other in ((expr[3], expr[1]), (expr[1], expr[3])):
+                            if (other == loop_var and invariant(factor)
+                                    and self._kind(factor) == 'int'):
+                                if factor not in reduced:
+                                    reduced[factor] = self._new_temp(expr)
+                                return ('VARIABLE', reduced[factor])
+                    return ('BINOP', reduce(expr[1]), expr[2], reduce(expr[3]))
+                if expr[0] == 'UNOP':
+                    return ('UNOP', expr[1], reduce(expr[2]))
+                if expr[0] == 'FUNCTION':
+                    return ('FUNCTION', expr[1], [reduce(arg) for arg in expr[2]])
+                return expr
+            
+            for line_num in body_lines:
+                statements[line_num] = ExpressionOptimizer.map_statement(statements[line_num], reduce)
+            assigned.update(reduced.values())
+        
+        # Invariant hoisting: the largest invariant subexpressions become %n
+        hoisted = {}
+        
+        def hoist(expr):
+            if not isinstance(expr, tuple) or not expr or expr[0] in ('NUMBER', 'STRING', 'VARIABLE'):
+                return expr
+            if invariant(expr):
+                if expr not in hoisted:
+                    hoisted[expr] = self._new_temp(expr)
+                return ('VARIABLE', hoisted[expr])
+            if expr[0] == 'BINOP':
+                return ('BINOP', hoist(expr[1]), expr[2], hoist(expr[3]))
+            if expr[0] == 'UNOP':
+                return ('UNOP', expr[1], hoist(expr[2]))
+            if expr[0] == 'FUNCTION':
+                return ('FUNCTION', expr[1], [hoist(arg) for arg in expr[2]])
+            return expr
+        
+        for line_num in body_lines:
+            statements[line_num] = ExpressionOptimizer.map_statement(statements[line_num], hoist)
+        
+        if not reduced and not hoisted:
+            return
+        
+        # FOR line: hoisted values before the FOR, reduced products after it has
+        # set the loop variable (NEXT returns behind the FOR line, so both run once)
+        loop_var = ('VARIABLE', var)
+        for_subs = list(before)
+        for_subs += [('LET', name, expr) for expr, name in hoisted.items()]
+        for_subs += [for_stmt] + list(after)
+        next_subs = list(statements[next_line][1][:-1]) if statements[next_line][0] == 'MULTI_STATEMENT' else []
+        for factor, name in reduced.items():
+            for_subs.append(('LET', name, ('BINOP', loop_var, '*', factor)))
+            increment = self.optimizer.optimize_expression(('BINOP', factor, '*', step))
+            if increment[0] not in ('NUMBER', 'VARIABLE'):
+                temp = self._new_temp(increment)
+                for_subs.append(('LET', temp, increment))
+                increment = ('VARIABLE', temp)
+            next_subs.append(('LET', name, ('BINOP', ('VARIABLE', name), '+', increment)))
+        statements[for_line] = ('MULTI_STATEMENT', for_subs)
+        if reduced:
+            statements[next_line] = ('MULTI_STATEMENT', next_subs + [next_stmt])
+
+class VectorLoop:
+    """A FOR loop whose body only assigns array elements, run as NumPy array operations
+    
+    Built by LoopVectorizer. run() executes the whole loop at once or returns
+    False, leaving everything untouched, whenever the result could differ from
+    running it statement by statement; the engine then runs the loop itself.
+    """
+    
+    # Fewer passes than this are not worth the NumPy overhead
+    MIN_TRIPS = 32
+    
+    # Integer operands and results stay below this magnitude, so int64 sums
+    # and products are exact and convert to float64 exactly
+    INT_LIMIT = 2 ** 31
+    
+    def __init__(self, for_statement, next_line: int, assignments: List[tuple]):
+        self.for_statement = for_statement  # the FOR statement (by identity) on the FOR line
+        self.next_line = next_line          # execution continues after this line
+        self.slot = for_statement[5] if len(for_statement) > 5 else None  # None before resolution
+        # (array name, offset, node) in body order: A(I + offset) = node
+        self.assignments = assignments
+        self.arrays = sorted({name for name, _ in self.subscripts()})  # every array used
+        self.written = sorted({name for name, _, _ in assignments})
+    
+    def run(self, interp: 'BasicInterpreter', start, end, step) -> bool:
+        """Runs the loop with its FOR values; False if the engine has to run it"""
+        if not interp.running:
+            return False  # The FOR line reported an error; the loop must not run
+        if type(start) is not int or type(end) is not int or type(step) is not int or not step:
+            return False
+        # The body runs at least once, like execute_for/execute_next
+        trips = 1 + max(0, (end - start) // step)
+        last = start + (trips - 1) * step
+        limit = self.INT_LIMIT
+        if trips < self.MIN_TRIPS or abs(start) >= limit or abs(last + step) >= limit:
+            return False
+        
+        arrays = {}
+        for name in self.arrays:
+            array = interp.arrays.get(name)
+            if array is None or array.strings or len(array.bounds) != 1:
+                return False
+            arrays[name] = array
+        low, high = min(start, last), max(start, last)
+        for name, offset in self.subscripts():
+            if low + offset < 0 or high + offset > arrays[name].bounds[0]:
+                return False
+        
+        # Whole-array promotion: an array that gets a float element in the
+        # first pass reads as float from the second pass on
+        floats = {name for name, array in arrays.items() if array.floats}
+        values = interp.variables.values
+        changed = True
+        while changed:
+            changed = False
+            for name, _, node in self.assignments:
+                kind = self._kind(node, values, floats)
+                if kind is None:
+                    return False
+                if kind == 'float' and name not in floats:
+                    floats.add(name)
+                    changed = True
+        
+        # Work on copies, so nothing changes unless the whole loop succeeds
+        data = {name: array.vector() for name, array in arrays.items()}
+        for name in self.written:
+            data[name] = data[name].astype(numpy.float64 if name in floats else numpy.int64)
+        index = numpy.arange(trips, dtype=numpy.int64) * step + start
+        with numpy.errstate(all='ignore'):
+            for name, offset, node in self.assignments:
+                result = self._evaluate(node, values, data, floats, index)
+                if result is None:
+                    return False
+                data[name][index + offset] = result
+        
+        for name in self.written:
+            arrays[name].store_vector(data[name], name in floats)
+        values[self.slot] = last + step
+        return True
+    
+    def subscripts(self):
+        """Yields (array name, offset) for every element the body reads or writes"""
+        for name, offset, node in self.assignments:
+            yield name, offset
+            yield from self._reads(node)
+    
+    @classmethod
+    def _reads(cls, node):
+        if node[0] == 'array':
+            yield node[1], node[2]
+        elif node[0] == 'neg':
+            yield from cls._reads(node[1])
+        elif node[0] == 'binop':
+            yield from cls._reads(node[2])
+            yield from cls._reads(node[3])
+    
+    @classmethod
+    def _kind(cls, node, values, floats) -> Optional[str]:
+        """'int' or 'float' for a node's result; None if it is not numeric"""
+        node_type = node[0]
+        if node_type == 'number':
+            if type(node[1]) is float:
+                return 'float'
+            return 'int' if abs(node[1]) < cls.INT_LIMIT else None
+        if node_type == 'variable':
+            value = values[node[1]]
+            if type(value) is float:
+                return 'float'
+            return 'int' if type(value) is int and abs(value) < cls.INT_LIMIT else None
+        if node_type == 'index':
+            return 'int'
+        if node_type == 'array':
+            return 'float' if node[1] in floats else 'int'
+        if node_type == 'neg':
+            return cls._kind(node[1], values, floats)
+        left = cls._kind(node[2], values, floats)
+        right = cls._kind(node[3], values, floats)
+        if left is None or right is None:
+            return None
+        return 'float' if node[1] == '/' or 'float' in (left, right) else 'int'
+    
+    @classmethod
+    def _evaluate(cls, node, values, data, floats, index):
+        """Evaluates a node for all passes at once; None if a pass could fail or overflow"""
+        node_type = node[0]
+        if node_type == 'number':
+            return node[1]
+        if node_type == 'variable':
+            return values[node[1]]
+        if node_type == 'index':
+            return index
+        if node_type == 'array':
+            result = data[node[1]][index + node[2]]
+            return result.astype(numpy.float64) if node[1] in floats else result
+        if node_type == 'neg':
+            operand = cls._evaluate(node[1], values, data, floats, index)
+            return None if operand is None else -operand
+        
+        op = node[1]
+        left = cls._evaluate(node[2], values, data, floats, index)
+        right = cls._evaluate(node[3], values, data, floats, index)
+        if left is None or right is None:
+            return None
+        if op == '/':
+            if numpy.any(numpy.equal(right, 0)):
+                return None  # Division by zero is reported by the interpreter
+            return numpy.true_divide(left, right)
+        result = left + right if op == '+' else left - right if op == '-' else left * right
+        if numpy.asarray(result).dtype.kind == 'i' and numpy.any(numpy.abs(result) >= cls.INT_LIMIT):
+            return None
+        return result
+
+class LoopVectorizer:
+    """Finds FOR loops that VectorLoop can run as whole-array NumPy operations
+    
+    Candidates are loops paired by ProgramIndex.for_loops whose FOR and NEXT
+    lines hold nothing else, that nothing jumps into and whose body only
+    assigns array elements A(I + c) from +, -, *, /, negation, numbers,
+    variables, the loop variable I and array elements B(I + c). An array the
+    body writes is read and written at one offset only, so every pass works
+    on its own elements and the passes can run side by side.
+    """
+    
+    OPERATORS = ('+', '-', '*', '/')
+    
+    def __init__(self, index: ProgramIndex, builtin_functions: Dict[str, Any]):
+        self.index = index
+        self.builtin_functions = builtin_functions
+        self.entries = index.entry_lines()
+    
+    def is_candidate(self, statements: Dict[int, Any], for_line: int, next_line: int) -> bool:
+        """True if the loop would be vectorized; LoopOptimizer leaves such loops alone"""
+        return self._plan(statements, for_line, next_line) is not None
+    
+    def plans(self) -> Dict[int, VectorLoop]:
+        """Returns FOR line -> VectorLoop for the final (slot-resolved) statements"""
+        plans = {}
+        for for_line, next_line in self.index.loops:
+            plan = self._plan(self.index.statements, for_line, next_line)
+            if plan is not None:
+                plans[for_line] = plan
+        return plans
+    
+    def _plan(self, statements, for_line: int, next_line: int) -> Optional[VectorLoop]:
+        position = self.index.position
+        for_stmt, next_stmt = statements[for_line], statements[next_line]
+        if not (for_stmt and for_stmt[0] == 'FOR' and next_stmt and next_stmt[0] == 'NEXT'):
+            return None
+        body = self.index.line_numbers[position[for_line] + 1:position[next_line]]
+        if next_line in self.entries or any(line_num in self.entries for line_num in body):
+            return None
+        
+        var = for_stmt[1]
+        assignments = []
+        for line_num in body:
+            statement = statements[line_num]
+            subs = statement[1] if statement and statement[0] == 'MULTI_STATEMENT' else [statement]
+            for sub in subs:
+                if not sub or sub[0] == 'COMMENT':
+                    continue
+                if sub[0] != 'LET_ARRAY' or len(sub[2]) != 1 or sub[1].endswith('$'):
+                    return None
+                offset = self._offset(sub[2][0], var)
+                node = self._node(sub[3], var)
+                if offset is None or node is None:
+                    return None
+                assignments.append((sub[1], offset, node))
+        if not assignments:
+            return None
+        
+        # Arrays the body writes are read and written at a single offset
+        offsets = {}
+        for name, offset, _ in assignments:
+            offsets.setdefault(name, set()).add(offset)
+        for name, offset, node in assignments:
+            for read_name, read_offset in VectorLoop._reads(node):
+                if read_name in offsets:
+                    offsets[read_name].add(read_offset)
+        if any(len(found) > 1 for found in offsets.values()):
+            return None
+        
+        return VectorLoop(for_stmt, next_line, assignments)
+    
+    @staticmethod
+    def _is_var(expr, var: str) -> bool:
+        return bool(expr) and expr[0] == 'VARIABLE' and expr[1] == var
+    
+    def _offset(self, expr, var: str) -> Optional[int]:
+        """c for a subscript I, I + c, I - c or c + I; None otherwise"""
+        if self._is_var(expr, var):
+            return 0
+        if not expr or expr[0] != 'BINOP' or expr[2] not in ('+', '-'):
+            return None
+        left, op, right = expr[1], expr[2], expr[3]
+        if self._is_var(left, var) and right[0] == 'NUMBER' and type(right[1]) is int:
+            return right[1] if op == '+' else -right[1]
+        if op == '+' and self._is_var(right, var) and left[0] == 'NUMBER' and type(left[1]) is int:
+            return left[1]
+        return None
+    
+    def _node(self, expr, var: str):
+        """Translates an expression into a VectorLoop node; None if it cannot be vectorized"""
+        if not expr:
+            return None
+        expr_type = expr[0]
+        if expr_type == 'NUMBER':
+            return ('number', expr[1]) if type(expr[1]) in (int, float) else None
+        if expr_type == 'VARIABLE':
+            if expr[1] == var:
+                return ('index',)
+            # Slots exist once statements are resolved; candidates are checked before
+            return ('variable', expr[2] if len(expr) > 2 else None)
+        if expr_type == 'UNOP':
+            operand = self._node(expr[2], var)
+            if operand is None or expr[1] not in ('+', '-'):
+                return None
+            return ('neg', operand) if expr[1] == '-' else operand
+        if expr_type == 'BINOP':
+            if expr[2] not in self.OPERATORS:
+                return None
+            left, right = self._node(expr[1], var), self._node(expr[3], var)
+            if left is None or right is None:
+                return None
+            return ('binop', expr[2], left, right)
+        if expr_type == 'FUNCTION':
+            if expr[1] in self.builtin_functions or len(expr[2]) != 1 or expr[1].endswith('$'):
+                return None
+            offset = self._offset(expr[2][0], var)
+            return None if offset is None else ('array', expr[1], offset)
+        return None
+
+class ParallelLoop:
+    """A PARALLEL FOR loop whose passes run in worker processes (see ParallelPool)
+    
+    Built by ProgramIndex when the FOR and the NEXT each stand alone on their
+    line (as entered; the optimizer may add statements), the body neither
+    jumps out of the loop nor uses INPUT, RETURN, READ or RESTORE, and no
+    pass reads a variable that an earlier pass may have left behind
+    (S = S + I, see carried_variables); other PARALLEL FOR loops are plain
+    FOR loops. run() returns False, and the
+    engine runs the loop itself, for non-integer bounds, fewer than
+    MIN_TRIPS passes, fewer than two processes, and in graphics programs
+    before GRAPHICS opened the screen.
+    """
+    
+    MIN_TRIPS = 2
+    
+    def __init__(self, for_statement, for_line: int, next_line: int):
+        self.for_statement = for_statement  # the FOR statement (by identity) on the FOR line
+        self.for_line = for_line
+        self.next_line = next_line          # execution continues after this line
+        self.var = for_statement[1]
+    
+    @classmethod
+    def plan(cls, index: ProgramIndex, program: Dict[Any, Any], for_line: int,
+             next_line: int) -> Optional['ParallelLoop']:
+        """Returns the plan for a PARALLEL FOR loop, None if it can only run sequentially"""
+        statements = index.statements
+        # The workers put an END after the NEXT of the program as entered
+        if program[next_line][0][0] != 'NEXT':
+            return None
+        position = index.position
+        for line_num in index.line_numbers[position[for_line] + 1:position[next_line]]:
+            for stmt in ProgramIndex._flatten(statements[line_num]):
+                if stmt[0] in ('INPUT', 'RETURN', 'READ', 'RESTORE'):
+                    return None
+                if stmt[0] == 'GOTO':
+                    target = index.resolve_jump(stmt[1])
+                    if target is None or not for_line < target <= next_line:
+                        return None
+        if cls.carried_variables(index, for_line, next_line) != set():
+            return None  # Chunks would each start from the values before the loop
+        return cls(ProgramIndex.split_loop_line(statements[for_line], 'FOR')[1], for_line, next_line)
+    
+    @staticmethod
+    def carried_variables(index: ProgramIndex, for_line: int, next_line: int) -> Optional[set]:
+        """Variables a pass assigns and may read before assigning them; None if unknown
+        
+        The body is scanned in line order, subroutines where a GOSUB calls
+        them. An assignment only counts for the statements after it if it
+        runs in every pass: outside IF branches and WHILE loops, and before
+        the first GOTO. A GOTO in a subroutine makes the loop unknown.
+        """
+        statements = index.statements
+        position = index.position
+        assigned = set()
+        done = {ProgramIndex.split_loop_line(statements[for_line], 'FOR')[1][1]}
+        read_first = set()
+        jumped = False
+        whiles = 0
+        called = set()
+        
+        def read(node):
+            if isinstance(node, (tuple, list)):
+                if len(node) >= 2 and node[0] == 'VARIABLE' and node[1] not in done:
+                    read_first.add(node[1])
+                for child in node:
+                    read(child)
+        
+        def scan(stmt, always: bool) -> bool:
+            """False if the statement makes the body unknown"""
+            nonlocal jumped, whiles
+            if not stmt:
+                return True
+            cmd = stmt[0]
+            if cmd == 'MULTI_STATEMENT':
+                return all(scan(sub, always) for sub in stmt[1])
+            if cmd == 'IF':
+                read(stmt[1])
+                return scan(stmt[2], False) and (len(stmt) < 4 or scan(stmt[3], False))
+            read(stmt)
+            if cmd in ('LET', 'FOR'):
+                assigned.add(stmt[1])
+                if always and not jumped and not whiles:
+                    done.add(stmt[1])
+            elif cmd == 'WHILE':
+                whiles += 1
+            elif cmd == 'WEND':
+                whiles = max(0, whiles - 1)
+            elif cmd == 'GOTO':
+                jumped = True
+            elif cmd == 'GOSUB':
+                return call(stmt[1])
+            return True
+        
+        def call(target) -> bool:
+            target = index.resolve_jump(target)
+            if target is None or target in called:
+                return target is None  # A missing line is an error anyway; recursion: unknown
+            called.add(target)
+            for line_num in index.line_numbers[position[target]:]:
+                flat = list(ProgramIndex._flatten(statements[line_num]))
+                if any(stmt[0] == 'GOTO' for stmt in flat) or not scan(statements[line_num], False):
+                    return False
+                if any(stmt[0] == 'RETURN' for stmt in flat):
+                    break
+            called.discard(target)
+            return True
+        
+        for line_num in index.line_numbers[position[for_line] + 1:position[next_line]]:
+            if not scan(statements[line_num], True):
+                return None
+        return read_first & assigned
+    
+    def run(self, interp: 'BasicInterpreter', start, end, step) -> bool:
+        """Runs the loop in the worker processes; False if the engine has to run it"""
+        if not interp.running:
+            return False  # The FOR line reported an error; the loop must not run
+        if type(start) is not int or type(end) is not int or type(step) is not int or not step:
+            return False
+        # The body runs at least once, like execute_for/execute_next
+        trips = 1 + max(0, (end - start) // step)
+        pool = interp.parallel_pool
+        if trips < self.MIN_TRIPS or pool is None or pool.processes < 2:
+            return False
+        if interp.program_index.has_graphics and interp.graphics.screen is None:
+            return False
+        pool.run_loop(self, start, trips, step)
+        return True
+
+class RecordedOutput(OutputBuffer):
+    """PRINT output of a PARALLEL FOR worker: kept as (fg, bg, text) lines
+    
+    The main process prints them in loop order with the same colors.
+    """
+    
+    def __init__(self, color_manager: ColorManager):
+        super().__init__(color_manager, 'input')
+        self.lines = []
+    
+    def print_line(self, text: str = ''):
+        color_manager = self.color_manager
+        self.lines.append((color_manager.current_fg_color, color_manager.current_bg_color, text))
+
+class ParallelPool:
+    """The worker processes that run the PARALLEL FOR loops of one program run
+    
+    The multiprocessing pool is started by the first loop and stopped when
+    the program ends. Every worker keeps one BasicInterpreter per loop on the
+    loaded program, with the FOR line turned into a FOR over the variables
+    parallel_first, parallel_last and parallel_step (no BASIC program can
+    name them), and with a NEXT that sets parallel_done and ends the program
+    after the last of them.
+    run_loop() splits the passes into
+    contiguous chunks, CHUNKS_PER_PROCESS per process; each chunk starts from
+    the variables, arrays, READ position and colors at the FOR.
+    
+    Chunks are merged in loop order. Their PRINT output is printed in that
+    order, and a variable, array element, READ position or color gets the
+    value of the last chunk that changed it: what every pass assigns ends
+    up as after the last pass. A chunk only sees its own writes, so values
+    carried from pass to pass (sums, counters) are not combined.
+    
+    Workers draw into a multiprocessing.shared_memory framebuffer that starts
+    as a copy of the screen; the main process presents it while it waits.
+    Each chunk also records a DisplayList: at the end the screen is restored
+    and the lists are replayed in loop order, so pixels that two chunks
+    draw come out as in a sequential run. An error, END or STOP in a chunk
+    ends the program after the chunks before it are merged.
+    """
+    
+    CHUNKS_PER_PROCESS = 4
+    # Seconds between presenting the shared framebuffer while the workers run
+    PREVIEW_INTERVAL = 0.1
+    
+    # State of a worker process (see _start_worker)
+    _program = None
+    _engine = None
+    _optimize = True
+    _interpreters = {}  # FOR line -> BasicInterpreter
+    _framebuffers = {}  # Shared memory name -> (SharedMemory, surface)
+    
+    def __init__(self, interpreter: 'BasicInterpreter', engine: str):
+        self.interp = interpreter
+        self.engine = engine
+        processes = interpreter.processes
+        if processes is None:
+            setting = os.environ.get('CROSSBASIC_PROCESSES', '')
+            processes = int(setting) if setting.isdigit() else os.cpu_count() or 1
+        self.processes = processes
+        self.pool = None
+        self.shared = None   # SharedMemory of the framebuffer
+        self.surface = None  # pygame surface on self.shared
+    
+    def close(self):
+        """Stops the worker processes and frees the shared framebuffer"""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self._free_framebuffer()
+    
+    def _free_framebuffer(self):
+        if self.shared is not None:
+            self.surface = None  # The surface holds the buffer, which has to be released first
+            self.shared.close()
+            self.shared.unlink()
+            self.shared = None
+    
+    @staticmethod
+    def _surface(shared, size):
+        """Returns a pygame surface whose pixels are the shared memory"""
+        width, height = size
+        return pygame.image.frombuffer(shared.buf[:width * height * 4], size, 'RGBX')
+    
+    def _framebuffer(self, graphics: GraphicsEngine) -> Optional[tuple]:
+        """Copies the screen into the shared framebuffer; returns (name, width, height), None without a screen"""
+        if graphics.screen is None:
+            return None
+        from multiprocessing import shared_memory
+        size = graphics.screen.get_size()
+        if self.surface is None or self.surface.get_size() != size:
+            self._free_framebuffer()
+            self.shared = shared_memory.SharedMemory(create=True, size=size[0] * size[1] * 4)
+            self.surface = self._surface(self.shared, size)
+        graphics.copy_to(self.surface)
+        return (self.shared.name,) + size
+    
+    def run_loop(self, loop: ParallelLoop, start: int, trips: int, step: int):
+        """Runs all passes of a loop in the workers and merges the chunks into the interpreter"""
+        import multiprocessing
+        interp = self.interp
+        graphics = interp.graphics
+        colors = interp.color_manager
+        if self.pool is None:
+            # Workers share the parent's resource tracker, so attaching to the
+            # framebuffer does not make them remove it when they exit
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+            program = {line_num: value for line_num, value in interp.program.items()
+                       if isinstance(line_num, int)}
+            self.pool = multiprocessing.Pool(self.processes, ParallelPool._start_worker,
+                                             (program, self.engine, interp.optimize))
+        
+        framebuffer = self._framebuffer(graphics)
+        preview = framebuffer is not None and not graphics.headless and graphics.auto_flip
+        before = self.surface.copy() if preview else None
+        state = (interp.variables.copy(), dict(interp.arrays), interp.data_pointer,
+                 graphics.color_index, (colors.current_fg_color, colors.current_bg_color))
+        chunks = min(trips, self.processes * self.CHUNKS_PER_PROCESS)
+        tasks = []
+        for number in range(chunks):
+            first = trips * number // chunks
+            last = trips * (number + 1) // chunks - 1
+            tasks.append((loop.for_line, loop.next_line, loop.var,
+                          start + first * step, start + last * step, step, framebuffer) + state)
+        
+        # imap returns the chunks in task order, whatever order they finish in: when
+        # several chunks fail, the one that starts first reports its error, as in
+        # a sequential run, and the chunks after it are never merged
+        results = self.pool.imap(ParallelPool._run_chunk, tasks)
+        display_lists = []
+        color_index = None
+        for _ in tasks:
+            while preview:
+                try:
+                    result = results.next(self.PREVIEW_INTERVAL)
+                    break
+                except multiprocessing.TimeoutError:
+                    graphics.copy_from(self.surface)
+                    graphics.present()
+                    graphics.pump_events()
+            else:
+                result = next(results)
+            completed, display_list, chunk_color = self._merge(result)
+            if display_list is not None:
+                display_lists.append(display_list)
+            if chunk_color is not None:
+                color_index = chunk_color
+            if not completed:
+                interp.running = False
+                break
+        
+        if before is not None:
+            graphics.copy_from(before)
+        for display_list in display_lists:
+            graphics.replay(display_list)
+        if color_index is not None:
+            graphics.set_color(color_index)
+    
+    def _merge(self, result: tuple) -> tuple:
+        """Merges one chunk into the interpreter; returns (completed, DisplayList, color index)"""
+        (completed, lines, messages, last_error, variables, arrays, data_pointer, color_index,
+         text_colors, display_list) = result
+        interp = self.interp
+        colors = interp.color_manager
+        print_line = interp.output.print_line
+        for fg, bg, text in lines:
+            colors.current_fg_color = fg
+            colors.current_bg_color = bg
+            print_line(text)
+        if messages:
+            interp.output.release()
+            sys.stdout.write(messages)
+        if last_error is not None:
+            interp.last_error = last_error
+        if text_colors is not None:
+            colors.current_fg_color, colors.current_bg_color = text_colors
+        interp.variables.update(variables)
+        for name, change in arrays.items():
+            if isinstance(change, BasicArray):
+                interp.arrays[name] = change
+                continue
+            floats, elements = change
+            array = interp.arrays[name]
+            if floats:
+                array.promote()
+            data = array.data
+            for offset, value in elements:
+                data[offset] = value
+        if data_pointer is not None:
+            interp.data_pointer = data_pointer
+        return completed, display_list, color_index
+    
+    # Worker side
+    
+    @classmethod
+    def _start_worker(cls, program: Dict[int, Any], engine: str, optimize: bool):
+        """Pool initializer: keeps the program for the worker's interpreters"""
+        cls._program = program
+        cls._engine = engine
+        cls._optimize = optimize
+        cls._interpreters = {}
+        cls._framebuffers = {}
+        random.seed()  # Forked workers would all continue the same RND sequence
+    
+    @classmethod
+    def _worker(cls, for_line: int, next_line: int) -> 'BasicInterpreter':
+        """Returns the worker's interpreter for a loop, creating it on first use"""
+        interp = cls._interpreters.get(for_line)
+        if interp is None:
+            program = dict(cls._program)
+            statement, *rest = program[for_line]
+            var = statement[1][1]
+            first, last, step = (('VARIABLE', name)
+                                 for name in ('parallel_first', 'parallel_last', 'parallel_step'))
+            program[for_line] = (('FOR', var, first, last, step), *rest)
+            # IF (var + step - last) * step <= 0 THEN NEXT ELSE parallel_done = 1: END
+            # stops after the chunk's last pass
+            statement, *rest = program[next_line]
+            more = ('BINOP', ('BINOP', ('BINOP', ('VARIABLE', var), '+', step), '-', last), '*', step)
+            done = ('MULTI_STATEMENT', [('LET', 'parallel_done', ('NUMBER', 1)), ('END',)])
+            program[next_line] = (('IF', ('BINOP', more, '<=', ('NUMBER', 0)), statement, done), *rest)
+            interp = BasicInterpreter()
+            interp.program = program
+            interp.optimize = cls._optimize
+            interp.output = RecordedOutput(interp.color_manager)
+            interp.graphics = GraphicsEngine(headless=True, threaded=False)
+            cls._interpreters[for_line] = interp
+        return interp
+    
+    @classmethod
+    def _attach(cls, framebuffer: tuple):
+        """Returns a surface on the shared framebuffer (name, width, height)"""
+        name, width, height = framebuffer
+        entry = cls._framebuffers.get(name)
+        if entry is None:
+            from multiprocessing import shared_memory
+            load_pygame()
+            shared = shared_memory.SharedMemory(name=name)
+            entry = cls._framebuffers[name] = (shared, cls._surface(shared, (width, height)))
+        return entry[1]
+    
+    @classmethod
+    def _run_chunk(cls, task: tuple) -> tuple:
+        """Runs the passes first..last of a loop in a worker; returns what _merge() needs"""
+        (for_line, next_line, var, first, last, step, framebuffer,
+         variables, arrays, data_pointer, color_index, text_colors) = task
+        interp = cls._worker(for_line, next_line)
+        interp.variables = variables
+        interp.variables.update(parallel_first=first, parallel_last=last, parallel_step=step)
+        originals = {name: (array.bounds, array.floats, array.data[:]) for name, array in arrays.items()}
+        interp.arrays.clear()
+        interp.arrays.update(arrays)
+        interp.data_pointer = data_pointer
+        interp.for_stack.clear()
+        interp.while_stack.clear()
+        interp.call_stack.clear()
+        colors = interp.color_manager
+        colors.current_fg_color, colors.current_bg_color = text_colors
+        interp.output.lines = []
+        graphics = interp.graphics
+        if framebuffer is not None:
+            graphics.attach(cls._attach(framebuffer))
+        graphics.set_color(color_index)
+        if framebuffer is not None:
+            graphics.start_recording()
+        
+        messages = io.StringIO()
+        with contextlib.redirect_stdout(messages):
+            interp.running = True
+            interp.last_error = None
+            interp.current_line = for_line
+            interp.goto_executed = False
+            try:
+                interp._run_engine(interp.program_index, cls._engine)
+            except Exception as e:
+                interp.error(str(e))
+            finally:
+                interp.running = False
+                interp.output.release()
+        display_list = graphics.stop_recording()
+        graphics._unlock()
+        # Anything but the END on the NEXT line (error, END, STOP) ends the program
+        completed = interp.variables.get('parallel_done') == 1
+        if completed:
+            interp.variables[var] += step  # What the NEXT that ends the loop does
+        
+        # Only what the chunk changed goes back
+        changed = {}
+        for name, value in interp.variables.copy().items():
+            if name.startswith('parallel_'):
+                continue
+            # A variable the chunk assigned for the first time counts even if it is 0
+            old = variables.get(name, UNSET)
+            if old is UNSET or type(value) is not type(old) or value != old:
+                changed[name] = value
+        changed_arrays = {}
+        for name, array in interp.arrays.items():
+            original = originals.get(name)
+            if original is None or original[0] != array.bounds:
+                changed_arrays[name] = array
+                continue
+            # Equal values stay unchanged when the chunk made the array float
+            elements = [(offset, value) for offset, (value, old) in enumerate(zip(array.data, original[2]))
+                        if value != old]
+            if elements or array.floats != original[1]:
+                changed_arrays[name] = (array.floats, elements)
+        final_colors = (colors.current_fg_color, colors.current_bg_color)
+        return (completed, interp.output.lines, messages.getvalue(), interp.last_error,
+                changed, changed_arrays,
+                interp.data_pointer if interp.data_pointer != data_pointer else None,
+                graphics.color_index if graphics.color_index != color_index else None,
+                final_colors if final_colors != text_colors else None,
+                display_list)
+
+class LineProfiler:
+    """Execution counts and times per line of a profiled run (RUN PROFILE)
+    
+    BasicInterpreter.run(profile=True) steps through the program with a
+    main loop of its own that times every line with perf_counter; unprofiled
+    runs use the engines' loops unchanged. Time spent in GraphicsEngine
+    calls is booked separately, per line, by timing the engine's drawing
+    methods for the duration of the run. vm and python have no lines to
+    time: their runs are profiled with the closure engine, and the report
+    names both.
+    """
+    
+    GRAPHICS_METHODS = ('init_graphics', 'reset', 'clear_screen', 'set_color', 'plot_point', 'point',
+                        'draw_line', 'draw_circle', 'draw_rect', 'present', 'pump_events', 'sync')
+    HOT_LINES = 20
+    
+    def __init__(self, engine: str, requested: str = None):
+        self.engine = engine        # the engine whose statements were timed: 'tree' or 'closure'
+        self.requested = requested or engine  # the engine the run was started with
+        self.counts = {}            # line -> executions
+        self.times = {}             # line -> seconds, graphics included
+        self.graphics_times = {}    # line -> seconds in GraphicsEngine calls; None: after the last line
+        self.line = None            # the line being timed
+        self.total = 0.0            # seconds the whole run took
+        self._depth = 0             # nesting of timed graphics calls
+    
+    def instrument(self, graphics: 'GraphicsEngine'):
+        """Times the drawing methods of graphics until restore()"""
+        for name in self.GRAPHICS_METHODS:
+            setattr(graphics, name, self._timed(getattr(graphics, name)))
+    
+    def restore(self, graphics: 'GraphicsEngine'):
+        for name in self.GRAPHICS_METHODS:
+            graphics.__dict__.pop(name, None)
+    
+    def _timed(self, method):
+        graphics_times = self.graphics_times
+        clock = time.perf_counter
+        
+        def timed(*args, **kwargs):
+            if self._depth:
+                return method(*args, **kwargs)  # Already timed by the outer call
+            self._depth = 1
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._depth = 0
+                graphics_times[self.line] = graphics_times.get(self.line, 0.0) + clock() - start
+        return timed
+    
+    def report(self, interp: 'BasicInterpreter', limit: int = None) -> str:
+        """Returns the hot-line table: the lines that took longest first, shown as entered"""
+        limit = limit or self.HOT_LINES
+        executed = sum(self.counts.values())
+        timed = sum(self.times.values())
+        graphics = sum(self.graphics_times.values())
+        share = graphics / self.total if self.total else 0.0
+        engine = f"{self.engine} engine"
+        if self.requested != self.engine:
+            engine += f", {self.requested} requested"
+        lines = [f"Profile ({engine}): {executed:,} lines executed in {self.total:.3f} s, "
+                 f"graphics {graphics:.3f} s ({share:.1%})",
+                 f"{'Line':>7} {'Count':>11} {'Time s':>9} {'Time %':>7} {'Graphics s':>11}  Statement"]
+        hot = sorted(self.times, key=self.times.get, reverse=True)[:limit]
+        for line_num in hot:
+            entry = interp.program.get(line_num)
+            source = interp.format_statement(entry[0]) if entry else ''
+            seconds = self.times[line_num]
+            lines.append(f"{line_num:>7} {self.counts[line_num]:>11,} {seconds:>9.3f} "
+                         f"{seconds / timed if timed else 0.0:>7.1%} "
+                         f"{self.graphics_times.get(line_num, 0.0):>11.3f}  {source}")
+        if len(self.times) > limit:
+            lines.append(f"({len(self.times) - limit} more lines)")
+        final = self.graphics_times.get(None)
+        if round(final or 0.0, 3):
+            lines.append(f"Graphics outside the lines (start, final present): {final:.3f} s")
+        return '\n'.join(lines)
+
+class Tracer:
+    """Calls the hooks registered with BasicInterpreter.add_hook while a program runs
+    
+    install() puts instrumented versions of the interpreter's dispatch
+    methods (and of the GraphicsEngine drawing methods) on the instances;
+    uninstall() removes them again. Only runs with hooks pay for them:
+    they use the tree engine, which dispatches every statement through
+    execute_statement, and run vectorized and PARALLEL FOR loops pass by
+    pass. Hidden optimizer variables (%1, ...) are not reported.
+    """
+    
+    GRAPHICS_METHODS = ('init_graphics', 'clear_screen', 'set_color', 'plot_point', 'draw_line',
+                        'draw_circle', 'draw_rect', 'present')
+    JUMPS = ('GOTO', 'GOSUB', 'RETURN')
+    
+    def __init__(self, interp: 'BasicInterpreter'):
+        self.interp = interp
+        self.hooks = {event: list(hooks) for event, hooks in interp.hooks.items()}
+        self._patched = []      # (object, method name) to remove in uninstall()
+        self._loop_plans = None
+        self._drawing = False   # a graphics hook call is in progress
+    
+    def install(self, index: ProgramIndex):
+        interp = self.interp
+        hooks = self.hooks
+        if hooks['statement']:
+            self._patch(interp, 'execute_statement', self._statement)
+        if hooks['jump']:
+            for command in self.JUMPS:
+                self._patch(interp, f'execute_{command.lower()}', self._jump(command))
+        if hooks['variable']:
+            for name in ('execute_let', 'execute_for', 'execute_next', 'execute_input',
+                         'execute_read', 'set_array_element'):
+                self._patch(interp, name, getattr(self, f'_{name}'))
+        if hooks['graphics']:
+            for name in self.GRAPHICS_METHODS:
+                self._patch(interp.graphics, name, self._graphics(name))
+        # Every pass of every loop is traced
+        self._loop_plans = index.loop_plans
+        index.loop_plans = {}
+    
+    def uninstall(self, index: ProgramIndex):
+        for target, name in self._patched:
+            target.__dict__.pop(name, None)
+        self._patched.clear()
+        if self._loop_plans is not None:
+            index.loop_plans = self._loop_plans
+            self._loop_plans = None
+    
+    def _patch(self, target, name: str, make):
+        setattr(target, name, make(getattr(target, name)))
+        self._patched.append((target, name))
+    
+    def _statement(self, execute_statement):
+        interp = self.interp
+        hooks = self.hooks['statement']
+        
+        def traced(statement):
+            if statement and statement[0] != 'MULTI_STATEMENT':
+                for hook in hooks:
+                    hook(interp.current_line, statement)
+            execute_statement(statement)
+        return traced
+    
+    def _jump(self, command: str):
+        interp = self.interp
+        hooks = self.hooks['jump']
+        
+        def make(execute):
+            def traced(statement):
+                from_line = interp.current_line
+                execute(statement)
+                if interp.running:
+                    # The line that runs next (RETURN resumes after the GOSUB line)
+                    to_line = (interp.current_line if interp.goto_executed
+                               else interp.program_index.line_after(interp.current_line))
+                    for hook in hooks:
+                        hook(command, from_line, to_line)
+            return traced
+        return make
+    
+    def _assigned(self, name: str, value, subscripts=None):
+        if not name.startswith('%'):
+            for hook in self.hooks['variable']:
+                hook(name, value, subscripts)
+    
+    def _execute_let(self, execute):
+        interp = self.interp
+        
+        def traced(statement):
+            execute(statement)
+            if interp.running:
+                self._assigned(statement[1], interp._values[statement[3]])
+        return traced
+    
+    def _execute_input(self, execute):
+        interp = self.interp
+        
+        def traced(statement):
+            execute(statement)
+            if interp.running:
+                self._assigned(statement[2], interp._values[statement[3]])
+        return traced
+    
+    def _execute_for(self, execute):
+        interp = self.interp
+        
+        def traced(statement):
+            execute(statement)
+            if interp.running:
+                self._assigned(statement[1], interp._values[statement[5]])
+        return traced
+    
+    def _execute_next(self, execute):
+        interp = self.interp
+        
+        def traced(statement):
+            frame = interp.for_stack[-1] if interp.for_stack else None
+            execute(statement)
+            if frame is not None:
+                self._assigned(frame.var, interp._values[frame.slot])
+        return traced
+    
+    def _execute_read(self, execute):
+        interp = self.interp
+        
+        def traced(statement):
+            first = interp.data_pointer
+            execute(statement)
+            # Array elements are reported by set_array_element
+            for target in statement[1][:interp.data_pointer - first]:
+                if target[0] == 'VARIABLE':
+                    self._assigned(target[1], interp._values[target[2]])
+        return traced
+    
+    def _set_array_element(self, set_element):
+        interp = self.interp
+        
+        def traced(name, subscripts, value):
+            set_element(name, subscripts, value)
+            if interp.running:
+                self._assigned(name, interp.arrays[name].get(subscripts), tuple(subscripts))
+        return traced
+    
+    def _graphics(self, name: str):
+        hooks = self.hooks['graphics']
+        
+        def make(method):
+            def traced(*args):
+                if self._drawing:
+                    return method(*args)  # Called by another drawing method
+                self._drawing = True
+                try:
+                    for hook in hooks:
+                        hook(name, args)
+                    return method(*args)
+                finally:
+                    self._drawing = False
+            return traced
+        return make
 
 class BasicInterpreter:
     """BASIC-Interpreter"""
     
+    # Available execution engines: 'tree' walks the statement tuples directly,
+    # 'closure' compiles every statement once into Python closures (ClosureCompiler),
+    # 'vm' compiles the whole program into bytecode for a stack machine (BasicVM),
+    # 'python' transpiles the whole program into one Python function (PythonTranspiler)
+    ENGINES = ('tree', 'closure', 'vm', 'python')
+    
+    # Window events are handled while a program runs: every EVENT_CHECK_STATEMENTS
+    # statements (loop passes and jumps in the compiled engines) the clock is
+    # read, and events are pumped if EVENT_INTERVAL seconds have passed
+    EVENT_CHECK_STATEMENTS = 1000
+    EVENT_INTERVAL = 0.02
+    # Kinds of events add_hook() can observe
+    HOOK_EVENTS = ('statement', 'jump', 'variable', 'graphics')
+    
     def __init__(self):
-        self.variables = {}
+        self._variables = VariableStore()
+        self._values = self._variables.values  # Slot-indexed values, shared with the store
+        self.data_pointer = 0  # Next value READ takes from ProgramIndex.data
+        self.arrays = {}  # DIM arrays by name (see BasicArray); the dict object is never replaced
         self.program = {}
         self.current_line = 0
         self.running = False
@@ -1046,8 +4029,22 @@ class BasicInterpreter:
         self.while_stack = []
         self.graphics = GraphicsEngine()
         self.color_manager = ColorManager()
+        # PRINT output; engines bind output.print_line, so the object is never replaced
+        self.output = OutputBuffer(self.color_manager)
         self.goto_executed = False  # Flag to track GOTO execution
         self._last_operation_results = {}  # Track add/overwrite operations
+        self._program_index = None  # Run-time line index, rebuilt after program changes
+        self.engine = 'tree'  # Default execution engine, see ENGINES
+        self.count_lines = False  # 'vm' engine: count executions per line (see line_counts)
+        self.line_counts = {}
+        self.optimize = True  # Fold constants before execution (see ExpressionOptimizer)
+        self._next_event_pump = 0.0  # time.monotonic() of the next poll_events() that pumps
+        # PARALLEL FOR worker processes; None: CROSSBASIC_PROCESSES or one per CPU
+        self.processes = None
+        self.parallel_pool = None  # ParallelPool of the running program, if it has PARALLEL FOR
+        self.last_error = None  # message of the runtime error that ended the last run, if any
+        self.profiler = None  # LineProfiler of the last run(profile=True)
+        self.hooks = {event: [] for event in self.HOOK_EVENTS}  # see add_hook
         
         # Built-in functions
         self.builtin_functions = {
@@ -1062,21 +4059,52 @@ class BasicInterpreter:
             'CHR': lambda x: chr(int(x)),
             'ASC': lambda s: ord(str(s)[0]) if str(s) else 0,
             'TIME': lambda: time.time(),
+            'POINT': lambda x, y: self.graphics.point(x, y),
         }
     
     def error(self, message: str):
         """Fehlerbehandlung"""
+        self.output.release()
         print(f"Runtime Error at line {self.current_line}: {message}")
+        self.last_error = message
         self.running = False
     
     def clear_program(self):
         """Clears the loaded program"""
         self.program = {}
         self.variables = {}
+        self.arrays.clear()
         self.call_stack = []
         self.for_stack = []
         self.while_stack = []
         self._last_operation_results = {}
+        self.invalidate_program_index()
+    
+    @property
+    def variables(self) -> VariableStore:
+        """The program's variables; a mapping from name to value"""
+        return self._variables
+    
+    @variables.setter
+    def variables(self, values: Dict[str, Any]):
+        # Keep the store (and its slots): only the values are replaced
+        if values is self._variables:
+            return
+        values = dict(values)
+        self._variables.clear()
+        self._variables.update(values)
+    
+    @property
+    def program_index(self) -> ProgramIndex:
+        """Returns the run-time line index, building it if the program or optimize changed"""
+        if self._program_index is None or self._program_index.optimized != self.optimize:
+            optimizer = ExpressionOptimizer(self.builtin_functions) if self.optimize else None
+            self._program_index = ProgramIndex(self.program, self._variables, optimizer)
+        return self._program_index
+    
+    def invalidate_program_index(self):
+        """Discards the run-time line index after the program was modified"""
+        self._program_index = None
     
     def get_last_line_operation(self, line_number: int) -> str:
         """Get the result of the last operation for a specific line number"""
@@ -1108,6 +4136,7 @@ class BasicInterpreter:
                 ]
             # Track the deletion operation
             self._last_operation_results[line_number] = 'deleted'
+            self.invalidate_program_index()
             return True
         return False
     
@@ -1164,6 +4193,7 @@ class BasicInterpreter:
                     
                     # Track the update operation
                     self._last_operation_results[actual_line_number] = 'updated'
+                    self.invalidate_program_index()
                     return True
                 else:
                     # Empty statement - delete the line
@@ -1232,65 +4262,234 @@ class BasicInterpreter:
                     else:
                         self._last_operation_results[key] = 'added'
             
+            self.invalidate_program_index()
             return True
         except Exception as e:
             print(f"Error loading program: {e}")
             return False
     
-    def run(self):
-        """Executes the loaded program"""
+    def add_hook(self, event: str, hook):
+        """Calls hook for every event of a kind (HOOK_EVENTS) in the programs run from now on
+        
+        - 'statement': hook(line_num, statement) before each statement (the run-time tuple)
+        - 'jump': hook(command, from_line, to_line) after each GOTO, GOSUB and RETURN;
+          to_line is the line that runs next, None if the program ends
+        - 'variable': hook(name, value, subscripts) after a variable (subscripts None)
+          or an array element is assigned
+        - 'graphics': hook(method, args) before each GraphicsEngine drawing call
+        
+        Runs with hooks use the tree engine (see Tracer): run() with another
+        engine prints a notice and runs the tree engine instead. An exception
+        in a hook ends the program like a runtime error.
+        """
+        if event not in self.HOOK_EVENTS:
+            raise ValueError(f"Unknown hook event: {event} (available: {', '.join(self.HOOK_EVENTS)})")
+        self.hooks[event].append(hook)
+    
+    def remove_hook(self, event: str, hook):
+        """Removes a hook added with add_hook"""
+        self.hooks[event].remove(hook)
+    
+    def run(self, engine: str = None, profile: bool = False):
+        """Executes the loaded program; with profile, times every line (see profiler)"""
+        self.profiler = None
         if not self.program:
             print("No program loaded")
             return
         
-        # Prüfen ob das Programm Grafik-Befehle enthält
-        has_graphics = any(
-            isinstance(stmt, tuple) and len(stmt) > 0 and 
-            stmt[0] in ['GRAPHICS', 'PLOT', 'LINE', 'CIRCLE', 'RECT', 'COLOR', 'PSET', 'CLS']
-            for key, value in self.program.items() 
-            if key != '__lines__' and isinstance(value, tuple) and len(value) >= 3
-            for stmt, _, _ in [value]  # Extract statement from tuple
-        )
+        engine = engine or self.engine
+        if engine not in self.ENGINES:
+            print(f"Unknown engine: {engine} (available: {', '.join(self.ENGINES)})")
+            return
+        
+        tracer = None
+        if any(self.hooks.values()):
+            # Hooks need every statement dispatched through execute_statement
+            tracer = Tracer(self)
+            if engine != 'tree':
+                print(f"Hooks are registered: running the tree engine instead of {engine}")
+                engine = 'tree'
+        
+        profiler = None
+        if profile:
+            # vm and python have no line-by-line dispatch to time: their lines run as closures
+            profiler = LineProfiler(engine if engine in ('tree', 'closure') else 'closure', engine)
+            profiler.instrument(self.graphics)
+            started = time.perf_counter()
+            self.profiler = profiler
+        
+        # Line index is built once per program change, not on every step
+        index = self.program_index
         
         # Grafikfenster zurücksetzen falls es bereits läuft und das Programm Grafik verwendet
-        if has_graphics and self.graphics.running:
+        if index.has_graphics and self.graphics.running:
             print("Resetting graphics window...")
             self.graphics.reset()
         
         self.running = True
-        numeric_keys = [k for k in self.program.keys() if isinstance(k, int)]
-        self.current_line = min(numeric_keys) if numeric_keys else 0
+        self.last_error = None
+        self.current_line = index.first_line if index.first_line is not None else 0
         self.goto_executed = False  # Flag to track if GOTO was executed
-        
+        self.data_pointer = 0
+        self.graphics.set_auto_flip(True, GraphicsEngine.DEFAULT_FPS)
+        if index.parallel_loops:
+            # Worker processes are only started when a PARALLEL FOR runs
+            self.parallel_pool = ParallelPool(self, engine)
+        
+        if tracer is not None:
+            tracer.install(index)
         try:
-            while self.running and self.current_line in self.program:
-                if self.current_line == '__lines__':
-                    # Skip the special __lines__ entry - this shouldn't happen since current_line should be numeric
-                    numeric_keys = [k for k in self.program.keys() if isinstance(k, int) and k > self.current_line]
-                    if numeric_keys:
-                        self.current_line = min(numeric_keys)
-                    else:
-                        break
-                    continue
-                    
-                statement, _, _ = self.program[self.current_line]  # Extract statement, ignore had_line_number and position
-                self.goto_executed = False  # Reset flag before executing statement
-                self.execute_statement(statement)
-                
-                if self.running and not self.goto_executed:
-                    # Only advance to next line if GOTO wasn't executed
-                    numeric_keys = [k for k in self.program.keys() if isinstance(k, int) and k > self.current_line]
-                    if numeric_keys:
-                        self.current_line = min(numeric_keys)
-                    else:
-                        break
+            if profiler is not None:
+                self._run_profiled(index, profiler)
+            else:
+                self._run_engine(index, engine)
         
         except KeyboardInterrupt:
+            self.output.release()
             print("\nProgram interrupted")
         except Exception as e:
             self.error(str(e))
         finally:
-            self.running = False
+            self.running = False
+            self.output.release()
+            self._variables.clear_hidden()
+            if self.parallel_pool is not None:
+                self.parallel_pool.close()
+                self.parallel_pool = None
+            self.graphics.present()
+            if profiler is not None:
+                profiler.total = time.perf_counter() - started
+                profiler.restore(self.graphics)
+            if tracer is not None:
+                tracer.uninstall(index)
+    
+    def _run_engine(self, index: ProgramIndex, engine: str):
+        """Runs the program from current_line with one of the ENGINES"""
+        if engine == 'closure':
+            self._run_compiled(index, self._get_closure_code(index))
+        elif engine == 'vm':
+            self._run_vm(index)
+        elif engine == 'python':
+            self._run_python(index)
+        else:
+            self._run_tree(index)
+    
+    def poll_events(self) -> int:
+        """Pumps window events if EVENT_INTERVAL has passed; returns the statements until the next check"""
+        now = time.monotonic()
+        if now >= self._next_event_pump:
+            self._next_event_pump = now + self.EVENT_INTERVAL
+            self.graphics.pump_events()
+        return self.EVENT_CHECK_STATEMENTS
+    
+    def _run_tree(self, index: ProgramIndex, stop_lines: Dict[int, Any] = None) -> Optional[int]:
+        """Tree-walking main loop: dispatches each statement tuple through execute_statement
+        
+        With stop_lines, returns as soon as the next line to run is one of them
+        (used by the 'python' engine to resume its own code); otherwise runs to the end.
+        """
+        statements = index.statements
+        next_line = index.next_line
+        countdown = self.EVENT_CHECK_STATEMENTS
+        while self.running and self.current_line in statements:
+            self.goto_executed = False  # Reset flag before executing statement
+            self.execute_statement(statements[self.current_line])
+            countdown -= 1
+            if not countdown:
+                countdown = self.poll_events()
+            
+            if self.running and not self.goto_executed:
+                # Only advance to next line if GOTO wasn't executed
+                following = next_line[self.current_line]
+                if following is None:
+                    break
+                self.current_line = following
+            
+            if stop_lines is not None and self.running and self.current_line in stop_lines:
+                return self.current_line
+        return None
+    
+    def _run_compiled(self, index: ProgramIndex, code: Dict[int, Any]):
+        """Main loop for the closure engine: same line stepping, precompiled statements"""
+        next_line = index.next_line
+        fn = code.get(self.current_line)
+        countdown = self.EVENT_CHECK_STATEMENTS
+        while self.running and fn is not None:
+            self.goto_executed = False
+            fn()
+            countdown -= 1
+            if not countdown:
+                countdown = self.poll_events()
+            
+            if self.running and not self.goto_executed:
+                following = next_line[self.current_line]
+                if following is None:
+                    break
+                self.current_line = following
+            fn = code.get(self.current_line)
+    
+    def _run_profiled(self, index: ProgramIndex, profiler: LineProfiler):
+        """Main loop of a profiled run: the line stepping of _run_tree/_run_compiled, timed per line"""
+        statements = index.statements
+        next_line = index.next_line
+        code = self._get_closure_code(index) if profiler.engine == 'closure' else None
+        counts = profiler.counts
+        times = profiler.times
+        clock = time.perf_counter
+        countdown = self.EVENT_CHECK_STATEMENTS
+        try:
+            while self.running and self.current_line in statements:
+                line_num = profiler.line = self.current_line
+                start = clock()
+                self.goto_executed = False
+                if code is None:
+                    self.execute_statement(statements[line_num])
+                else:
+                    code[line_num]()
+                countdown -= 1
+                if not countdown:
+                    countdown = self.poll_events()
+                times[line_num] = times.get(line_num, 0.0) + clock() - start
+                counts[line_num] = counts.get(line_num, 0) + 1
+                
+                if self.running and not self.goto_executed:
+                    following = next_line[self.current_line]
+                    if following is None:
+                        break
+                    self.current_line = following
+        finally:
+            profiler.line = None
+    
+    def _get_closure_code(self, index: ProgramIndex) -> Dict[int, Any]:
+        """Returns the compiled closures for the program, compiling them on first use"""
+        # Closures bind the slot list of the variable store, which is never replaced
+        code = index.compiled.get('closure')
+        if code is None:
+            code = index.compiled['closure'] = ClosureCompiler(self).compile_program(index)
+        return code
+    
+    def _run_vm(self, index: ProgramIndex):
+        """Runs the program as bytecode on the stack machine"""
+        key = 'vm+counts' if self.count_lines else 'vm'
+        program = index.compiled.get(key)
+        if program is None:
+            program = BytecodeCompiler(self, count_lines=self.count_lines).compile(index)
+            index.compiled[key] = program
+        
+        program.counts[:] = [0] * len(program.counts)
+        try:
+            BasicVM(self, program).run(program.line_pc.get(self.current_line, program.halt_pc))
+        finally:
+            if self.count_lines:
+                self.line_counts = program.line_counts()
+    
+    def _run_python(self, index: ProgramIndex):
+        """Runs the program as transpiled Python code"""
+        program = index.compiled.get('python')
+        if program is None:
+            program = PythonTranspiler(self).compile_program(index)
+            index.compiled['python'] = program
+        program.run(self, self.current_line)
     
     def execute_statement(self, statement):
         """Executes a statement"""
@@ -1303,6 +4502,14 @@ class BasicInterpreter:
             self.execute_print(statement)
         elif cmd == 'LET':
             self.execute_let(statement)
+        elif cmd == 'LET_ARRAY':
+            self.execute_let_array(statement)
+        elif cmd == 'DIM':
+            self.execute_dim(statement)
+        elif cmd == 'READ':
+            self.execute_read(statement)
+        elif cmd == 'RESTORE':
+            self.execute_restore(statement)
         elif cmd == 'INPUT':
             self.execute_input(statement)
         elif cmd == 'IF':
@@ -1345,10 +4552,14 @@ class BasicInterpreter:
             self.execute_textbg(statement)
         elif cmd == 'RESETCOLOR':
             self.execute_resetcolor(statement)
+        elif cmd == 'FLIP':
+            self.execute_flip(statement)
+        elif cmd == 'AUTOFLIP':
+            self.execute_autoflip(statement)
         elif cmd == 'MULTI_STATEMENT':
             self.execute_multi_statement(statement)
-        elif cmd == 'COMMENT':
-            pass  # Kommentare ignorieren
+        elif cmd in ('COMMENT', 'DATA'):
+            pass  # Kommentare ignorieren; DATA wird beim Laden gesammelt
         else:
             self.error(f"Unknown command: {cmd}")
     
@@ -1364,8 +4575,7 @@ class BasicInterpreter:
         elif expr_type == 'STRING':
             return expr[1]
         elif expr_type == 'VARIABLE':
-            var_name = expr[1]
-            return self.variables.get(var_name, 0)
+            return self._values[expr[2]]  # Slot attached by ProgramIndex
         elif expr_type == 'BINOP':
             left = self.evaluate_expression(expr[1])
             op = expr[2]
@@ -1378,6 +4588,8 @@ class BasicInterpreter:
         elif expr_type == 'FUNCTION':
             func_name = expr[1]
             args = [self.evaluate_expression(arg) for arg in expr[2]]
+            if func_name not in self.builtin_functions and func_name in self.arrays:
+                return self.get_array_element(func_name, args)
             return self.call_function(func_name, args)
         else:
             self.error(f"Unknown expression type: {expr_type}")
@@ -1467,7 +4679,7 @@ class BasicInterpreter:
         
         if not items:
             # Empty PRINT statement just prints a newline
-            print()
+            self.output.print_line()
             return
         
         output_parts = []
@@ -1491,21 +4703,95 @@ class BasicInterpreter:
                 if i < len(items) - 1:
                     output_parts.append(' ')
         
-        # Apply current text colors to the output
-        output_text = ''.join(output_parts)
-        colored_output = self.color_manager.colorize_text(output_text)
-        print(colored_output)
+        # Ausgabe in den aktuellen Textfarben (gepuffert, siehe OutputBuffer)
+        self.output.print_line(''.join(output_parts))
     
     def execute_let(self, statement):
         """Führt LET-Statement aus"""
-        var_name = statement[1]
         value = self.evaluate_expression(statement[2])
-        self.variables[var_name] = value
+        if value is UNSET:
+            value = 0  # Y = X assigns Y even if X is unset
+        self._values[statement[3]] = value
+    
+    def execute_let_array(self, statement):
+        """Executes an assignment to an array element: A(I) = expr"""
+        subscripts = [self.evaluate_expression(index) for index in statement[2]]
+        value = self.evaluate_expression(statement[3])
+        self.set_array_element(statement[1], subscripts, value)
+    
+    def execute_dim(self, statement):
+        """Executes DIM: creates (or re-creates) arrays filled with 0"""
+        for name, sizes in statement[1]:
+            bounds = [self.evaluate_expression(size) for size in sizes]
+            text = ', '.join(str(bound) for bound in bounds)
+            if name in self.builtin_functions:
+                self.error(f"Illegal array name: {name}")
+                return
+            if any(isinstance(bound, str) or bound < 0 for bound in bounds):
+                self.error(f"Illegal array size: {name}({text})")
+                return
+            try:
+                self.arrays[name] = BasicArray(name, [int(bound) for bound in bounds])
+            except (MemoryError, ValueError, OverflowError):
+                self.error(f"Out of memory: {name}({text})")
+                return
+    
+    def get_array_element(self, name: str, subscripts):
+        """Returns an array element, or reports the error and returns 0"""
+        array = self.arrays.get(name)
+        if array is None:
+            self.error(f"Unknown function: {name}")
+            return 0
+        try:
+            return array.get(subscripts)
+        except (IndexError, TypeError, ValueError, OverflowError) as e:
+            self.error(str(e))
+            return 0
+    
+    def set_array_element(self, name: str, subscripts, value):
+        """Stores an array element, or reports the error"""
+        array = self.arrays.get(name)
+        if array is None:
+            self.error(f"Array not dimensioned: {name}")
+            return
+        try:
+            array.set(subscripts, value)
+        except (IndexError, TypeError, ValueError, OverflowError) as e:
+            self.error(str(e))
+    
+    def execute_read(self, statement):
+        """Executes READ: assigns the next DATA values to variables or array elements"""
+        data = self.program_index.data
+        for target in statement[1]:
+            if self.data_pointer >= len(data):
+                self.error("Out of DATA")
+                return
+            value = data[self.data_pointer]
+            self.data_pointer += 1
+            if target[0] == 'VARIABLE':
+                self._values[target[2]] = value
+            else:
+                subscripts = [self.evaluate_expression(index) for index in target[2]]
+                self.set_array_element(target[1], subscripts, value)
+                if not self.running:
+                    return
+    
+    def execute_restore(self, statement):
+        """Executes RESTORE: the next READ starts at the first DATA value (of the given line or later)"""
+        if statement[1] is None:
+            self.data_pointer = 0
+            return
+        offset = self.program_index.data_offsets.get(statement[1])
+        if offset is None:
+            self.error(f"Line {statement[1]} not found")
+            return
+        self.data_pointer = offset
     
     def execute_input(self, statement):
         """Executes INPUT statement"""
         prompt = statement[1]
-        var_name = statement[2]
+        self.output.release()  # The prompt follows all output so far
+        self.graphics.present()
         
         if prompt:
             user_input = input(prompt + " ")
@@ -1521,7 +4807,7 @@ class BasicInterpreter:
         except ValueError:
             value = user_input  # Treat as string
         
-        self.variables[var_name] = value
+        self._values[statement[3]] = value
     
     def execute_if(self, statement):
         """Führt IF-Statement aus"""
@@ -1540,16 +4826,22 @@ class BasicInterpreter:
         """Führt FOR-Statement aus"""
         var_name = statement[1]
         start_value = self.evaluate_expression(statement[2])
+        if start_value is UNSET:
+            start_value = 0
         end_value = self.evaluate_expression(statement[3])
         step_value = self.evaluate_expression(statement[4])
         
-        self.variables[var_name] = start_value
-        self.for_stack.append({
-            'var': var_name,
-            'end': end_value,
-            'step': step_value,
-            'line': self.current_line
-        })
+        # Reine Array-Schleife (NumPy) oder PARALLEL FOR: ganze Schleife ausführen, weiter nach NEXT
+        index = self._program_index
+        plan = index.loop_plans.get(self.current_line) if index is not None else None
+        if (plan is not None and plan.for_statement is statement
+                and plan.run(self, start_value, end_value, step_value)):
+            self.current_line = plan.next_line
+            return
+        
+        self._values[statement[5]] = start_value
+        self.for_stack.append(ForFrame(var_name, statement[5], start_value, end_value, step_value,
+                                       self.current_line))
     
     def execute_next(self, statement):
         """Führt NEXT-Statement aus"""
@@ -1557,22 +4849,23 @@ class BasicInterpreter:
             self.error("NEXT without FOR")
             return
         
-        for_info = self.for_stack[-1]
-        var_name = for_info['var']
-        end_value = for_info['end']
-        step_value = for_info['step']
-        for_line = for_info['line']
+        frame = self.for_stack[-1]
         
         # Variable erhöhen
-        current_value = self.variables.get(var_name, 0)
-        new_value = current_value + step_value
-        self.variables[var_name] = new_value
-        
-        # Prüfen ob Schleife weiterlaufen soll
-        if ((step_value > 0 and new_value <= end_value) or 
-            (step_value < 0 and new_value >= end_value)):
+        new_value = self._values[frame.slot] + frame.step
+        self._values[frame.slot] = new_value
+        
+        # Prüfen ob Schleife weiterlaufen soll (Integer-Zähler: nur eine Grenze)
+        direction = frame.direction
+        if direction > 0:
+            more = new_value <= frame.end
+        elif direction:
+            more = new_value >= frame.end
+        else:
+            more = frame.more(new_value)
+        if more:
             # Zurück zur FOR-Zeile
-            self.current_line = for_line
+            self.current_line = frame.line
         else:
             # Schleife beenden
             self.for_stack.pop()
@@ -1593,7 +4886,7 @@ class BasicInterpreter:
             return
         
         while_line = self.while_stack[-1]
-        while_stmt, _, _ = self.program[while_line]  # Extract statement, ignore had_line_number and position
+        while_stmt = self.program_index.statements[while_line]  # Run-time (optimized) statement
         condition = self.evaluate_expression(while_stmt[1])
         
         if condition:
@@ -1604,43 +4897,31 @@ class BasicInterpreter:
             self.while_stack.pop()
     
     def find_matching_wend(self):
-        """Findet das entsprechende WEND zu einem WHILE"""
-        while_count = 1
-        current = self.current_line
-        
-        for line_num in sorted([k for k in self.program.keys() if isinstance(k, int)]):
-            if line_num <= current:
-                continue
-            
-            stmt, _, _ = self.program[line_num]  # Extract statement, ignore had_line_number and position
-            if stmt[0] == 'WHILE':
-                while_count += 1
-            elif stmt[0] == 'WEND':
-                while_count -= 1
-                if while_count == 0:
-                    self.current_line = line_num
-                    return
-        
-        self.error("WHILE without matching WEND")
+        """Findet das entsprechende WEND zu einem WHILE (Tabelle im ProgramIndex)"""
+        wend_line = self.program_index.matching_wend(self.current_line)
+        if wend_line is not None:
+            self.current_line = wend_line
+        else:
+            self.error("WHILE without matching WEND")
     
     def execute_goto(self, statement):
         """Executes GOTO statement"""
-        target_line = statement[1]
-        if target_line in self.program:
+        target_line = self.program_index.resolve_jump(statement[1])
+        if target_line is not None:
             self.current_line = target_line
             self.goto_executed = True  # Set flag to prevent automatic line advancement
         else:
-            self.error(f"Line {target_line} not found")
+            self.error(f"Line {statement[1]} not found")
     
     def execute_gosub(self, statement):
         """Executes GOSUB statement"""
-        target_line = statement[1]
-        if target_line in self.program:
+        target_line = self.program_index.resolve_jump(statement[1])
+        if target_line is not None:
             self.call_stack.append(self.current_line)
             self.current_line = target_line
             self.goto_executed = True  # Set flag to prevent automatic line advancement
         else:
-            self.error(f"Line {target_line} not found")
+            self.error(f"Line {statement[1]} not found")
     
     def execute_return(self, statement):
         """Führt RETURN-Statement aus"""
@@ -1650,9 +4931,9 @@ class BasicInterpreter:
         
         return_line = self.call_stack.pop()
         # Zur nächsten Zeile nach GOSUB gehen
-        numeric_keys = [k for k in self.program.keys() if isinstance(k, int) and k > return_line]
-        if numeric_keys:
-            self.current_line = min(numeric_keys)
+        resume_line = self.program_index.resume_line(return_line)
+        if resume_line is not None:
+            self.current_line = resume_line
         else:
             self.running = False
     
@@ -1661,7 +4942,8 @@ class BasicInterpreter:
         if self.graphics.running:
             self.graphics.clear_screen()
         else:
-            # Konsole löschen
+            # Konsole löschen (vorher gepufferte Ausgabe schreiben)
+            self.output.release()
             os.system('cls' if os.name == 'nt' else 'clear')
     
     def execute_graphics(self, statement):
@@ -1723,6 +5005,22 @@ class BasicInterpreter:
         """Execute RESETCOLOR statement - resets text colors to default"""
         self.color_manager.set_text_color(1, 0)  # White on black (default)
     
+    def execute_flip(self, statement):
+        """Executes FLIP: shows everything drawn since the last presentation"""
+        self.graphics.present()
+    
+    def execute_autoflip(self, statement):
+        """Executes AUTOFLIP ON, AUTOFLIP OFF or AUTOFLIP fps"""
+        mode = statement[1]
+        if mode == 'FPS':
+            fps = self.evaluate_expression(statement[2])
+            try:
+                self.graphics.set_auto_flip(True, fps)
+            except ValueError as e:
+                self.error(str(e))
+        else:
+            self.graphics.set_auto_flip(mode == 'ON')
+    
     def execute_multi_statement(self, statement):
         """Execute multiple statements from a single line"""
         _, statements = statement
@@ -1801,6 +5099,31 @@ class BasicInterpreter:
                     return f"LET {self.format_expression(statement[1])} = {self.format_expression(statement[2])}"
                 return ' '.join(map(str, statement))
             
+            elif command == 'LET_ARRAY':
+                # Zuweisung an ein Array-Element
+                subscripts = ', '.join(self.format_expression(index) for index in statement[2])
+                return f"LET {statement[1]}({subscripts}) = {self.format_expression(statement[3])}"
+            
+            elif command == 'DIM':
+                # DIM Statement
+                arrays = ', '.join(f"{name}({', '.join(self.format_expression(size) for size in sizes)})"
+                                   for name, sizes in statement[1])
+                return f"DIM {arrays}"
+            
+            elif command == 'DATA':
+                # DATA Statement: Strings in Anführungszeichen
+                values = ', '.join(f'"{value}"' if isinstance(value, str) else str(value)
+                                   for value in statement[1])
+                return f"DATA {values}"
+            
+            elif command == 'READ':
+                # READ Statement
+                return f"READ {', '.join(self.format_expression(target) for target in statement[1])}"
+            
+            elif command == 'RESTORE':
+                # RESTORE Statement
+                return "RESTORE" if statement[1] is None else f"RESTORE {statement[1]}"
+            
             elif command == 'IF':
                 # IF Statement formatieren
                 result = ['IF']
@@ -1834,6 +5157,9 @@ class BasicInterpreter:
                     return result
                 return ' '.join(map(str, statement))
             
+            elif command == 'PARALLEL':
+                return f"PARALLEL {self.format_statement(statement[1])}"
+            
             elif command in ['GOTO', 'GOSUB']:
                 # GOTO/GOSUB Statement formatieren
                 if len(statement) > 1:
@@ -1878,6 +5204,25 @@ class BasicInterpreter:
                 # RESETCOLOR Statement
                 return "RESETCOLOR"
             
+            elif command == 'FLIP':
+                return "FLIP"
+            
+            elif command == 'AUTOFLIP':
+                # AUTOFLIP ON/OFF oder Bildrate
+                if statement[1] == 'FPS':
+                    return f"AUTOFLIP {self.format_expression(statement[2])}"
+                return f"AUTOFLIP {statement[1]}"
+            
+            elif command == 'WHILE':
+                return f"WHILE {self.format_expression(statement[1])}"
+            
+            elif command == 'LINE':
+                x1, y1, x2, y2 = (self.format_expression(arg) for arg in statement[1:5])
+                return f"LINE {x1}, {y1} TO {x2}, {y2}"
+            
+            elif command in ('PLOT', 'CIRCLE', 'RECT'):
+                return f"{command} {', '.join(self.format_expression(arg) for arg in statement[1:])}"
+            
             elif command == 'PSET':
                 # PSET Statement
                 if len(statement) >= 3:
@@ -1937,7 +5282,7 @@ class BasicInterpreter:
                 op = expr[2]
                 right = self.format_expression(expr[3])
                 return f"({left} {op} {right})"
-            elif len(expr) == 3 and expr[0] == 'FUNCTION':
+            elif len(expr) == 3 and expr[0] == 'FUNCTION' and not expr[2]:
                 # Funktionsaufruf ohne Argumente
                 func_name = expr[1]
                 return f"{func_name}()"
@@ -1964,6 +5309,1872 @@ class BasicInterpreter:
             # Primitiver Wert
             return str(expr)
 
+class ClosureCompiler:
+    """Compiles parsed statements into trees of Python closures (the 'closure' engine)
+    
+    Every statement tuple is translated once into a function without arguments.
+    Operators, built-in functions and variable accesses are resolved at compile
+    time, so the run loop no longer dispatches on node type strings. Runtime
+    semantics (error messages, 1/0 truth values, line stepping) are identical
+    to the tree-walking interpreter.
+    """
+    
+    # Source templates for binary operators. {a}/{b} are replaced with the code
+    # for the operand kind: constant, variable lookup or nested closure call.
+    _ARITHMETIC_TEMPLATE = '''
+def factory(L, R, error, values):
+    def binop():
+        try:
+            return {a} {op} {b}
+        except Exception as e:
+            error(f"Error in binary operation: {{e}}")
+            return 0
+    return binop
+'''
+    _DIVISION_TEMPLATE = '''
+def factory(L, R, error, values):
+    def binop():
+        a = {a}
+        b = {b}
+        if b == 0:
+            error("{message}")
+            return 0
+        try:
+            return a {op} b
+        except Exception as e:
+            error(f"Error in binary operation: {{e}}")
+            return 0
+    return binop
+'''
+    _COMPARISON_TEMPLATE = '''
+def factory(L, R, error, values):
+    def binop():
+        try:
+            return 1 if {a} {op} {b} else 0
+        except Exception as e:
+            error(f"Error in binary operation: {{e}}")
+            return 0
+    return binop
+'''
+    _LOGICAL_TEMPLATE = '''
+def factory(L, R, error, values):
+    def binop():
+        a = {a}
+        b = {b}
+        return 1 if a {op} b else 0
+    return binop
+'''
+    _OPERAND_CODE = {'const': '{name}', 'var': 'values[{name}]', 'call': '{name}()'}
+    
+    # BASIC operator -> (template, Python operator, division error message)
+    _BINARY_OPERATORS = {
+        '+': ('_ARITHMETIC_TEMPLATE', '+', None),
+        '-': ('_ARITHMETIC_TEMPLATE', '-', None),
+        '*': ('_ARITHMETIC_TEMPLATE', '*', None),
+        '^': ('_ARITHMETIC_TEMPLATE', '**', None),
+        '/': ('_DIVISION_TEMPLATE', '/', 'Division by zero'),
+        'MOD': ('_DIVISION_TEMPLATE', '%', 'Division by zero in MOD operation'),
+        '=': ('_COMPARISON_TEMPLATE', '==', None),
+        '<>': ('_COMPARISON_TEMPLATE', '!=', None),
+        '!=': ('_COMPARISON_TEMPLATE', '!=', None),
+        '<': ('_COMPARISON_TEMPLATE', '<', None),
+        '>': ('_COMPARISON_TEMPLATE', '>', None),
+        '<=': ('_COMPARISON_TEMPLATE', '<=', None),
+        '>=': ('_COMPARISON_TEMPLATE', '>=', None),
+        'AND': ('_LOGICAL_TEMPLATE', 'and', None),
+        'OR': ('_LOGICAL_TEMPLATE', 'or', None),
+    }
+    
+    # Generated operator factories, shared by all compilers
+    _factories = {}
+    
+    # Statements compiled as a call to the matching BasicInterpreter.execute_* method
+    _DELEGATED = ('INPUT', 'GOTO', 'GOSUB', 'RETURN', 'CLS', 'GRAPHICS', 'LINE',
+                  'CIRCLE', 'RECT', 'TEXTCOLOR', 'TEXTBG', 'RESETCOLOR', 'DIM', 'READ', 'RESTORE',
+                  'FLIP', 'AUTOFLIP')
+    
+    def __init__(self, interpreter: 'BasicInterpreter'):
+        self.interp = interpreter
+        self.values = interpreter.variables.values
+        # Compiled WHILE conditions by line number, used by WEND
+        self.while_conditions = {}
+        self.loop_plans = {}  # FOR line -> VectorLoop/ParallelLoop of the program being compiled
+    
+    def compile_program(self, index: ProgramIndex) -> Dict[int, Any]:
+        """Compiles every line of the program; returns line number -> closure"""
+        self.loop_plans = index.loop_plans
+        return {
+            line_num: self.compile_statement(statement, line_num)
+            for line_num, statement in index.statements.items()
+        }
+    
+    @classmethod
+    def _binop_factory(cls, op: str, left_kind: str, right_kind: str):
+        """Returns (and caches) the closure factory for an operator and operand kinds"""
+        key = (op, left_kind, right_kind)
+        factory = cls._factories.get(key)
+        if factory is None:
+            template_name, py_op, message = cls._BINARY_OPERATORS[op]
+            source = getattr(cls, template_name).format(
+                a=cls._OPERAND_CODE[left_kind].format(name='L'),
+                b=cls._OPERAND_CODE[right_kind].format(name='R'),
+                op=py_op, message=message)
+            namespace = {}
+            exec(source, namespace)
+            factory = cls._factories[key] = namespace['factory']
+        return factory
+    
+    def _operand(self, expr):
+        """Classifies an operand as ('const', value), ('var', slot) or ('call', closure)"""
+        if not expr:
+            return 'const', 0
+        if expr[0] in ('NUMBER', 'STRING'):
+            return 'const', expr[1]
+        if expr[0] == 'VARIABLE':
+            return 'var', expr[2]
+        return 'call', self.compile_expression(expr)
+    
+    def compile_expression(self, expr):
+        """Compiles an expression tuple into a closure returning its value"""
+        interp = self.interp
+        error = interp.error
+        if not expr:
+            return lambda: 0
+        
+        expr_type = expr[0]
+        
+        if expr_type in ('NUMBER', 'STRING'):
+            value = expr[1]
+            return lambda: value
+        elif expr_type == 'VARIABLE':
+            slot = expr[2]
+            values = self.values
+            return lambda: values[slot]
+        elif expr_type == 'BINOP':
+            op = expr[2]
+            if op not in self._BINARY_OPERATORS:
+                def unknown_binop():
+                    error(f"Unknown binary operator: {op}")
+                    return 0
+                return unknown_binop
+            left_kind, left = self._operand(expr[1])
+            right_kind, right = self._operand(expr[3])
+            factory = self._binop_factory(op, left_kind, right_kind)
+            return factory(left, right, error, self.values)
+        elif expr_type == 'UNOP':
+            return self._compile_unary(expr[1], self.compile_expression(expr[2]))
+        elif expr_type == 'FUNCTION':
+            return self._compile_call(expr[1], [self.compile_expression(arg) for arg in expr[2]])
+        else:
+            def unknown_expression():
+                error(f"Unknown expression type: {expr_type}")
+                return 0
+            return unknown_expression
+    
+    def _compile_unary(self, op: str, operand):
+        """Compiles a unary operator applied to a compiled operand"""
+        error = self.interp.error
+        if op == '-':
+            def negate():
+                value = operand()
+                try:
+                    return -value
+                except Exception as e:
+                    error(f"Error in unary operation: {e}")
+                    return 0
+            return negate
+        elif op == '+':
+            def plus():
+                value = operand()
+                try:
+                    return +value
+                except Exception as e:
+                    error(f"Error in unary operation: {e}")
+                    return 0
+            return plus
+        elif op == 'NOT':
+            return lambda: 1 if not operand() else 0
+        else:
+            def unknown_unop():
+                operand()
+                error(f"Unknown unary operator: {op}")
+                return 0
+            return unknown_unop
+    
+    def _compile_call(self, func_name: str, args: List[Any]):
+        """Compiles a built-in function call; the function object is bound now"""
+        error = self.interp.error
+        func = self.interp.builtin_functions.get(func_name)
+        
+        if func is None:
+            # Not a built-in function: an array element (or "Unknown function")
+            get_element = self.interp.get_array_element
+            def array_element():
+                return get_element(func_name, [arg() for arg in args])
+            return array_element
+        
+        if not args:
+            def call0():
+                try:
+                    return func()
+                except Exception as e:
+                    error(f"Error calling function {func_name}: {e}")
+                    return 0
+            return call0
+        elif len(args) == 1:
+            arg0 = args[0]
+            def call1():
+                value = arg0()
+                try:
+                    return func(value)
+                except Exception as e:
+                    error(f"Error calling function {func_name}: {e}")
+                    return 0
+            return call1
+        else:
+            def call():
+                values = [arg() for arg in args]
+                try:
+                    return func(*values)
+                except Exception as e:
+                    error(f"Error calling function {func_name}: {e}")
+                    return 0
+            return call
+    
+    def compile_statement(self, statement, line_num: int = None):
+        """Compiles a statement tuple into a closure that executes it"""
+        interp = self.interp
+        if not statement:
+            return lambda: None
+        
+        cmd = statement[0]
+        handler = getattr(self, f'_compile_{cmd.lower()}', None)
+        if handler is not None:
+            return handler(statement, line_num)
+        
+        if cmd in ('COMMENT', 'DATA'):
+            return lambda: None  # Kommentare ignorieren; DATA wird beim Laden gesammelt
+        
+        # Statements without a hot path run through the interpreter's own execute_* method
+        if cmd in self._DELEGATED:
+            method = getattr(interp, f'execute_{cmd.lower()}')
+            return lambda: method(statement)
+        
+        def unknown_command():
+            interp.error(f"Unknown command: {cmd}")
+        return unknown_command
+    
+    def _compile_let(self, statement, line_num):
+        values = self.values
+        slot = statement[3]
+        kind, value = self._operand(statement[2])
+        if kind == 'const':
+            def let_const():
+                values[slot] = value
+            return let_const
+        if kind == 'var':
+            source = value
+            def let_var():
+                value = values[source]
+                values[slot] = 0 if value is UNSET else value
+            return let_var
+        expr = value
+        def let():
+            values[slot] = expr()
+        return let
+    
+    def _compile_print(self, statement, line_num):
+        interp = self.interp
+        items = [self.compile_expression(item) for item in statement[1]]
+        separators = statement[2] if len(statement) > 2 else []
+        
+        print_line = interp.output.print_line
+        if not items:
+            return lambda: print_line()
+        
+        # Text appended after each item, as in execute_print
+        suffixes = []
+        for i in range(len(items)):
+            if i < len(separators):
+                sep = separators[i]
+                suffixes.append('' if sep == ';' else '    ' if sep == ',' else ' ')
+            else:
+                suffixes.append(' ' if i < len(items) - 1 else '')
+        parts = list(zip(items, suffixes))
+        
+        def print_items():
+            print_line(''.join([str(item()) + suffix for item, suffix in parts]))
+        return print_items
+    
+    def _compile_if(self, statement, line_num):
+        condition = self.compile_expression(statement[1])
+        then_stmt = self.compile_statement(statement[2]) if statement[2] else None
+        else_part = statement[3] if len(statement) > 3 else None
+        else_stmt = self.compile_statement(else_part) if else_part else None
+        
+        if else_stmt is None:
+            def if_then():
+                if condition():
+                    if then_stmt is not None:
+                        then_stmt()
+            return if_then
+        
+        def if_then_else():
+            if condition():
+                if then_stmt is not None:
+                    then_stmt()
+            else:
+                else_stmt()
+        return if_then_else
+    
+    def _compile_multi_statement(self, statement, line_num):
+        interp = self.interp
+        # Only a FOR needs its line (to find the loop plan); a WHILE in a line is not registered
+        compiled = [self.compile_statement(sub_statement,
+                                           line_num if sub_statement and sub_statement[0] == 'FOR' else None)
+                    for sub_statement in statement[1]]
+        
+        def multi_statement():
+            for sub_statement in compiled:
+                if interp.running:  # Check if we should continue (e.g., no END or GOTO executed)
+                    sub_statement()
+                else:
+                    break
+        return multi_statement
+    
+    def _compile_let_array(self, statement, line_num):
+        set_element = self.interp.set_array_element
+        name = statement[1]
+        subscripts = [self.compile_expression(index) for index in statement[2]]
+        expr = self.compile_expression(statement[3])
+        
+        def let_array():
+            values = [subscript() for subscript in subscripts]
+            set_element(name, values, expr())
+        return let_array
+    
+    def _compile_for(self, statement, line_num):
+        interp = self.interp
+        values = self.values
+        for_stack = interp.for_stack
+        var_name, slot = statement[1], statement[5]
+        start = self.compile_expression(statement[2])
+        end = self.compile_expression(statement[3])
+        step = self.compile_expression(statement[4])
+        
+        plan = self.loop_plans.get(line_num)
+        if plan is not None and plan.for_statement is statement:
+            next_line = plan.next_line
+            
+            def planned_loop():
+                start_value = start()
+                if start_value is UNSET:
+                    start_value = 0
+                end_value = end()
+                step_value = step()
+                if plan.run(interp, start_value, end_value, step_value):
+                    interp.current_line = next_line
+                    return
+                values[slot] = start_value
+                for_stack.append(ForFrame(var_name, slot, start_value, end_value, step_value,
+                                          interp.current_line))
+            return planned_loop
+        
+        def for_loop():
+            start_value = start()
+            if start_value is UNSET:
+                start_value = 0
+            end_value = end()
+            step_value = step()
+            values[slot] = start_value
+            for_stack.append(ForFrame(var_name, slot, start_value, end_value, step_value,
+                                      interp.current_line))
+        return for_loop
+    
+    def _compile_next(self, statement, line_num):
+        interp = self.interp
+        values = self.values
+        for_stack = interp.for_stack
+        
+        def next_loop():
+            if not for_stack:
+                interp.error("NEXT without FOR")
+                return
+            
+            frame = for_stack[-1]
+            slot = frame.slot
+            new_value = values[slot] + frame.step
+            values[slot] = new_value
+            
+            direction = frame.direction
+            if direction > 0:
+                more = new_value <= frame.end
+            elif direction:
+                more = new_value >= frame.end
+            else:
+                more = frame.more(new_value)
+            if more:
+                interp.current_line = frame.line
+            else:
+                for_stack.pop()
+        return next_loop
+    
+    def _compile_while(self, statement, line_num):
+        interp = self.interp
+        condition = self.compile_expression(statement[1])
+        if line_num is not None:
+            self.while_conditions[line_num] = condition
+        
+        def while_loop():
+            if not condition():
+                interp.find_matching_wend()
+            else:
+                interp.while_stack.append(interp.current_line)
+        return while_loop
+    
+    def _compile_wend(self, statement, line_num):
+        interp = self.interp
+        while_conditions = self.while_conditions
+        
+        def wend():
+            if not interp.while_stack:
+                interp.error("WEND without WHILE")
+                return
+            
+            while_line = interp.while_stack[-1]
+            condition = while_conditions.get(while_line)
+            if condition is None:
+                # WHILE not compiled as a line of its own, use the interpreter
+                interp.execute_wend(statement)
+            elif condition():
+                interp.current_line = while_line
+            else:
+                interp.while_stack.pop()
+        return wend
+    
+    def _compile_end(self, statement, line_num):
+        interp = self.interp
+        def end():
+            interp.running = False
+        return end
+    
+    def _compile_color(self, statement, line_num):
+        interp = self.interp
+        color = self.compile_expression(statement[1])
+        def set_color():
+            interp.graphics.set_color(int(color()))
+        return set_color
+    
+    def _compile_pset(self, statement, line_num):
+        interp = self.interp
+        x = self.compile_expression(statement[1])
+        y = self.compile_expression(statement[2])
+        def pset():
+            x_value = x()
+            interp.graphics.plot_point(x_value, y())
+        return pset
+    
+    _compile_plot = _compile_pset
+
+class Op:
+    """Opcodes of the CrossBasic bytecode (see BytecodeCompiler and BasicVM)"""
+    LOAD_VAR = 0
+    LOAD_CONST = 1
+    STORE_VAR = 2
+    ADD = 3
+    SUB = 4
+    MUL = 5
+    DIV = 6
+    MOD = 7
+    POW = 8
+    CMP_EQ = 9
+    CMP_NE = 10
+    CMP_LT = 11
+    CMP_GT = 12
+    CMP_LE = 13
+    CMP_GE = 14
+    AND = 15
+    OR = 16
+    NEG = 17
+    POS = 18
+    NOT = 19
+    CALL = 20
+    JUMP = 21
+    JUMP_IF_FALSE = 22
+    FOR = 23
+    NEXT = 24
+    WHILE = 25
+    WEND = 26
+    WEND_TEST = 27
+    GOSUB = 28
+    RETURN = 29
+    PRINT = 30
+    COLOR = 31
+    PSET = 32
+    EXEC = 33
+    EXEC_LINE = 34
+    ERROR = 35
+    COUNT = 36
+    HALT = 37
+    ARRAY_GET = 38
+    ARRAY_SET = 39
+    COPY_VAR = 40
+    # Superinstructions: the right operand is a variable slot or a constant
+    ADD_VAR = 41
+    SUB_VAR = 42
+    MUL_VAR = 43
+    ADD_CONST = 44
+    SUB_CONST = 45
+    MUL_CONST = 46
+    COMPARE_JUMP = 47  # IF with a comparison: test and jump in one instruction
+    
+    NAMES = {}
+    
+    BINARY = {
+        '+': ADD, '-': SUB, '*': MUL, '/': DIV, 'MOD': MOD, '^': POW,
+        '=': CMP_EQ, '<>': CMP_NE, '!=': CMP_NE, '<': CMP_LT, '>': CMP_GT,
+        '<=': CMP_LE, '>=': CMP_GE, 'AND': AND, 'OR': OR,
+    }
+    UNARY = {'-': NEG, '+': POS, 'NOT': NOT}
+    # Operator -> (opcode with a variable operand, opcode with a constant operand)
+    OPERAND = {'+': (ADD_VAR, ADD_CONST), '-': (SUB_VAR, SUB_CONST), '*': (MUL_VAR, MUL_CONST)}
+    COMPARISONS = {
+        '=': operator.eq, '<>': operator.ne, '!=': operator.ne, '<': operator.lt,
+        '>': operator.gt, '<=': operator.le, '>=': operator.ge,
+    }
+
+Op.NAMES = {value: name for name, value in vars(Op).items() if isinstance(value, int)}
+
+class BytecodeProgram:
+    """A program compiled to linear bytecode: flat [opcode, argument, ...] list"""
+    
+    def __init__(self, code: List[Any], line_pc: Dict[int, int], halt_pc: int,
+                 index: ProgramIndex, counted_lines: List[int] = None):
+        self.code = code
+        self.line_pc = line_pc        # line number -> pc of its first instruction
+        self.halt_pc = halt_pc        # pc of the final HALT
+        self.index = index
+        # Sorted line start pcs, to map a pc back to its line for error messages
+        self._line_starts = sorted((pc, line_num) for line_num, pc in line_pc.items())
+        self._start_pcs = [pc for pc, _ in self._line_starts]
+        self._return_pc = {}
+        self.retest_pc = {}           # WHILE line -> pc of its condition, for WEND
+        self.boundaries = []          # pcs of statements following a ':' inside a line
+        self._guarded_code = None
+        # Profiling counters, one per line, filled by COUNT instructions
+        self.counted_lines = counted_lines or []
+        self.counts = [0] * len(self.counted_lines)
+        self.variable_names = []      # slot -> variable name, for disassemble
+    
+    def line_at(self, pc: int) -> int:
+        """Returns the line number the instruction at pc belongs to"""
+        i = bisect.bisect_right(self._start_pcs, pc) - 1
+        return self._line_starts[i][1] if i >= 0 else 0
+    
+    def pc_after_line(self, line_num: int) -> int:
+        """Returns the pc execution continues at when line_num completes normally"""
+        following = self.index.line_after(line_num)
+        return self.line_pc[following] if following is not None else self.halt_pc
+    
+    def return_pc(self, gosub_line: int) -> int:
+        """Returns the pc a RETURN continues at for a GOSUB issued on gosub_line"""
+        pc = self._return_pc.get(gosub_line)
+        if pc is None:
+            line_num = self.index.return_line(gosub_line)
+            pc = self.halt_pc if line_num is None else self.line_pc[line_num]
+            self._return_pc[gosub_line] = pc
+        return pc
+    
+    def guarded_code(self) -> List[Any]:
+        """Returns a copy of the code that halts at every line and statement start
+        
+        After a runtime error the interpreter still finishes the statement it
+        was executing; the VM switches to this copy to do the same.
+        """
+        if self._guarded_code is None:
+            code = list(self.code)
+            for pc in list(self.line_pc.values()) + self.boundaries:
+                code[pc] = Op.HALT
+            self._guarded_code = code
+        return self._guarded_code
+    
+    def line_counts(self) -> Dict[int, int]:
+        """Returns line number -> execution count (only when compiled with counters)"""
+        return dict(zip(self.counted_lines, self.counts))
+    
+    def disassemble(self) -> str:
+        """Returns a readable listing of the bytecode"""
+        lines = []
+        line_starts = {pc: line_num for line_num, pc in self.line_pc.items()}
+        for pc in range(0, len(self.code), 2):
+            if pc in line_starts:
+                lines.append(f"{line_starts[pc]}:")
+            op, arg = self.code[pc], self.code[pc + 1]
+            text = '' if arg is None else repr(arg)
+            names = self.variable_names
+            if op in (Op.LOAD_VAR, Op.STORE_VAR, Op.ADD_VAR, Op.SUB_VAR, Op.MUL_VAR) and arg < len(names):
+                text += f" ({names[arg]})"
+            elif op == Op.COMPARE_JUMP:
+                text = f"{arg[0].__name__} -> {arg[1]}"
+            elif op == Op.COPY_VAR and max(arg) < len(names):
+                text += f" ({names[arg[0]]} -> {names[arg[1]]})"
+            lines.append(f"  {pc:6} {Op.NAMES[op]:<14}{text}")
+        return '\n'.join(lines)
+
+class BytecodeCompiler:
+    """Compiles a program from its BasicParser statements into bytecode (the 'vm' engine)
+    
+    Line-numbered control flow becomes resolved jump offsets. GOTO, GOSUB,
+    RETURN, NEXT and WEND are compiled as direct jumps when they are the last
+    thing a line executes; a line that transfers control and then keeps
+    running statements is executed by the tree-walker as a whole (EXEC_LINE),
+    which keeps the interpreter's exact line stepping rules.
+    """
+    
+    def __init__(self, interpreter: 'BasicInterpreter', count_lines: bool = False):
+        self.interp = interpreter
+        self.count_lines = count_lines
+        self.code = []
+        self._labels = {}     # label -> pc
+        self._patches = []    # (position in code, label) to resolve after emission
+    
+    def emit(self, op: int, arg: Any = None):
+        """Appends one instruction"""
+        self.code.append(op)
+        self.code.append(arg)
+    
+    def emit_jump(self, op: int, label: Any, extra: Any = None):
+        """Appends a jump to a label; the target pc is patched in once known"""
+        self._patches.append((len(self.code) + 1, label, extra))
+        self.emit(op, None)
+    
+    def place(self, label: Any):
+        """Binds a label to the next instruction"""
+        self._labels[label] = len(self.code)
+    
+    def compile(self, index: ProgramIndex) -> BytecodeProgram:
+        """Compiles every line of the program"""
+        self._index = index
+        self._retests = []
+        self._boundaries = []  # pcs where a multi-statement continues with its next statement
+        counted_lines = []
+        for line_num in index.line_numbers:
+            statement = index.statements[line_num]
+            self.place(('line', line_num))
+            if self.count_lines:
+                self.emit(Op.COUNT, len(counted_lines))
+                counted_lines.append(line_num)
+            if ProgramIndex.jumps_mid_line(statement):
+                self.emit(Op.EXEC_LINE, line_num)
+            else:
+                self.compile_statement(statement, line_num, tail=True)
+        self.place('halt')
+        self.emit(Op.HALT)
+        
+        # WHILE conditions re-evaluated by WEND live after the program
+        for line_num, condition in self._retests:
+            self.place(('retest', line_num))
+            self.compile_expression(condition)
+            self.emit_jump(Op.WEND_TEST, ('after', line_num))
+        
+        for position, label, extra in self._patches:
+            if label[0] == 'after':
+                # Continue with the line following label[1]
+                following = index.line_after(label[1])
+                label = ('line', following) if following is not None else 'halt'
+            target = self._labels[label]
+            self.code[position] = target if extra is None else (extra, target)
+        
+        line_pc = {line_num: self._labels[('line', line_num)] for line_num in index.line_numbers}
+        program = BytecodeProgram(self.code, line_pc, self._labels['halt'], index, counted_lines)
+        program.variable_names = list(self.interp.variables.slots)
+        program.retest_pc = {line_num: self._labels[('retest', line_num)] for line_num, _ in self._retests}
+        program.boundaries = self._boundaries
+        return program
+    
+    def compile_expression(self, expr):
+        """Emits code that pushes the value of an expression"""
+        if not expr:
+            self.emit(Op.LOAD_CONST, 0)
+            return
+        
+        expr_type = expr[0]
+        
+        if expr_type in ('NUMBER', 'STRING'):
+            self.emit(Op.LOAD_CONST, expr[1])
+        elif expr_type == 'VARIABLE':
+            self.emit(Op.LOAD_VAR, expr[2])
+        elif expr_type == 'BINOP':
+            self.compile_expression(expr[1])
+            right = expr[3]
+            if expr[2] in Op.OPERAND and right and right[0] in ('VARIABLE', 'NUMBER'):
+                # X + Y, X * 2: one instruction instead of a load and the operation
+                with_variable, with_constant = Op.OPERAND[expr[2]]
+                if right[0] == 'VARIABLE':
+                    self.emit(with_variable, right[2])
+                else:
+                    self.emit(with_constant, right[1])
+                return
+            self.compile_expression(right)
+            if expr[2] in Op.BINARY:
+                self.emit(Op.BINARY[expr[2]])
+            else:
+                self.emit(Op.ERROR, f"Unknown binary operator: {expr[2]}")
+        elif expr_type == 'UNOP':
+            self.compile_expression(expr[2])
+            if expr[1] in Op.UNARY:
+                self.emit(Op.UNARY[expr[1]])
+            else:
+                self.emit(Op.ERROR, f"Unknown unary operator: {expr[1]}")
+        elif expr_type == 'FUNCTION':
+            func_name, args = expr[1], expr[2]
+            for arg in args:
+                self.compile_expression(arg)
+            func = self.interp.builtin_functions.get(func_name)
+            if func is None:
+                # Not a built-in function: an array element (or "Unknown function")
+                self.emit(Op.ARRAY_GET, (func_name, len(args)))
+            else:
+                self.emit(Op.CALL, (func, len(args), func_name))
+        else:
+            self.emit(Op.ERROR, f"Unknown expression type: {expr_type}")
+    
+    def compile_statement(self, statement, line_num: int, tail: bool):
+        """Emits code for a statement; tail is True if nothing follows it on its line"""
+        if not statement:
+            return
+        
+        cmd = statement[0]
+        
+        if cmd == 'LET':
+            if statement[2][0] == 'VARIABLE':
+                self.emit(Op.COPY_VAR, (statement[2][2], statement[3]))
+            else:
+                self.compile_expression(statement[2])
+                self.emit(Op.STORE_VAR, statement[3])
+        elif cmd == 'LET_ARRAY':
+            for index in statement[2]:
+                self.compile_expression(index)
+            self.compile_expression(statement[3])
+            self.emit(Op.ARRAY_SET, (statement[1], len(statement[2])))
+        elif cmd == 'PRINT':
+            items = statement[1]
+            separators = statement[2] if len(statement) > 2 else []
+            suffixes = []
+            for i, item in enumerate(items):
+                self.compile_expression(item)
+                if i < len(separators):
+                    sep = separators[i]
+                    suffixes.append('' if sep == ';' else '    ' if sep == ',' else ' ')
+                else:
+                    suffixes.append(' ' if i < len(items) - 1 else '')
+            self.emit(Op.PRINT, tuple(suffixes))
+        elif cmd == 'IF':
+            else_stmt = statement[3] if len(statement) > 3 else None
+            end_label = ('if_end', len(self.code))
+            else_label = ('if_else', len(self.code))
+            condition = statement[1]
+            if condition and condition[0] == 'BINOP' and condition[2] in Op.COMPARISONS:
+                self.compile_expression(condition[1])
+                self.compile_expression(condition[3])
+                self.emit_jump(Op.COMPARE_JUMP, else_label if else_stmt else end_label,
+                               Op.COMPARISONS[condition[2]])
+            else:
+                self.compile_expression(condition)
+                self.emit_jump(Op.JUMP_IF_FALSE, else_label if else_stmt else end_label)
+            self.compile_statement(statement[2], line_num, tail)
+            if else_stmt:
+                self.emit_jump(Op.JUMP, end_label)
+                self.place(else_label)
+                self.compile_statement(else_stmt, line_num, tail)
+            self.place(end_label)
+        elif cmd == 'MULTI_STATEMENT':
+            subs = statement[1]
+            for i, sub_statement in enumerate(subs):
+                if i > 0:
+                    self._boundaries.append(len(self.code))
+                self.compile_statement(sub_statement, line_num, tail and i == len(subs) - 1)
+        elif cmd == 'FOR':
+            self.compile_expression(statement[2])
+            self.compile_expression(statement[3])
+            self.compile_expression(statement[4])
+            # NEXT resumes with the line after the FOR line
+            plan = self._index.loop_plans.get(line_num)
+            if plan is not None and plan.for_statement is not statement:
+                plan = None
+            self.emit_jump(Op.FOR, ('after', line_num), (statement[1], statement[5], line_num, plan))
+        elif cmd == 'NEXT':
+            self.emit(Op.NEXT)
+        elif cmd == 'WHILE':
+            wend_line = self._index.matching_wend(line_num)
+            self.compile_expression(statement[1])
+            if wend_line is None:
+                self.emit(Op.WHILE, (line_num, None))
+            else:
+                self.emit_jump(Op.WHILE, ('after', wend_line), line_num)
+            self._retests.append((line_num, statement[1]))
+        elif cmd == 'WEND':
+            self.emit_jump(Op.WEND, ('after', line_num))
+        elif cmd in ('GOTO', 'GOSUB'):
+            target = self._index.resolve_jump(statement[1])
+            if target is None:
+                self.emit(Op.ERROR, f"Line {statement[1]} not found")
+            elif cmd == 'GOTO':
+                self.emit_jump(Op.JUMP, ('line', target))
+            else:
+                self.emit_jump(Op.GOSUB, ('line', target), line_num)
+        elif cmd == 'RETURN':
+            self.emit(Op.RETURN)
+        elif cmd == 'END':
+            self.emit(Op.HALT)
+        elif cmd in ('COMMENT', 'DATA'):
+            pass
+        elif cmd in ('PSET', 'PLOT'):
+            self.compile_expression(statement[1])
+            self.compile_expression(statement[2])
+            self.emit(Op.PSET)
+        elif cmd == 'COLOR':
+            self.compile_expression(statement[1])
+            self.emit(Op.COLOR)
+        else:
+            # Everything else runs through the interpreter's execute_* methods
+            self.emit(Op.EXEC, statement)
+    
+
+class BasicVM:
+    """Stack machine executing a BytecodeProgram on behalf of a BasicInterpreter
+    
+    Runtime errors behave as in the tree-walker: the failing expression
+    yields 0 and the program stops once the current statement is done.
+    
+    Instructions are dispatched by one if-chain ordered by how often they
+    occur in arithmetic loops; an instruction far down the chain (MOD, ^,
+    string and array operations) pays for every test above it, which is
+    where the closure engine can be faster.
+    """
+    
+    def __init__(self, interpreter: 'BasicInterpreter', program: BytecodeProgram):
+        self.interp = interpreter
+        self.program = program
+    
+    def _fail(self, pc: int, message: str) -> List[Any]:
+        """Reports a runtime error for the instruction at pc, returns the code to continue with"""
+        self.interp.current_line = self.program.line_at(pc)
+        self.interp.error(message)
+        return self.program.guarded_code()
+    
+    def run(self, pc: int = 0):
+        """Executes instructions starting at pc until HALT, END or an error"""
+        interp = self.interp
+        program = self.program
+        code = program.code
+        counts = program.counts
+        slots = interp.variables.values  # Variable values by slot
+        arrays = interp.arrays
+        print_line = interp.output.print_line
+        for_stack = interp.for_stack
+        while_stack = interp.while_stack
+        call_stack = interp.call_stack
+        line_pc = program.line_pc
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        wend_continue = program.halt_pc
+        # Loop passes and jumps until the next interp.poll_events()
+        poll_events = interp.poll_events
+        countdown = interp.EVENT_CHECK_STATEMENTS
+        
+        # Opcodes as locals, in Op order
+        (LOAD_VAR, LOAD_CONST, STORE_VAR, ADD, SUB, MUL, DIV, MOD, POW,
+         CMP_EQ, CMP_NE, CMP_LT, CMP_GT, CMP_LE, CMP_GE, AND, OR, NEG, POS, NOT,
+         CALL, JUMP, JUMP_IF_FALSE, FOR, NEXT, WHILE, WEND, WEND_TEST, GOSUB,
+         RETURN, PRINT, COLOR, PSET, EXEC, EXEC_LINE, ERROR, COUNT, HALT,
+         ARRAY_GET, ARRAY_SET, COPY_VAR, ADD_VAR, SUB_VAR, MUL_VAR, ADD_CONST, SUB_CONST,
+         MUL_CONST, COMPARE_JUMP) = range(48)
+        
+        op = HALT
+        while True:
+            try:
+                while True:
+                    op = code[pc]
+                    arg = code[pc + 1]
+                    pc += 2
+                    
+                    if op == LOAD_VAR:
+                        push(slots[arg])
+                    elif op == LOAD_CONST:
+                        push(arg)
+                    elif op == STORE_VAR:
+                        slots[arg] = pop()
+                    elif op == COPY_VAR:
+                        value = slots[arg[0]]
+                        slots[arg[1]] = 0 if value is UNSET else value
+                    elif op == MUL_VAR:
+                        stack[-1] = stack[-1] * slots[arg]
+                    elif op == ADD_VAR:
+                        stack[-1] = stack[-1] + slots[arg]
+                    elif op == COMPARE_JUMP:
+                        b = pop()
+                        if not arg[0](pop(), b):
+                            pc = arg[1]
+                    elif op == NEXT:
+                        if not for_stack:
+                            code = self._fail(pc - 2, "NEXT without FOR")
+                            continue
+                        frame = for_stack[-1]
+                        slot = frame.slot
+                        new_value = slots[slot] + frame.step
+                        slots[slot] = new_value
+                        direction = frame.direction
+                        if direction > 0:
+                            more = new_value <= frame.end
+                        elif direction:
+                            more = new_value >= frame.end
+                        else:
+                            more = frame.more(new_value)
+                        if more:
+                            pc = frame.pc if frame.pc is not None else program.pc_after_line(frame.line)
+                            countdown -= 1
+                            if not countdown:
+                                countdown = poll_events()
+                        else:
+                            for_stack.pop()
+                    elif op == SUB_VAR:
+                        stack[-1] = stack[-1] - slots[arg]
+                    elif op == ADD_CONST:
+                        stack[-1] = stack[-1] + arg
+                    elif op == MUL_CONST:
+                        stack[-1] = stack[-1] * arg
+                    elif op == SUB_CONST:
+                        stack[-1] = stack[-1] - arg
+                    elif op == MUL:
+                        b = pop()
+                        stack[-1] = stack[-1] * b
+                    elif op == ADD:
+                        b = pop()
+                        stack[-1] = stack[-1] + b
+                    elif op == SUB:
+                        b = pop()
+                        stack[-1] = stack[-1] - b
+                    elif op == JUMP_IF_FALSE:
+                        if not pop():
+                            pc = arg
+                    elif op == CMP_GT:
+                        b = pop()
+                        stack[-1] = 1 if stack[-1] > b else 0
+                    elif op == CMP_LT:
+                        b = pop()
+                        stack[-1] = 1 if stack[-1] < b else 0
+                    elif op == CMP_EQ:
+                        b = pop()
+                        stack[-1] = 1 if stack[-1] == b else 0
+                    elif op == DIV:
+                        b = pop()
+                        if b == 0:
+                            code = self._fail(pc - 2, "Division by zero")
+                            stack[-1] = 0
+                            continue
+                        stack[-1] = stack[-1] / b
+                    elif op == MOD:
+                        b = pop()
+                        if b == 0:
+                            code = self._fail(pc - 2, "Division by zero in MOD operation")
+                            stack[-1] = 0
+                            continue
+                        stack[-1] = stack[-1] % b
+                    elif op == WEND:
+                        if not while_stack:
+                            code = self._fail(pc - 2, "WEND without WHILE")
+                            continue
+                        retest_pc = program.retest_pc.get(while_stack[-1])
+                        if retest_pc is None:
+                            # Not a WHILE line compiled by us; let the interpreter decide
+                            interp.current_line = program.line_at(pc - 2)
+                            interp.goto_executed = False
+                            interp.execute_wend(None)
+                            if not interp.running:
+                                return
+                            pc = program.pc_after_line(interp.current_line)
+                        else:
+                            wend_continue = arg
+                            pc = retest_pc
+                        countdown -= 1
+                        if not countdown:
+                            countdown = poll_events()
+                    elif op == WEND_TEST:
+                        if pop():
+                            pc = arg
+                        else:
+                            while_stack.pop()
+                            pc = wend_continue
+                    elif op == CMP_NE:
+                        b = pop()
+                        stack[-1] = 1 if stack[-1] != b else 0
+                    elif op == CMP_LE:
+                        b = pop()
+                        stack[-1] = 1 if stack[-1] <= b else 0
+                    elif op == CMP_GE:
+                        b = pop()
+                        stack[-1] = 1 if stack[-1] >= b else 0
+                    elif op == AND:
+                        b = pop()
+                        stack[-1] = 1 if stack[-1] and b else 0
+                    elif op == OR:
+                        b = pop()
+                        stack[-1] = 1 if stack[-1] or b else 0
+                    elif op == CALL:
+                        func, nargs, _ = arg
+                        if nargs == 1:
+                            stack[-1] = func(stack[-1])
+                        elif nargs == 0:
+                            push(func())
+                        else:
+                            args = stack[-nargs:]
+                            del stack[-nargs:]
+                            push(func(*args))
+                    elif op == JUMP:
+                        pc = arg
+                        countdown -= 1
+                        if not countdown:
+                            countdown = poll_events()
+                    elif op == POW:
+                        b = pop()
+                        stack[-1] = stack[-1] ** b
+                    elif op == NEG:
+                        stack[-1] = -stack[-1]
+                    elif op == NOT:
+                        stack[-1] = 1 if not stack[-1] else 0
+                    elif op == POS:
+                        stack[-1] = +stack[-1]
+                    elif op == PSET:
+                        y = pop()
+                        interp.graphics.plot_point(pop(), y)
+                    elif op == COLOR:
+                        interp.graphics.set_color(int(pop()))
+                    elif op == PRINT:
+                        if arg:
+                            values = stack[-len(arg):]
+                            del stack[-len(arg):]
+                            print_line(''.join([str(value) + suffix for value, suffix in zip(values, arg)]))
+                        else:
+                            print_line()
+                    elif op == FOR:
+                        (var_name, slot, for_line, plan), resume_pc = arg
+                        step_value = pop()
+                        end_value = pop()
+                        start_value = pop()
+                        if start_value is UNSET:
+                            start_value = 0
+                        if plan is not None and plan.run(interp, start_value, end_value, step_value):
+                            if not interp.running:
+                                return  # A PARALLEL FOR pass ended the program
+                            pc = program.pc_after_line(plan.next_line)
+                            continue
+                        slots[slot] = start_value
+                        for_stack.append(ForFrame(var_name, slot, start_value, end_value, step_value,
+                                                  for_line, resume_pc))
+                    elif op == GOSUB:
+                        gosub_line, pc = arg
+                        call_stack.append(gosub_line)
+                    elif op == RETURN:
+                        if not call_stack:
+                            code = self._fail(pc - 2, "RETURN without GOSUB")
+                            continue
+                        pc = program.return_pc(call_stack.pop())
+                    elif op == WHILE:
+                        while_line, exit_pc = arg
+                        if pop():
+                            while_stack.append(while_line)
+                        elif exit_pc is None:
+                            code = self._fail(pc - 2, "WHILE without matching WEND")
+                        else:
+                            pc = exit_pc
+                    elif op == ARRAY_GET:
+                        name, nargs = arg
+                        subscripts = stack[-nargs:]
+                        del stack[-nargs:]
+                        array = arrays.get(name)
+                        if array is None:
+                            code = self._fail(pc - 2, f"Unknown function: {name}")
+                            push(0)
+                            continue
+                        push(array.get(subscripts))
+                    elif op == ARRAY_SET:
+                        name, nargs = arg
+                        value = pop()
+                        subscripts = stack[-nargs:]
+                        del stack[-nargs:]
+                        array = arrays.get(name)
+                        if array is None:
+                            code = self._fail(pc - 2, f"Array not dimensioned: {name}")
+                            continue
+                        array.set(subscripts, value)
+                    elif op == EXEC:
+                        interp.current_line = program.line_at(pc - 2)
+                        interp.execute_statement(arg)
+                        if not interp.running:
+                            return
+                    elif op == EXEC_LINE:
+                        # Whole line through the tree-walker, then follow its line stepping
+                        interp.current_line = arg
+                        interp.goto_executed = False
+                        interp.execute_statement(program.index.statements[arg])
+                        if not interp.running:
+                            return
+                        if interp.goto_executed:
+                            pc = line_pc[interp.current_line]
+                        else:
+                            pc = program.pc_after_line(interp.current_line)
+                    elif op == COUNT:
+                        counts[arg] += 1
+                    elif op == ERROR:
+                        # Failed expressions evaluate to 0, as in the interpreter
+                        code = self._fail(pc - 2, arg)
+                        push(0)
+                    elif op == HALT:
+                        if interp.running:
+                            interp.current_line = program.line_at(pc - 2)
+                        return
+            except Exception as e:
+                # The faulting instruction is the one just dispatched
+                if Op.ADD <= op <= Op.OR or Op.NEG <= op <= Op.NOT or Op.ADD_VAR <= op <= Op.MUL_CONST:
+                    kind = 'unary' if Op.NEG <= op <= Op.NOT else 'binary'
+                    code = self._fail(pc - 2, f"Error in {kind} operation: {e}")
+                    stack[-1] = 0
+                elif op == Op.COMPARE_JUMP:
+                    # Both operands are off the stack; a failed condition is false
+                    code = self._fail(pc - 2, f"Error in binary operation: {e}")
+                    pc = code[pc - 1][1]
+                elif op == Op.CALL:
+                    func, nargs, func_name = code[pc - 1]
+                    code = self._fail(pc - 2, f"Error calling function {func_name}: {e}")
+                    if nargs == 1:
+                        stack[-1] = 0
+                    else:
+                        push(0)
+                elif op == Op.ARRAY_GET:
+                    # Subscripts are already off the stack
+                    code = self._fail(pc - 2, str(e))
+                    push(0)
+                elif op == Op.ARRAY_SET:
+                    code = self._fail(pc - 2, str(e))
+                else:
+                    # Errors outside expressions end the program immediately
+                    self._fail(pc - 2, str(e))
+                    return
+
+class PythonProgram:
+    """A program transpiled to Python source and compiled into one function"""
+    
+    def __init__(self, source: str, namespace: Dict[str, Any]):
+        self.source = source
+        exec(compile(source, '<crossbasic>', 'exec'), namespace)
+        self.function = namespace['basic_program']
+    
+    def run(self, interpreter: 'BasicInterpreter', start_line: int):
+        """Runs the program from start_line on the interpreter's state"""
+        self.function(interpreter, interpreter.variables, interpreter.builtin_functions, start_line)
+
+class PythonTranspiler:
+    """Translates a whole program into the source of one Python function (the 'python' engine)
+    
+    BASIC variables become local variables, and the lines are split into
+    basic blocks that a dispatch loop selects by number. FOR/NEXT and
+    WHILE/WEND pairs that nothing jumps into or out of become native Python
+    loops. Whatever the generated code does not handle itself (lines that
+    jump mid-line, jumps to a line that starts no block, runtime errors) is
+    passed to the tree-walker, so results and error messages stay the same.
+    """
+    
+    _ARITHMETIC = {'+': '+', '-': '-', '*': '*', '/': '/', 'MOD': '%', '^': '**'}
+    _COMPARISON = {'=': '==', '<>': '!=', '!=': '!=', '<': '<', '>': '>', '<=': '<=', '>=': '>='}
+    
+    def __init__(self, interpreter: 'BasicInterpreter'):
+        self.interp = interpreter
+    
+    def compile_program(self, index: ProgramIndex) -> PythonProgram:
+        """Transpiles the program and compiles the generated source"""
+        source = self.transpile(index)
+        namespace = {
+            '_INDEX': index,
+            '_STATEMENTS': self.statements,
+            '_SOURCE_MAP': self.source_map,
+            '_fail': self._fail,
+            '_dim': self._dim,
+            '_ForFrame': ForFrame,
+            '_UNSET': UNSET,
+            '_line_after': index.line_after,
+            '_return_line': index.return_line,
+        }
+        return PythonProgram(source, namespace)
+    
+    @staticmethod
+    def _fail():
+        """Leaves the generated code; the interpreter re-runs the statement and reports the error"""
+        raise RuntimeError("statement handed back to the interpreter")
+    
+    @staticmethod
+    def _dim(name: str, *bounds) -> BasicArray:
+        """DIM in generated code; raises where execute_dim reports an error"""
+        if any(isinstance(bound, str) or bound < 0 for bound in bounds):
+            raise ValueError(f"Illegal array size: {name}")
+        return BasicArray(name, [int(bound) for bound in bounds])
+    
+    def transpile(self, index: ProgramIndex) -> str:
+        """Returns the Python source for the program"""
+        self._index = index
+        self.lines = []
+        self.statements = []     # statements the error handler can re-run
+        self.source_map = {}     # source line -> (BASIC line, statement number or None to re-raise)
+        self._context = (None, None)
+        self._depth = 0
+        
+        self._collect_names()
+        self._find_loops()
+        self._find_blocks()
+        self._emit_program()
+        return '\n'.join(self.lines) + '\n'
+    
+    # Analysis
+    
+    def _collect_names(self):
+        """Assigns a Python local to every BASIC variable and collects the FOR variables"""
+        names = set()
+        self._for_vars = []
+        
+        def walk(node):
+            if isinstance(node, (tuple, list)):
+                if len(node) >= 2 and node[0] == 'VARIABLE':
+                    names.add(node[1])
+                for child in node:
+                    walk(child)
+        
+        for statement in self._index.statements.values():
+            walk(statement)
+            for stmt in ProgramIndex._flatten(statement):
+                if stmt[0] in ('LET', 'FOR'):
+                    names.add(stmt[1])
+                if stmt[0] == 'FOR' and stmt[1] not in self._for_vars:
+                    self._for_vars.append(stmt[1])
+                elif stmt[0] == 'INPUT':
+                    names.add(stmt[2])
+        
+        self._locals = {}
+        used = set()
+        for name in sorted(names):
+            local = 'V_' + name.replace('$', '_S').replace('%', '_T')
+            while local in used:
+                local += '_'
+            used.add(local)
+            self._locals[name] = local
+        self._slots = {name: self.interp.variables.slot(name) for name in names}
+    
+    def _find_loops(self):
+        """Pairs FOR/NEXT and WHILE/WEND lines and decides which become native loops"""
+        index = self._index
+        statements = index.statements
+        lines = index.line_numbers
+        self._position = index.position
+        
+        # PARALLEL FOR loops stay in the interpreter, which offers them to their ParallelLoop
+        pairs = [('FOR', start, end) for start, end in index.loops if start not in index.parallel_loops]
+        self._while_lines = [line_num for line_num in lines
+                             if statements[line_num] and statements[line_num][0] == 'WHILE']
+        pairs += [('WHILE', start, index.wend_of[start]) for start in self._while_lines
+                  if index.wend_of[start] is not None]
+        self._wend_of = {start: end for kind, start, end in pairs if kind == 'WHILE'}
+        
+        # Lines something may jump to, which no native loop may contain
+        targets = index.entry_lines()
+        self._targets = targets
+        
+        # Inner loops first, so an outer loop can contain native inner loops
+        self._native = {}
+        for kind, start, end in sorted(pairs, key=lambda p: self._position[p[2]] - self._position[p[1]]):
+            if end in targets:
+                continue
+            i = self._position[start] + 1
+            while i < self._position[end]:
+                line_num = lines[i]
+                if line_num in targets:
+                    break
+                if line_num in self._native:
+                    i = self._position[self._native[line_num][2]] + 1
+                    continue
+                if any(stmt[0] in ProgramIndex.CONTROL_STATEMENTS or stmt[0] == 'FOR'
+                       for stmt in ProgramIndex._flatten(statements[line_num])):
+                    break
+                i += 1
+            else:
+                self._native[start] = (kind, start, end)
+    
+    def _find_blocks(self):
+        """Chooses the lines that start basic blocks"""
+        index = self._index
+        starts = set(self._targets)
+        native_lines = set()
+        for kind, start, end in self._native.values():
+            native_lines.update((start, end))
+        
+        # Where NEXT, WHILE and WEND outside native loops continue
+        for line_num, statement in index.statements.items():
+            if line_num in native_lines:
+                continue
+            if any(stmt[0] in ('FOR', 'WHILE', 'WEND') for stmt in ProgramIndex._flatten(statement)):
+                starts.add(index.line_after(line_num))
+        for start, end in self._wend_of.items():
+            if start not in self._native:
+                starts.add(index.line_after(end))
+        for plan in index.parallel_loops.values():
+            starts.add(index.line_after(plan.next_line))
+        
+        starts.discard(None)
+        self._block_starts = sorted(starts)
+        self._block_ids = {line_num: i for i, line_num in enumerate(self._block_starts)}
+    
+    # Emission
+    
+    def emit(self, text: str, re_raise: bool = False):
+        """Appends one source line, remembering which statement it belongs to"""
+        self.lines.append('    ' * self._depth + text)
+        line_num, statement_id = self._context
+        self.source_map[len(self.lines)] = (line_num, None if re_raise else statement_id)
+    
+    def _emit_program(self):
+        index = self._index
+        self.lines.append(f"_BLOCKS = {self._block_ids!r}")
+        self.lines.append("")
+        self.lines.append("def basic_program(interp, variables, _fn, _line):")
+        self._depth = 1
+        self.emit("_values = variables.values")
+        self.emit("_arrays = interp.arrays")
+        self.emit("for_stack = interp.for_stack")
+        self.emit("while_stack = interp.while_stack")
+        self.emit("call_stack = interp.call_stack")
+        self.emit("graphics = interp.graphics")
+        self.emit("_print = interp.output.print_line")
+        self.emit("_set_text_color = interp.color_manager.set_text_color")
+        if index.has_graphics:
+            self.emit("_poll_events = interp.poll_events")
+            self.emit("_countdown = interp.EVENT_CHECK_STATEMENTS")
+        for func_name in sorted(self._function_names()):
+            if func_name in self.interp.builtin_functions:
+                self.emit(f"_f_{func_name} = _fn[{func_name!r}]")
+        self._emit_sync_in(self._locals)
+        self.emit("_pc = -1")
+        self.emit("try:")
+        self._depth += 1
+        self.emit("while True:")
+        self._depth += 1
+        self._emit_event_poll()
+        
+        self.emit("if _pc < 0:")
+        self._depth += 1
+        self.emit("# Jump to _line: use its block, or let the interpreter run up to the next block")
+        self.emit("if _line is None:")
+        self.emit("    return")
+        self.emit("_pc = _BLOCKS.get(_line, -1)")
+        self.emit("if _pc < 0:")
+        self._depth += 1
+        self._emit_sync_out(self._locals)
+        self.emit("interp.current_line = _line")
+        self.emit("_line = interp._run_tree(_INDEX, _BLOCKS)")
+        self._emit_sync_in(self._locals)
+        self.emit("continue")
+        self._depth -= 2
+        
+        if self._block_starts:
+            self._emit_dispatch(0, len(self._block_starts))
+        else:
+            self.emit("return")
+        self._depth -= 2
+        
+        # Runtime errors: the interpreter re-runs the failing statement, which
+        # reports the error exactly as it would and ends the program
+        self.emit("except Exception as _e:")
+        self._depth += 1
+        self.emit("_line, _statement = _SOURCE_MAP.get(_e.__traceback__.tb_lineno, (None, None))")
+        self._emit_sync_out(self._locals)
+        self.emit("if _line is not None:")
+        self.emit("    interp.current_line = _line")
+        self.emit("if _statement is None:")
+        self.emit("    raise")
+        self.emit("try:")
+        self.emit("    interp.execute_statement(_STATEMENTS[_statement])")
+        self.emit("finally:")
+        self._depth += 1
+        self._emit_sync_in(self._locals)
+        self._depth -= 2
+        self.emit("finally:")
+        self._depth += 1
+        self._emit_sync_out(self._locals)
+        self._depth = 0
+    
+    def _function_names(self):
+        names = set()
+        
+        def walk(node):
+            if isinstance(node, (tuple, list)):
+                if len(node) == 3 and node[0] == 'FUNCTION':
+                    names.add(node[1])
+                for child in node:
+                    walk(child)
+        
+        walk(list(self._index.statements.values()))
+        return names
+    
+    def _emit_sync_out(self, names):
+        """Copies locals into the interpreter's variables"""
+        for name in sorted(names):
+            self.emit(f"_values[{self._slots[name]}] = {self._locals[name]}")
+        if not names:
+            self.emit("pass")
+    
+    def _emit_sync_in(self, names):
+        """Reloads locals from the interpreter's variables"""
+        for name in sorted(names):
+            self.emit(f"{self._locals[name]} = _values[{self._slots[name]}]")
+        if not names:
+            self.emit("pass")
+    
+    def _emit_dispatch(self, low: int, high: int):
+        """Emits a binary search over block numbers low..high-1"""
+        if high - low == 1:
+            self._emit_block(low)
+            return
+        middle = (low + high) // 2
+        self.emit(f"if _pc < {middle}:")
+        self._depth += 1
+        self._emit_dispatch(low, middle)
+        self._depth -= 1
+        self.emit("else:")
+        self._depth += 1
+        self._emit_dispatch(middle, high)
+        self._depth -= 1
+    
+    def _emit_block(self, block_id: int):
+        lines = self._index.line_numbers
+        first = self._position[self._block_starts[block_id]]
+        if block_id + 1 < len(self._block_starts):
+            last = self._position[self._block_starts[block_id + 1]]
+        else:
+            last = len(lines)
+        self._emit_lines(lines[first:last])
+        # Fall through into the next block
+        self.emit(f"_pc = {block_id + 1}" if block_id + 1 < len(self._block_starts) else "return")
+    
+    def _emit_lines(self, lines: List[int]):
+        statements = self._index.statements
+        i = 0
+        while i < len(lines):
+            line_num = lines[i]
+            statement = statements[line_num]
+            if line_num in self._native:
+                kind, start, end = self._native[line_num]
+                body = self._index.line_numbers[self._position[start] + 1:self._position[end]]
+                if kind == 'FOR':
+                    self._emit_native_for(start, end, body)
+                else:
+                    self._emit_native_while(start, end, body)
+                i += len(body) + 2
+                continue
+            
+            self._emit_comment(line_num, statement)
+            if line_num in self._index.parallel_loops:
+                # The worker processes may change any variable
+                self._emit_interpreted_line(line_num, statement, sorted(self._locals))
+            elif ProgramIndex.jumps_mid_line(statement):
+                self._emit_interpreted_line(line_num, statement)
+            else:
+                self._emit_statement(statement, line_num, tail=True)
+            i += 1
+    
+    def _emit_comment(self, line_num: int, statement):
+        text = self.interp.format_statement(statement) if statement else ''
+        self.lines.append('    ' * self._depth + f"# {line_num} {text}".rstrip().replace('\n', ' '))
+    
+    def _statement_id(self, statement) -> int:
+        self.statements.append(statement)
+        return len(self.statements) - 1
+    
+    def _names_in(self, statement) -> List[str]:
+        """Returns the program variables a statement refers to"""
+        found = set()
+        
+        def walk(node):
+            if isinstance(node, (tuple, list)):
+                for child in node:
+                    walk(child)
+            elif isinstance(node, str) and node in self._locals:
+                found.add(node)
+        
+        walk(statement)
+        return sorted(found)
+    
+    def _emit_interpreted_line(self, line_num: int, statement, names: List[str] = None):
+        """A line that jumps mid-line runs in the interpreter, then we follow its line stepping"""
+        if names is None:
+            names = self._names_in(statement)
+        # Exceptions from the interpreter pass through unchanged
+        self._context = (None, None)
+        self._emit_sync_out(names)
+        self.emit(f"interp.current_line = {line_num}")
+        self.emit("interp.goto_executed = False")
+        self.emit(f"interp.execute_statement(_STATEMENTS[{self._statement_id(statement)}])")
+        self._emit_sync_in(names)
+        self.emit("if not interp.running:")
+        self.emit("    return")
+        self.emit("_line = interp.current_line if interp.goto_executed else _line_after(interp.current_line)")
+        self.emit("_pc = -1")
+        self.emit("continue")
+    
+    def _emit_native_for(self, start: int, end: int, body: List[int]):
+        statements = self._index.statements
+        before, for_stmt, after = ProgramIndex.split_loop_line(statements[start], 'FOR')
+        next_before, next_stmt, _ = ProgramIndex.split_loop_line(statements[end], 'NEXT')
+        var = self._locals[for_stmt[1]]
+        end_var, step_var = f"_end{start}", f"_step{start}"
+        
+        self._emit_comment(start, statements[start])
+        for statement in before:
+            self._emit_statement(statement, start, tail=False)
+        self._context = (start, self._statement_id(for_stmt))
+        step_expr = for_stmt[4]
+        constant_step = (step_expr and step_expr[0] == 'NUMBER' and
+                         isinstance(step_expr[1], (int, float)) and not isinstance(step_expr[1], bool))
+        self.emit(f"_value = {self._stored_value(for_stmt[2])}")
+        self.emit(f"{end_var} = {self._value(for_stmt[3])}")
+        step = self._constant(step_expr[1]) if constant_step else step_var
+        if not constant_step:
+            self.emit(f"{step_var} = {self._value(step_expr)}")
+        self.emit(f"{var} = _value")
+        self.emit(f"for_stack.append(_ForFrame({for_stmt[1]!r}, {for_stmt[5]}, _value, {end_var}, "
+                  f"{step}, {start}))")
+        # Statements after the FOR on its line run once: NEXT continues behind the line
+        for statement in after:
+            self._emit_statement(statement, start, tail=False)
+        self.emit("while True:")
+        self._depth += 1
+        self._emit_event_poll()
+        self._emit_lines(body)
+        
+        self._emit_comment(end, statements[end])
+        for statement in next_before:
+            self._emit_statement(statement, end, tail=False)
+        self._context = (end, self._statement_id(next_stmt))
+        self.emit(f"{var} = {var} + {step}")
+        if constant_step and step_expr[1] > 0:
+            test = f"{var} <= {end_var}"
+        elif constant_step and step_expr[1] < 0:
+            test = f"{var} >= {end_var}"
+        elif constant_step:
+            test = "False"
+        else:
+            test = f"({step} > 0 and {var} <= {end_var}) or ({step} < 0 and {var} >= {end_var})"
+        # By now the interpreter would have updated the variable too
+        self.emit(f"if not ({test}):", re_raise=True)
+        self.emit("    break")
+        self._depth -= 1
+        self.emit("for_stack.pop()")
+    
+    def _emit_native_while(self, start: int, end: int, body: List[int]):
+        statements = self._index.statements
+        while_stmt = statements[start]
+        self._emit_comment(start, while_stmt)
+        self._context = (start, self._statement_id(while_stmt))
+        self.emit(f"if {self._condition(while_stmt[1])}:")
+        self._depth += 1
+        self.emit(f"while_stack.append({start})")
+        self.emit("while True:")
+        self._depth += 1
+        self._emit_event_poll()
+        self._emit_lines(body)
+        self._emit_comment(end, statements[end])
+        self._context = (end, self._statement_id(statements[end]))
+        self.emit(f"if not {self._condition(while_stmt[1])}:")
+        self.emit("    break")
+        self._depth -= 1
+        self.emit("while_stack.pop()")
+        self._depth -= 1
+    
+    def _emit_event_poll(self):
+        """Counts a loop pass or jump; the interpreter pumps window events every so often"""
+        if self._index.has_graphics:
+            self.emit("_countdown -= 1", re_raise=True)
+            self.emit("if not _countdown:", re_raise=True)
+            self.emit("    _countdown = _poll_events()", re_raise=True)
+    
+    def _emit_jump(self, line_num: Optional[int]):
+        """Emits a jump to the block starting at line_num (None ends the program)"""
+        if line_num is None:
+            self.emit("return")
+        else:
+            self.emit(f"_pc = {self._block_ids[line_num]}")
+            self.emit("continue")
+    
+    def _emit_branch(self, statement, line_num: int, tail: bool):
+        self._depth += 1
+        emitted = len(self.lines)
+        self._emit_statement(statement, line_num, tail)
+        if len(self.lines) == emitted:
+            self.emit("pass")
+        self._depth -= 1
+    
+    def _emit_statement(self, statement, line_num: int, tail: bool):
+        if not statement:
+            return
+        
+        outer_context = self._context
+        self._context = (line_num, self._statement_id(statement))
+        cmd = statement[0]
+        
+        if cmd == 'LET':
+            self.emit(f"{self._locals[statement[1]]} = {self._stored_value(statement[2])}")
+        elif cmd == 'LET_ARRAY':
+            subscripts = ', '.join(self._value(index) for index in statement[2])
+            self.emit(f"_arrays[{statement[1]!r}].set([{subscripts}], {self._value(statement[3])})")
+        elif cmd == 'DIM':
+            for name, sizes in statement[1]:
+                if name in self.interp.builtin_functions:
+                    self.emit("_fail()")
+                    break
+                bounds = ', '.join(self._value(size) for size in sizes)
+                self.emit(f"_arrays[{name!r}] = _dim({name!r}, {bounds})")
+        elif cmd == 'PRINT':
+            self._emit_print(statement)
+        elif cmd == 'IF':
+            self.emit(f"if {self._condition(statement[1])}:")
+            self._emit_branch(statement[2], line_num, tail)
+            else_stmt = statement[3] if len(statement) > 3 else None
+            if else_stmt:
+                self.emit("else:")
+                self._emit_branch(else_stmt, line_num, tail)
+        elif cmd == 'MULTI_STATEMENT':
+            subs = statement[1]
+            for i, sub_statement in enumerate(subs):
+                self._emit_statement(sub_statement, line_num, tail and i == len(subs) - 1)
+        elif cmd == 'FOR':
+            self.emit(f"_value = {self._stored_value(statement[2])}")
+            self.emit(f"for_stack.append(_ForFrame({statement[1]!r}, {statement[5]}, _value, "
+                      f"{self._value(statement[3])}, {self._value(statement[4])}, {line_num}))")
+            self.emit(f"{self._locals[statement[1]]} = _value")
+        elif cmd == 'NEXT':
+            self._emit_next()
+        elif cmd == 'WHILE':
+            self.emit(f"if {self._condition(statement[1])}:")
+            self.emit(f"    while_stack.append({line_num})")
+            self.emit("else:")
+            self._depth += 1
+            wend_line = self._wend_of.get(line_num)
+            if wend_line is None:
+                self.emit("_fail()")
+            else:
+                self._emit_jump(self._index.line_after(wend_line))
+            self._depth -= 1
+        elif cmd == 'WEND':
+            self._emit_wend()
+        elif cmd in ('GOTO', 'GOSUB'):
+            target = self._index.resolve_jump(statement[1])
+            if target is None:
+                self.emit("_fail()")
+            else:
+                if cmd == 'GOSUB':
+                    self.emit(f"call_stack.append({line_num})")
+                self._emit_jump(target)
+        elif cmd == 'RETURN':
+            self.emit("if not call_stack:")
+            self.emit("    _fail()")
+            self.emit("_line = _return_line(call_stack.pop())")
+            self.emit("_pc = -1")
+            self.emit("continue")
+        elif cmd == 'END':
+            self.emit("return")
+        elif cmd in ('COMMENT', 'DATA'):
+            pass
+        elif cmd in ('READ', 'RESTORE'):
+            # Runs in the interpreter, which moves the DATA pointer and reports errors
+            names = self._names_in(statement)
+            self._emit_sync_out(names)
+            self.emit(f"interp.current_line = {line_num}")
+            self.emit(f"interp.execute_{cmd.lower()}(_STATEMENTS[{self._context[1]}])", re_raise=True)
+            self._emit_sync_in(names)
+            self.emit("if not interp.running:")
+            self.emit("    return")
+        elif cmd in ('PSET', 'PLOT'):
+            self.emit(f"graphics.plot_point({self._value(statement[1])}, {self._value(statement[2])})")
+        elif cmd == 'COLOR':
+            self.emit(f"graphics.set_color(int({self._value(statement[1])}))")
+        elif cmd in ('LINE', 'CIRCLE', 'RECT'):
+            method = {'LINE': 'draw_line', 'CIRCLE': 'draw_circle', 'RECT': 'draw_rect'}[cmd]
+            args = ', '.join(self._value(arg) for arg in statement[1:])
+            self.emit(f"graphics.{method}({args})")
+        elif cmd == 'TEXTCOLOR':
+            self.emit(f"_set_text_color(int({self._value(statement[1])}), None)")
+        elif cmd == 'TEXTBG':
+            self.emit(f"_set_text_color(None, int({self._value(statement[1])}))")
+        elif cmd == 'RESETCOLOR':
+            self.emit("_set_text_color(1, 0)")
+        elif cmd == 'FLIP':
+            self.emit("graphics.present()")
+        elif cmd == 'AUTOFLIP':
+            if statement[1] == 'FPS':
+                self.emit(f"graphics.set_auto_flip(True, {self._value(statement[2])})")
+            else:
+                self.emit(f"graphics.set_auto_flip({statement[1] == 'ON'})")
+        elif cmd == 'GRAPHICS':
+            self.emit(f"graphics.init_graphics({(statement[1] if len(statement) > 1 else 0)!r})")
+        elif cmd == 'CLS':
+            self.emit("interp.execute_cls(None)")
+        elif cmd == 'INPUT':
+            self.emit(f"interp.execute_input({statement!r})", re_raise=True)
+            self.emit(f"{self._locals[statement[2]]} = _values[{statement[3]}]")
+        else:
+            self.emit("_fail()")
+        
+        self._context = outer_context
+    
+    def _emit_print(self, statement):
+        items = statement[1]
+        separators = statement[2] if len(statement) > 2 else []
+        if not items:
+            self.emit("_print()")
+            return
+        
+        parts = []
+        literal = None
+        for i, item in enumerate(items):
+            if i < len(separators):
+                sep = separators[i]
+                suffix = '' if sep == ';' else '    ' if sep == ',' else ' '
+            else:
+                suffix = ' ' if i < len(items) - 1 else ''
+            if item and item[0] in ('STRING', 'NUMBER'):
+                literal = (literal or '') + str(item[1]) + suffix
+                continue
+            if literal is not None:
+                parts.append(repr(literal))
+            parts.append(f"str({self._value(item)})")
+            literal = suffix or None
+        if literal is not None:
+            parts.append(repr(literal))
+        self.emit(f"_print({' + '.join(parts)})")
+    
+    def _emit_next(self):
+        """NEXT outside a native loop: works on whatever FOR frame is on top, like execute_next"""
+        self.emit("if not for_stack:")
+        self.emit("    _fail()")
+        self.emit("_frame = for_stack[-1]")
+        self.emit("_var = _frame.var")
+        keyword = "if"
+        for name in self._for_vars:
+            local = self._locals[name]
+            self.emit(f"{keyword} _var == {name!r}:")
+            self.emit(f"    {local} = _value = {local} + _frame.step")
+            keyword = "elif"
+        if keyword == "elif":
+            self.emit("else:")
+            self._depth += 1
+        self.emit("_value = _values[_frame.slot] = _values[_frame.slot] + _frame.step")
+        if keyword == "elif":
+            self._depth -= 1
+        self.emit("if _frame.more(_value):",
+                  re_raise=True)
+        self._depth += 1
+        self.emit("_line = _line_after(_frame.line)")
+        self.emit("_pc = -1")
+        self.emit("continue")
+        self._depth -= 1
+        self.emit("for_stack.pop()")
+    
+    def _emit_wend(self):
+        """WEND outside a native loop: re-tests the condition of the WHILE on top of the stack"""
+        statements = self._index.statements
+        self.emit("if not while_stack:")
+        self.emit("    _fail()")
+        self.emit("_while = while_stack[-1]")
+        keyword = "if"
+        # A native WHILE is only on top of the stack inside its own loop; anything
+        # else is left to the interpreter (_fail below)
+        for while_line in self._while_lines:
+            if while_line in self._native:
+                continue
+            self.emit(f"{keyword} _while == {while_line}:")
+            self._depth += 1
+            self.emit(f"if {self._condition(statements[while_line][1])}:")
+            self._depth += 1
+            self._emit_jump(self._index.line_after(while_line))
+            self._depth -= 2
+            keyword = "elif"
+        if keyword == "elif":
+            self.emit("else:")
+            self.emit("    _fail()")
+        else:
+            self.emit("_fail()")
+        self.emit("while_stack.pop()")
+    
+    # Expressions
+    
+    def _constant(self, value) -> str:
+        if isinstance(value, float) and not math.isfinite(value):
+            return f"float({str(value)!r})"
+        return repr(value)
+    
+    def _value(self, expr) -> str:
+        """Returns Python code for the value of an expression"""
+        code, is_bool = self._expression(expr)
+        return f"(1 if {code} else 0)" if is_bool else code
+    
+    def _stored_value(self, expr) -> str:
+        """Like _value, for a value that is assigned: a copy of an unset variable stores 0"""
+        if expr and expr[0] == 'VARIABLE':
+            local = self._locals[expr[1]]
+            return f"(0 if {local} is _UNSET else {local})"
+        return self._value(expr)
+    
+    def _condition(self, expr) -> str:
+        """Returns Python code whose truth is that of the expression"""
+        return self._expression(expr)[0]
+    
+    def _expression(self, expr):
+        """Returns (code, is_bool); comparisons stay Python bools until a value is needed"""
+        if not expr:
+            return '0', False
+        
+        expr_type = expr[0]
+        
+        if expr_type in ('NUMBER', 'STRING'):
+            return self._constant(expr[1]), False
+        elif expr_type == 'VARIABLE':
+            return self._locals[expr[1]], False
+        elif expr_type == 'BINOP':
+            op = expr[2]
+            if op in self._ARITHMETIC:
+                return f"({self._value(expr[1])} {self._ARITHMETIC[op]} {self._value(expr[3])})", False
+            if op in self._COMPARISON:
+                return f"({self._value(expr[1])} {self._COMPARISON[op]} {self._value(expr[3])})", True
+            if op in ('AND', 'OR'):
+                # The interpreter evaluates both operands
+                left, left_bool = self._expression(expr[1])
+                right, right_bool = self._expression(expr[3])
+                if left_bool and right_bool:
+                    return f"({left} {'&' if op == 'AND' else '|'} {right})", True
+                return f"{'all' if op == 'AND' else 'any'}(({left}, {right}))", True
+            return '_fail()', False
+        elif expr_type == 'UNOP':
+            op = expr[1]
+            if op == 'NOT':
+                return f"(not {self._condition(expr[2])})", True
+            if op in ('-', '+'):
+                return f"({op}{self._value(expr[2])})", False
+            return '_fail()', False
+        elif expr_type == 'FUNCTION':
+            args = ', '.join(self._value(arg) for arg in expr[2])
+            if expr[1] not in self.interp.builtin_functions:
+                # Array element; a missing array raises and the interpreter reports it
+                return f"_arrays[{expr[1]!r}].get([{args}])", False
+            return f"_f_{expr[1]}({args})", False
+        return '_fail()', False
+
 class BasicEditor:
     """Interactive BASIC line editor with syntax checking and line history"""
     
@@ -2495,6 +7706,26 @@ class BasicEditor:
                 elif line.lower() == 'run':
                     self.interpreter.run()
                     continue
+                elif line.lower().startswith('run '):
+                    # RUN <engine>, e.g. 'run closure'; RUN PROFILE [<engine>] prints the hot lines
+                    words = line[4:].lower().split()
+                    if words[0] == 'profile':
+                        self.interpreter.run(engine=words[1] if len(words) > 1 else None, profile=True)
+                        if self.interpreter.profiler is not None:
+                            print(self.interpreter.profiler.report(self.interpreter))
+                    else:
+                        self.interpreter.run(engine=words[0])
+                    continue
+                elif line.lower() == 'optimize' or line.lower().startswith('optimize '):
+                    # OPTIMIZE [ON|OFF] switches constant folding before execution
+                    setting = line[8:].strip().lower()
+                    if setting in ('on', 'off'):
+                        self.interpreter.optimize = setting == 'on'
+                    elif setting:
+                        print("Usage: optimize on|off")
+                        continue
+                    print(f"Optimizer is {'on' if self.interpreter.optimize else 'off'}")
+                    continue
                 elif line.lower().startswith('load '):
                     filename = line[5:].strip()
                     try:
@@ -2610,6 +7841,7 @@ class BasicEditor:
                     temp_interpreter = BasicInterpreter()
                     temp_interpreter.variables = self.interpreter.variables.copy()
                     temp_interpreter.graphics = self.interpreter.graphics
+                    temp_interpreter.arrays = self.interpreter.arrays  # Shared, so DIM/A(I) = ... persist
                     
                     if temp_interpreter.load_program(line):
                         temp_interpreter.run()
@@ -2696,6 +7928,9 @@ Interpreter Commands:
     new           - Clears the current program
     list          - Shows the loaded program
     run           - Runs the program
+    run <engine>  - Runs the program with an execution engine (tree, closure, vm, python)
+    run profile [<engine>] - Runs the program and shows the lines that took the most time
+    optimize on|off - Switches constant folding before execution on or off
     edit <line>   - Edit an existing line with pre-populated content
     load <file>   - Loads a program from a file
     save <file>   - Saves the program to a file
@@ -2786,10 +8021,9 @@ Example MOD Operator Usage:
     print(help_text)
 
 if __name__ == "__main__":
-    # Install pygame if needed
-    try:
-        import pygame
-    except ImportError:
+    # Install pygame if needed (it is only imported once graphics are used)
+    import importlib.util
+    if importlib.util.find_spec("pygame") is None:
         print("Pygame is not installed. Install it with: pip install pygame")
         sys.exit(1)
     
@@ -0,0 +1,42 @@
+1 REM Array Benchmark - FOR loops over DIM arrays
+2 REM Simple element-wise loops run as NumPy array operations when NumPy is installed
+
+10 PRINT "CrossBasic Array Benchmark"
+20 PRINT "=========================="
+30 PRINT
+40 LET N = 100000
+50 DIM X(N), Y(N), Z(N)
+
+55 REM Test 1: Fill arrays from the loop variable
+60 PRINT "Test 1: Fill"
+70 LET START_TIME = TIME()
+80 FOR I = 0 TO N
+90 X(I) = I * 2 + 1
+100 Y(I) = N - I / 4
+110 NEXT I
+120 LET ELAPSED = TIME() - START_TIME
+130 PRINT N; " elements in "; ELAPSED; " seconds"
+140 PRINT
+
+145 REM Test 2: Element-wise arithmetic (AXPY)
+150 PRINT "Test 2: Z = A * X + Y"
+160 LET A = 0.5
+170 LET START_TIME = TIME()
+180 FOR I = 0 TO N
+190 Z(I) = A * X(I) + Y(I)
+200 NEXT I
+210 LET ELAPSED = TIME() - START_TIME
+220 PRINT N; " elements in "; ELAPSED; " seconds"
+230 PRINT "Z(0) Z(N) = "; Z(0); " "; Z(N)
+240 PRINT
+
+245 REM Test 3: Three-point smoothing
+250 PRINT "Test 3: Smoothing"
+260 LET START_TIME = TIME()
+270 FOR I = 1 TO N - 1
+280 Y(I) = (Z(I - 1) + Z(I) + Z(I + 1)) / 3
+290 NEXT I
+300 LET ELAPSED = TIME() - START_TIME
+310 PRINT N - 1; " elements in "; ELAPSED; " seconds"
+320 PRINT "Y(1) Y(N - 1) = "; Y(1); " "; Y(N - 1)
+330 END
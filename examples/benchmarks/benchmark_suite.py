@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite - headless runs of the benchmark programs with regression tracking
+
+Every workload runs in a fresh Python process per engine: warm-up runs
+first, then the timed runs. Reported are the median and best time,
+statements per second, pixels per second and the peak RSS of the
+process. Statements (every statement executed, the parts of a
+multi-statement line and the THEN of an IF included) and pixels (PSET
+points) are counted once per workload with the tree engine and no
+optimizer, so the rates of all engines and interpreter versions refer to
+the same amount of work.
+
+    python3 examples/benchmarks/benchmark_suite.py --json baseline.json
+    python3 examples/benchmarks/benchmark_suite.py --compare baseline.json
+
+With --compare the exit status is 1 when a workload got slower or
+needed more memory than the threshold allows.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import contextlib
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', '..'))
+
+# Deterministic programs without INPUT
+WORKLOADS = [
+    'benchmark_test.bas',
+    'variable_benchmark.bas',
+    'array_benchmark.bas',
+    'mandelbrot_benchmark.bas',
+]
+
+def workload_path(workload):
+    """Curated workloads are looked up in this folder, other names as given"""
+    path = os.path.join(HERE, workload)
+    return path if os.path.exists(path) else workload
+
+def load(workload):
+    """Returns a headless interpreter with the workload loaded"""
+    import crossbasic
+    interpreter = crossbasic.BasicInterpreter()
+    interpreter.graphics.headless = True
+    interpreter.processes = 1
+    with open(workload_path(workload)) as f:
+        if not interpreter.load_program(f.read()):
+            raise SystemExit(f"Could not load {workload}")
+    return interpreter
+
+def run_quietly(interpreter, engine):
+    """Runs the program with its output discarded; returns the wall time in seconds"""
+    random.seed(1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        interpreter.run(engine=engine)
+        elapsed = time.perf_counter() - start
+    if interpreter.last_error is not None:
+        raise SystemExit(f"Runtime error: {interpreter.last_error}")
+    return elapsed
+
+def count_work(workload):
+    """Returns (statements, pixels) one run of the workload executes"""
+    import crossbasic
+    interpreter = load(workload)
+    interpreter.optimize = False
+    statements = 0
+    execute_statement = interpreter.execute_statement
+    
+    def counting_execute_statement(statement):
+        nonlocal statements
+        if statement and statement[0] != 'MULTI_STATEMENT':
+            statements += 1
+        execute_statement(statement)
+    interpreter.execute_statement = counting_execute_statement
+    
+    display_list = interpreter.graphics.start_recording(draw=False)
+    run_quietly(interpreter, 'tree')
+    interpreter.graphics.stop_recording()
+    interpreter.graphics.close()
+    return statements, display_list.ops.count(crossbasic.DisplayList.PSET)
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KiB, None where unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def measure(workload, engine, warmup, repeat):
+    """Child process: warm-up and timed runs of one workload; prints the result as JSON"""
+    interpreter = load(workload)
+    for _ in range(warmup):
+        run_quietly(interpreter, engine)
+    times = [run_quietly(interpreter, engine) for _ in range(repeat)]
+    interpreter.graphics.close()
+    print(json.dumps({'times': times, 'peak_rss_kb': peak_rss_kb()}))
+
+def run_suite(workloads, engines, warmup, repeat):
+    """Returns the results of all workloads and engines, keyed 'workload/engine'"""
+    results = {}
+    for workload in workloads:
+        statements, pixels = count_work(workload)
+        for engine in engines:
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--measure', workload, engine,
+                 '--warmup', str(warmup), '--repeat', str(repeat)],
+                capture_output=True, text=True, env=dict(os.environ, CROSSBASIC_HEADLESS='1'))
+            if child.returncode != 0:
+                print(f"{workload:28} {engine:8} failed: {child.stderr.strip() or child.stdout.strip()}")
+                continue
+            measured = json.loads(child.stdout.strip().splitlines()[-1])
+            median = statistics.median(measured['times'])
+            result = {
+                'workload': workload,
+                'engine': engine,
+                'times': measured['times'],
+                'median': median,
+                'best': min(measured['times']),
+                'statements': statements,
+                'statements_per_sec': statements / median if median else None,
+                'pixels': pixels,
+                'pixels_per_sec': pixels / median if median and pixels else None,
+                'peak_rss_kb': measured['peak_rss_kb'],
+            }
+            results[f"{workload}/{engine}"] = result
+            print_result(result)
+    return results
+
+def rate(value):
+    return '-' if value is None else f"{value:,.0f}"
+
+def print_result(result):
+    rss = result['peak_rss_kb']
+    print(f"{result['workload']:28} {result['engine']:8}"
+          f" median {result['median'] * 1000:9.1f} ms   best {result['best'] * 1000:9.1f} ms"
+          f"   {rate(result['statements_per_sec']):>11} stmt/s   {rate(result['pixels_per_sec']):>9} px/s"
+          f"   {'-' if rss is None else f'{rss / 1024:.1f}':>6} MiB")
+
+def compare(baseline, results, threshold):
+    """Prints the change against the baseline; returns the number of regressions"""
+    regressions = 0
+    print()
+    print(f"{'Workload':28} {'Engine':8} {'Baseline':>10} {'Now':>10} {'Time':>8} {'Memory':>8}")
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{result['workload']:28} {result['engine']:8} {'-':>10} "
+                  f"{result['median'] * 1000:8.1f}ms   (new)")
+            continue
+        time_change = result['median'] / base['median'] - 1
+        memory_change = None
+        if result['peak_rss_kb'] and base.get('peak_rss_kb'):
+            memory_change = result['peak_rss_kb'] / base['peak_rss_kb'] - 1
+        flags = []
+        if time_change > threshold:
+            flags.append('SLOWER')
+        if memory_change is not None and memory_change > threshold:
+            flags.append('MORE MEMORY')
+        regressions += bool(flags)
+        memory = '-' if memory_change is None else f"{memory_change:+.1%}"
+        print(f"{result['workload']:28} {result['engine']:8} {base['median'] * 1000:8.1f}ms "
+              f"{result['median'] * 1000:8.1f}ms {time_change:+8.1%} {memory:>8}  {' '.join(flags)}")
+    print(f"{regressions} regression{'s' if regressions != 1 else ''} "
+          f"(threshold {threshold:.0%})")
+    return regressions
+
+def main():
+    import crossbasic
+    parser = argparse.ArgumentParser(description="Run the CrossBasic benchmark workloads headlessly")
+    parser.add_argument("workloads", nargs="*", metavar="workload",
+                        help=f"programs to run (default: {', '.join(WORKLOADS)})")
+    parser.add_argument("--engine", action="append", choices=crossbasic.BasicInterpreter.ENGINES,
+                        help="engine to measure, may be repeated (default: all)")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs first (default: 1)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs (default: 3)")
+    parser.add_argument("--json", metavar="FILE", help="save the results as JSON")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare with the results saved by an earlier --json run")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="percent of time or memory above the baseline that counts as a "
+                             "regression (default: 10)")
+    parser.add_argument("--measure", nargs=2, metavar=("WORKLOAD", "ENGINE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.measure:
+        measure(*args.measure, args.warmup, args.repeat)
+        return
+    
+    results = run_suite(args.workloads or WORKLOADS,
+                        args.engine or crossbasic.BasicInterpreter.ENGINES,
+                        args.warmup, args.repeat)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'warmup': args.warmup,
+                'repeat': args.repeat,
+                'results': results,
+            }, f, indent=2)
+        print(f"Results saved to {args.json}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(baseline, results, args.threshold / 100):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
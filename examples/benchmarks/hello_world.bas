@@ -0,0 +1,2 @@
+10 REM Smallest text-only program: used by startup_benchmark.py
+20 PRINT "HELLO, WORLD"
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Hook Benchmark - what tracing hooks (BasicInterpreter.add_hook) cost
+
+Runs a workload with the tree engine without hooks, with one no-op hook
+per event kind, with all of them, and once more after removing them
+again. The last run shows that a removed hook leaves nothing behind.
+Times are the best of --runs runs.
+"""
+
+import os
+import io
+import sys
+import random
+import argparse
+import contextlib
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', '..'))
+
+import crossbasic
+
+def noop(*args):
+    pass
+
+def measure(interpreter, runs):
+    """Returns the best wall time of running the loaded program runs times, in seconds"""
+    times = []
+    for _ in range(runs):
+        random.seed(1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            interpreter.run(engine='tree')
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost of tracing hooks")
+    parser.add_argument("workload", nargs="?", default=os.path.join(HERE, 'mandelbrot_benchmark.bas'),
+                        help="program to run (default: mandelbrot_benchmark.bas)")
+    parser.add_argument("--runs", type=int, default=3, help="runs per measurement (default: 3)")
+    args = parser.parse_args()
+    
+    interpreter = crossbasic.BasicInterpreter()
+    interpreter.graphics.headless = True
+    with open(args.workload) as f:
+        if not interpreter.load_program(f.read()):
+            sys.exit(f"Could not load {args.workload}")
+    measure(interpreter, 1)  # Warm-up
+    
+    baseline = measure(interpreter, args.runs)
+    print(f"{'no hooks':24} {baseline * 1000:9.1f} ms")
+    for event in interpreter.HOOK_EVENTS + ('all',):
+        events = interpreter.HOOK_EVENTS if event == 'all' else (event,)
+        for name in events:
+            interpreter.add_hook(name, noop)
+        seconds = measure(interpreter, args.runs)
+        for name in events:
+            interpreter.remove_hook(name, noop)
+        print(f"{event + ' hook' + ('s' if event == 'all' else ''):24} {seconds * 1000:9.1f} ms"
+              f"   x{seconds / baseline:.2f}")
+    seconds = measure(interpreter, args.runs)
+    print(f"{'no hooks (removed)':24} {seconds * 1000:9.1f} ms   x{seconds / baseline:.2f}")
+
+if __name__ == "__main__":
+    main()
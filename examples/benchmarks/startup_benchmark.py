@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark - cold start of run_bas.py on a hello-world program
+
+Every run is a fresh Python process, as in batch jobs that launch one
+.bas file per invocation. The bare interpreter start is measured too,
+so the difference is what CrossBasic itself costs.
+"""
+
+import os
+import subprocess
+import sys
+import time
+import argparse
+import statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RUN_BAS = os.path.join(HERE, '..', '..', 'run_bas.py')
+HELLO = os.path.join(HERE, 'hello_world.bas')
+
+def measure(command, runs):
+    """Returns the wall times of running command runs times, in seconds"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of run_bas.py")
+    parser.add_argument("--runs", type=int, default=10, help="processes per measurement (default: 10)")
+    args = parser.parse_args()
+    
+    # One untimed run writes the bytecode caches
+    measure([sys.executable, RUN_BAS, HELLO], 1)
+    
+    for name, command in (("python -c pass", [sys.executable, "-c", "pass"]),
+                          ("run_bas.py hello_world.bas", [sys.executable, RUN_BAS, HELLO])):
+        times = measure(command, args.runs)
+        print(f"{name:28} median {statistics.median(times) * 1000:7.1f} ms"
+              f"   best {min(times) * 1000:7.1f} ms")
+    
+    modules = subprocess.run(
+        [sys.executable, "-c",
+         "import sys; sys.path.insert(0, sys.argv[1]); import crossbasic; "
+         "print(' '.join(m for m in ('pygame', 'numpy') if m in sys.modules) or 'none')",
+         os.path.join(HERE, '..', '..')],
+        capture_output=True, text=True, check=True).stdout.strip()
+    print(f"Heavy modules loaded by 'import crossbasic': {modules}")
+
+if __name__ == "__main__":
+    main()
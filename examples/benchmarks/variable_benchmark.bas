@@ -0,0 +1,48 @@
+1 REM Variable Benchmark - Read/write-heavy loops
+2 REM Measures how fast the interpreter reads and assigns variables
+
+10 PRINT "CrossBasic Variable Benchmark"
+20 PRINT "============================="
+30 PRINT
+
+35 REM Test 1: Many variables read and written in one loop
+40 PRINT "Test 1: Variable shuffle"
+50 LET START_TIME = TIME()
+60 LET A = 1: LET B = 2: LET C = 3: LET D = 4
+70 FOR I = 1 TO 20000
+80 LET T = A: LET A = B: LET B = C: LET C = D: LET D = T
+90 NEXT I
+100 LET ELAPSED = TIME() - START_TIME
+110 PRINT "20000 shuffles in "; ELAPSED; " seconds"
+120 PRINT "A B C D = "; A; " "; B; " "; C; " "; D
+130 PRINT
+
+135 REM Test 2: Running sums over several accumulators
+140 PRINT "Test 2: Accumulators"
+150 LET START_TIME = TIME()
+160 LET S1 = 0: LET S2 = 0: LET S3 = 0
+170 FOR I = 1 TO 20000
+180 LET S1 = S1 + I
+190 LET S2 = S2 + S1 MOD 7
+200 LET S3 = S3 + S2 - S1 MOD 3
+210 NEXT I
+220 LET ELAPSED = TIME() - START_TIME
+230 PRINT "20000 iterations in "; ELAPSED; " seconds"
+240 PRINT "S1 S2 S3 = "; S1; " "; S2; " "; S3
+250 PRINT
+
+255 REM Test 3: Fibonacci with a WHILE loop
+260 PRINT "Test 3: Fibonacci pairs"
+270 LET START_TIME = TIME()
+280 LET N = 0
+290 WHILE N < 10000
+300 LET F0 = 0: LET F1 = 1: LET K = 0
+310 WHILE K < 10
+320 LET F2 = F0 + F1: LET F0 = F1: LET F1 = F2: LET K = K + 1
+330 WEND
+340 LET N = N + 10
+350 WEND
+360 LET ELAPSED = TIME() - START_TIME
+370 PRINT "1000 sequences in "; ELAPSED; " seconds"
+380 PRINT "F1 = "; F1
+390 END
@@ -5,42 +5,312 @@ CrossBasic File Runner - Wrapper script to run .bas files directly
 
 import sys
 import os
+import io
+import glob
+import argparse
+import contextlib
+import multiprocessing
+import multiprocessing.connection
+import time
 from pathlib import Path
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python run_bas.py <filename.bas>")
-        sys.exit(1)
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def parse_args():
+    """Parses the command line"""
+    parser = argparse.ArgumentParser(description="Run a CrossBasic .bas file")
+    parser.add_argument("filenames", nargs="+", metavar="filename",
+                        help="BASIC program to run (with --batch: any number of programs or glob patterns)")
+    parser.add_argument("--engine", default="tree", choices=("tree", "closure", "vm", "python"),
+                        help="execution engine: tree (default), closure, vm or python")
+    parser.add_argument("--emit-python", action="store_true",
+                        help="print the program transpiled to Python and exit")
+    parser.add_argument("--no-optimize", action="store_true",
+                        help="run the program without constant folding")
+    parser.add_argument("--flush", default="auto", choices=("auto", "line", "size", "input"),
+                        help="when PRINT output is written: per line, in blocks, or only "
+                             "before INPUT (default: per line on a terminal, in blocks when piped)")
+    parser.add_argument("--headless", action="store_true",
+                        help="draw graphics off-screen without a window (also: CROSSBASIC_HEADLESS=1)")
+    parser.add_argument("--checksum", action="store_true",
+                        help="print a SHA-256 checksum of the framebuffer when the program ends")
+    parser.add_argument("--save-image", metavar="FILE",
+                        help="save the framebuffer as an image (.png, .bmp, ...) when the program ends")
+    parser.add_argument("--render-thread", action="store_true",
+                        help="draw and present graphics in a separate thread (also: "
+                             "CROSSBASIC_RENDER_THREAD=1)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record all graphics primitives and save them as a display list")
+    parser.add_argument("--record-only", action="store_true",
+                        help="with --record: only record, do not draw (no window)")
+    parser.add_argument("--replay", action="store_true",
+                        help="the file is a display list saved with --record: draw it instead "
+                             "of running a program")
+    parser.add_argument("--processes", type=int, metavar="N",
+                        help="worker processes for PARALLEL FOR loops (also: CROSSBASIC_PROCESSES, "
+                             "default: number of CPUs)")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every line and print the lines that took the most time")
+    parser.add_argument("--batch", action="store_true",
+                        help="run all programs headless on a pool of worker processes, capture "
+                             "their output and print a summary")
+    parser.add_argument("--jobs", type=int, metavar="N",
+                        help="with --batch: number of worker processes (default: number of CPUs)")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help="with --batch: stop a program that runs longer than this")
+    parser.add_argument("--output-dir", metavar="DIR",
+                        help="with --batch: save the output of each program as DIR/<program>.out "
+                             "instead of printing it")
+    args = parser.parse_args()
+    if not args.batch and len(args.filenames) > 1:
+        parser.error("more than one program needs --batch")
+    return args
+
+def run_captured(crossbasic, filename, args):
+    """Runs one program headless in this process; returns (status, output, checksum)"""
+    output = io.StringIO()
+    status = 'ok'
+    checksum = None
+    with contextlib.redirect_stdout(output):
+        interpreter = crossbasic.BasicInterpreter()
+        interpreter.optimize = not args.no_optimize
+        interpreter.output.policy = 'input'
+        interpreter.color_manager.colors_enabled = False
+        interpreter.graphics.headless = True
+        interpreter.processes = 1  # The batch already keeps every CPU busy
+        try:
+            with open(filename, 'r') as f:
+                program_text = f.read()
+            if interpreter.load_program(program_text):
+                interpreter.run(engine=args.engine)
+                if interpreter.last_error is not None:
+                    status = 'error'
+            else:
+                status = 'error'
+            if args.checksum:
+                checksum = interpreter.graphics.checksum()
+        except Exception as e:
+            print(f"Error running program: {e}")
+            status = 'error'
+        finally:
+            try:
+                interpreter.graphics.close()
+            except:
+                pass
+    return status, output.getvalue(), checksum
+
+def batch_worker(connection, args):
+    """A pre-warmed batch worker: runs the programs it receives until it gets None"""
+    sys.path.insert(0, HERE)
+    import crossbasic
+    while True:
+        filename = connection.recv()
+        if filename is None:
+            break
+        connection.send(run_captured(crossbasic, filename, args))
+
+class BatchWorker:
+    """A worker process of the batch runner and the program it is running"""
+    
+    def __init__(self, args):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=batch_worker, args=(child, args), daemon=True)
+        self.process.start()
+        child.close()
+        self.filename = None
+        self.started = 0.0
+        self.deadline = None
+    
+    def start(self, filename, timeout):
+        self.filename = filename
+        self.started = time.perf_counter()
+        self.deadline = self.started + timeout if timeout else None
+        self.connection.send(filename)
     
-    filename = sys.argv[1]
+    def finish(self):
+        """Returns (filename, seconds) of the finished program; the worker is idle again"""
+        filename, self.filename = self.filename, None
+        return filename, time.perf_counter() - self.started
+    
+    def stop(self):
+        if self.filename is None and self.process.is_alive():
+            self.connection.send(None)
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
+
+def expand_programs(patterns):
+    """Expands glob patterns (** included); plain file names are kept as given"""
+    filenames = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            filenames.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            filenames.append(pattern)
+    return list(dict.fromkeys(filenames))
+
+def report(filename, status, output, args):
+    """Prints or saves the captured output of a finished program"""
+    if args.output_dir:
+        name = os.path.splitext(os.path.relpath(filename))[0].replace(os.sep, '_').replace('.', '_')
+        with open(os.path.join(args.output_dir, name + '.out'), 'w') as f:
+            f.write(output)
+        return
+    print(f"==> {filename} ({status}) <==")
+    sys.stdout.write(output)
+    if output and not output.endswith('\n'):
+        print()
+    print()
+
+def run_batch(args):
+    """Runs all programs on a pool of worker processes; returns the exit status"""
+    filenames = expand_programs(args.filenames)
+    if not filenames:
+        print("Error: no programs match")
+        return 1
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    jobs = max(1, min(args.jobs or os.cpu_count() or 1, len(filenames)))
+    
+    start = time.perf_counter()
+    results = {}  # filename -> (status, seconds, output lines, checksum)
+    pending = list(reversed(filenames))
+    workers = [BatchWorker(args) for _ in range(jobs)]
+    try:
+        while pending or any(worker.filename for worker in workers):
+            for worker in workers:
+                if worker.filename is None and pending:
+                    filename = pending.pop()
+                    if os.path.exists(filename):
+                        worker.start(filename, args.timeout)
+                    else:
+                        results[filename] = ('missing', 0.0, 0, None)
+            busy = [worker for worker in workers if worker.filename]
+            if not busy:
+                continue
+            
+            deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+            wait = max(0.0, min(deadlines) - time.perf_counter()) if deadlines else None
+            ready = multiprocessing.connection.wait([worker.connection for worker in busy], wait)
+            for i, worker in enumerate(workers):
+                if worker.filename is None:
+                    continue
+                if worker.connection in ready:
+                    try:
+                        status, output, checksum = worker.connection.recv()
+                    except (EOFError, OSError):
+                        status, output, checksum = 'crashed', '', None
+                elif worker.deadline is not None and time.perf_counter() >= worker.deadline:
+                    status, output, checksum = 'timeout', '', None
+                else:
+                    continue
+                filename, seconds = worker.finish()
+                results[filename] = (status, seconds, output.count('\n'), checksum)
+                report(filename, status, output, args)
+                if status in ('crashed', 'timeout'):
+                    # The process is stuck or gone: replace it by a fresh one
+                    worker.stop()
+                    workers[i] = BatchWorker(args)
+    finally:
+        for worker in workers:
+            worker.stop()
+    elapsed = time.perf_counter() - start
+    
+    # Summary table in the order the programs were given
+    width = max(len(filename) for filename in filenames)
+    print(f"{'Program':{width}}  {'Status':8} {'Seconds':>8} {'Lines':>6}"
+          + ("  Checksum" if args.checksum else ""))
+    for filename in filenames:
+        status, seconds, lines, checksum = results[filename]
+        print(f"{filename:{width}}  {status:8} {seconds:8.2f} {lines:6}"
+              + (f"  {checksum or '-'}" if args.checksum else ""))
+    counts = {}
+    for status, *_ in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    print(f"{len(filenames)} programs: "
+          + ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+          + f" in {elapsed:.2f} s with {jobs} worker{'s' if jobs > 1 else ''}")
+    return 0 if counts.get('ok', 0) == len(filenames) else 1
+
+def main():
+    args = parse_args()
+    if args.batch:
+        sys.exit(run_batch(args))
+    filename = args.filenames[0]
     
     if not os.path.exists(filename):
         print(f"Error: File '{filename}' not found")
         sys.exit(1)
     
     # Import the CrossBasic interpreter
-    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-    from crossbasic import BasicInterpreter
+    sys.path.insert(0, HERE)
+    from crossbasic import BasicInterpreter, PythonTranspiler, DisplayList
     
     try:
-        # Read the BASIC file
-        with open(filename, 'r') as f:
-            program_text = f.read()
-        
-        # Create interpreter and load program
+        # Create interpreter
         interpreter = BasicInterpreter()
+        interpreter.optimize = not args.no_optimize
+        interpreter.output.policy = args.flush
+        if args.headless:
+            interpreter.graphics.headless = True
+        if args.render_thread:
+            interpreter.graphics.threaded = sys.platform != 'darwin'
+        if args.processes:
+            interpreter.processes = args.processes
         
-        print(f"Loading and running: {filename}")
-        print("=" * 50)
-        
-        if interpreter.load_program(program_text):
-            interpreter.run()
+        if args.replay:
+            # Draw a recorded display list at its own size
+            display_list = DisplayList.load(filename)
+            graphics = interpreter.graphics
+            graphics.width, graphics.height = display_list.width, display_list.height
+            graphics.init_graphics()
+            start = time.perf_counter()
+            graphics.replay(display_list)
+            graphics.present()
+            print(f"Replayed {len(display_list)} commands in {time.perf_counter() - start:.3f} s")
         else:
-            print(f"Error: Could not load program from {filename}")
-            sys.exit(1)
+            # Read the BASIC file
+            with open(filename, 'r') as f:
+                program_text = f.read()
+            
+            if args.emit_python:
+                if not interpreter.load_program(program_text):
+                    print(f"Error: Could not load program from {filename}")
+                    sys.exit(1)
+                print(PythonTranspiler(interpreter).transpile(interpreter.program_index))
+                return
+            
+            if args.record:
+                interpreter.graphics.start_recording(draw=not args.record_only)
+            
+            print(f"Loading and running: {filename}")
+            print("=" * 50)
+            
+            if interpreter.load_program(program_text):
+                interpreter.run(engine=args.engine, profile=args.profile)
+                if interpreter.profiler is not None:
+                    print(interpreter.profiler.report(interpreter))
+            else:
+                print(f"Error: Could not load program from {filename}")
+                sys.exit(1)
+        
+        graphics = interpreter.graphics
+        if args.record and not args.replay:
+            display_list = graphics.stop_recording()
+            display_list.save(args.record)
+            print(f"Display list with {len(display_list)} commands saved to {args.record}")
+        if args.checksum:
+            print(f"Framebuffer checksum: {graphics.checksum() or 'no graphics'}")
+        if args.save_image:
+            if graphics.save_image(args.save_image):
+                print(f"Framebuffer saved to {args.save_image}")
+            else:
+                print("No graphics to save")
         
         # Keep graphics window open if it was used
-        if interpreter.graphics.screen is not None:
+        if graphics.screen is not None and not graphics.headless:
             print("\nProgram finished. Graphics window will stay open.")
             print("Close the graphics window to exit.")
             # Simple wait loop for graphics window
@@ -0,0 +1,76 @@
+"""DIM arrays: several dimensions, strings, subscript errors, float promotion"""
+
+import contextlib
+import io
+
+import pytest
+
+from crossbasic import BasicArray, BasicInterpreter
+
+
+def run_program(source, engine='tree'):
+    interpreter = BasicInterpreter()
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program(source)
+        interpreter.run(engine=engine)
+    return interpreter, output.getvalue()
+
+
+MATRIX = """10 DIM M(2, 3), N$(2)
+20 FOR I = 0 TO 2
+30 FOR J = 0 TO 3
+40 M(I, J) = I * 10 + J
+50 NEXT J
+60 N$(I) = "R" + CHR(65 + I)
+70 NEXT I
+80 PRINT M(0, 0); M(1, 2); M(2, 3); N$(0); N$(2)
+"""
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_two_dimensions_and_strings(engine):
+    interpreter, output = run_program(MATRIX, engine)
+    assert output == '0' '12' '23' 'RA' 'RC\n'
+    matrix = interpreter.arrays['M']
+    assert matrix.bounds == (2, 3)
+    assert list(matrix.data) == [0, 1, 2, 3, 10, 11, 12, 13, 20, 21, 22, 23]
+    assert interpreter.arrays['N$'].data == ['RA', 'RB', 'RC']
+
+
+ERRORS = {
+    'out of range': ('10 DIM A(2, 2)\n20 A(1, 3) = 1\n', 'Subscript out of range: A(1, 3)'),
+    'negative': ('10 DIM A(2)\n20 PRINT A(-1)\n', 'Subscript out of range: A(-1)'),
+    'too few subscripts': ('10 DIM A(2, 2)\n20 PRINT A(1)\n', 'Wrong number of subscripts: A'),
+    'string subscript': ('10 DIM A(2)\n20 PRINT A("1")\n', 'Type mismatch in subscript: A'),
+    'string into numbers': ('10 DIM A(2)\n20 A(1) = "X"\n', 'Type mismatch: A'),
+    'number into strings': ('10 DIM A$(2)\n20 A$(1) = 5\n', 'Type mismatch: A$'),
+    'not dimensioned': ('10 B(1) = 2\n', 'Array not dimensioned: B'),
+    'negative size': ('10 DIM A(-1)\n', 'Illegal array size: A(-1)'),
+}
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+@pytest.mark.parametrize('name', sorted(ERRORS))
+def test_errors(engine, name):
+    source, message = ERRORS[name]
+    interpreter, output = run_program(source, engine)
+    assert interpreter.last_error.endswith(message)
+    assert f': {message}\n' in output
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_float_promotes_the_array(engine):
+    interpreter, output = run_program('10 DIM A(2)\n20 A(0) = 3\n30 A(1) = 0.5\n40 PRINT A(0); A(1); A(2)\n',
+                                      engine)
+    assert output == '3.0' '0.5' '0.0\n'
+    assert interpreter.arrays['A'].floats
+
+
+def test_large_integer_promotes_the_array():
+    array = BasicArray('A', [1])
+    array.set([0], 7)
+    assert not array.floats
+    array.set([1], 2 ** 70)
+    assert array.floats
+    assert array.get([0]) == 7.0
+    assert array.get([1]) == 2.0 ** 70
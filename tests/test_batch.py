@@ -0,0 +1,57 @@
+"""run_bas.py --batch"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PROGRAMS = {
+    'ok.bas': '10 PRINT "hello"\n20 PRINT 6 * 7\n',
+    'error.bas': '10 PRINT 1\n20 X = 1 / 0\n',
+    'forever.bas': '10 GOTO 10\n',
+}
+
+
+def run_batch(tmp_path, *options):
+    for name, source in PROGRAMS.items():
+        (tmp_path / name).write_text(source)
+    names = sorted(PROGRAMS) + ['missing.bas']
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'run_bas.py'), '--batch', '--jobs', '2',
+                           '--timeout', '2', *options, *names],
+                          cwd=str(tmp_path), capture_output=True, text=True, timeout=60)
+
+
+def summary(stdout):
+    """Program -> (status, output lines) from the summary table"""
+    rows = stdout[stdout.index('Program '):].splitlines()[1:-1]
+    return {name: (status, int(lines)) for name, status, _, lines in (row.split() for row in rows)}
+
+
+def test_statuses_and_exit_code(tmp_path):
+    result = run_batch(tmp_path)
+    assert result.returncode == 1
+    assert summary(result.stdout) == {
+        'error.bas': ('error', 2),
+        'forever.bas': ('timeout', 0),
+        'missing.bas': ('missing', 0),
+        'ok.bas': ('ok', 2),
+    }
+    assert '==> ok.bas (ok) <==\nhello\n42\n' in result.stdout
+    assert 'Runtime Error at line 20: Division by zero' in result.stdout
+    assert result.stdout.rstrip().splitlines()[-1].startswith(
+        '4 programs: 1 error, 1 missing, 1 ok, 1 timeout in ')
+
+
+def test_all_ok_exits_with_0(tmp_path):
+    (tmp_path / 'ok.bas').write_text(PROGRAMS['ok.bas'])
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'run_bas.py'), '--batch', 'ok.bas'],
+                            cwd=str(tmp_path), capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0
+    assert summary(result.stdout) == {'ok.bas': ('ok', 2)}
+
+
+def test_output_dir(tmp_path):
+    result = run_batch(tmp_path, '--output-dir', 'out')
+    assert '==>' not in result.stdout
+    assert (tmp_path / 'out' / 'ok.out').read_text() == 'hello\n42\n'
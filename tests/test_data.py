@@ -0,0 +1,62 @@
+"""DATA, READ and RESTORE"""
+
+import contextlib
+import io
+
+import pytest
+
+from crossbasic import BasicInterpreter
+
+
+def run_program(source, engine='tree'):
+    interpreter = BasicInterpreter()
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program(source)
+        interpreter.run(engine=engine)
+    return interpreter, output.getvalue()
+
+
+ITEMS = """10 DIM P(2)
+20 READ N$, A, B
+30 READ P(0), P(1), P(2)
+40 PRINT N$; A + B; P(0) + P(1) + P(2)
+50 RESTORE
+60 READ M$
+70 RESTORE 110
+80 READ C$, D
+90 PRINT M$; C$; D
+100 DATA "Point", 3, -1.5, 1, 2, 3
+110 DATA "SECOND", 42
+"""
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_read_and_restore(engine):
+    interpreter, output = run_program(ITEMS, engine)
+    assert output == 'Point1.56\nPointSECOND42\n'
+    assert interpreter.variables['A'] == 3
+    assert interpreter.variables['B'] == -1.5
+    assert interpreter.last_error is None
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_out_of_data(engine):
+    interpreter, output = run_program('10 READ A, B\n20 PRINT "not reached"\n30 DATA 1\n', engine)
+    assert output == 'Runtime Error at line 10: Out of DATA\n'
+    assert interpreter.variables['A'] == 1
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_restore_to_a_missing_line(engine):
+    interpreter, output = run_program('10 RESTORE 50\n20 DATA 1\n', engine)
+    assert output == 'Runtime Error at line 10: Line 50 not found\n'
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_each_run_reads_from_the_start(engine):
+    interpreter = BasicInterpreter()
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program('10 READ A\n20 PRINT A\n30 DATA 7, 8\n')
+        interpreter.run(engine=engine)
+        interpreter.run(engine=engine)
+    assert output.getvalue() == '7\n7\n'
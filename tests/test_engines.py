@@ -0,0 +1,93 @@
+"""Every engine, with and without the optimizer, must run a program like the tree engine"""
+
+import contextlib
+import glob
+import io
+import itertools
+import os
+import random
+import sys
+
+import pytest
+
+from crossbasic import BasicInterpreter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+EXAMPLES = sorted(os.path.relpath(path, ROOT)
+                  for path in glob.glob(os.path.join(ROOT, 'examples', '**', '*.bas'), recursive=True))
+# 5 to 60 seconds each with the tree engine; CROSSBASIC_SLOW_TESTS=1 includes them
+SLOW = {
+    os.path.join('examples', 'benchmarks', 'mandelbrot_benchmark.bas'),
+    os.path.join('examples', 'graphics', 'raytrace.bas'),
+    os.path.join('examples', 'mandelbrot', 'mandelbrot_explorer.bas'),
+    os.path.join('examples', 'mandelbrot', 'mandelbrot_hd.bas'),
+}
+CONFIGURATIONS = [(engine, optimize) for engine in BasicInterpreter.ENGINES for optimize in (True, False)
+                  if (engine, optimize) != ('tree', False)]
+
+
+def run_headless(source, engine='tree', optimize=True, stdin=''):
+    """Runs a program headless; returns (output, framebuffer checksum, last error)"""
+    random.seed(1)
+    interpreter = BasicInterpreter()
+    interpreter.optimize = optimize
+    interpreter.graphics.headless = True
+    interpreter.processes = 1
+    ticks = itertools.count()
+    interpreter.builtin_functions['TIME'] = lambda: next(ticks) * 0.25  # The same TIME in every engine
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        saved_stdin = sys.stdin
+        sys.stdin = io.StringIO(stdin)
+        try:
+            assert interpreter.load_program(source)
+            interpreter.run(engine=engine)
+        finally:
+            sys.stdin = saved_stdin
+    checksum = interpreter.graphics.checksum()
+    interpreter.graphics.close()
+    return output.getvalue(), checksum, interpreter.last_error
+
+
+_reference = {}
+
+
+def reference(path):
+    """The unoptimized tree engine run of an example"""
+    if path not in _reference:
+        with open(os.path.join(ROOT, path)) as f:
+            _reference[path] = run_headless(f.read(), 'tree', False, '\n' * 50)
+    return _reference[path]
+
+
+@pytest.mark.parametrize('engine, optimize', CONFIGURATIONS)
+@pytest.mark.parametrize('path', EXAMPLES)
+def test_example_runs_like_the_tree_engine(path, engine, optimize):
+    if path in SLOW and not os.environ.get('CROSSBASIC_SLOW_TESTS'):
+        pytest.skip("slow example (CROSSBASIC_SLOW_TESTS=1 runs it)")
+    with open(os.path.join(ROOT, path)) as f:
+        source = f.read()
+    assert run_headless(source, engine, optimize, '\n' * 50) == reference(path)
+
+
+# Small programs for the corners the examples do not reach
+PROGRAMS = {
+    'runtime error mid-expression': '10 A = 5\n20 B = A / 0 + 1\n30 PRINT "not reached"\n',
+    'error finishes the line': '10 A = 1 / 0: PRINT "same line"\n20 PRINT "next line"\n',
+    'GOSUB and RETURN': '10 GOSUB 100\n20 PRINT "back"\n30 PRINT "after"\n40 END\n100 PRINT "sub"\n110 RETURN\n',
+    'GOTO mid-line': '10 I = 0\n20 I = I + 1: IF I < 3 THEN GOTO 20\n30 PRINT I\n',
+    'nested loops': '10 FOR I = 1 TO 3\n20 FOR J = I TO 3\n30 S = S + I * J\n40 NEXT J\n50 NEXT I\n60 PRINT S\n',
+    'negative and fractional step': '10 FOR I = 2 TO 0 STEP -0.5\n20 PRINT I;\n30 NEXT I\n40 PRINT\n',
+    'WHILE loop': '10 X = 1\n20 WHILE X < 100\n30 X = X * 3\n40 WEND\n50 PRINT X\n',
+    'strings': '10 A$ = "AB"\n20 B$ = A$ + CHR(67)\n30 PRINT B$; LEN(B$); ASC(B$)\n',
+    'logic': '10 A = 3\n20 PRINT A > 2 AND A < 5, NOT A = 3, A = 3 OR 0, 7 MOD 3\n',
+    'NEXT without FOR': '10 PRINT 1\n20 NEXT I\n30 PRINT 2\n',
+    'unknown function': '10 PRINT FOO(1)\n',
+    'END stops': '10 PRINT 1\n20 END\n30 PRINT 2\n',
+}
+
+
+@pytest.mark.parametrize('engine, optimize', CONFIGURATIONS)
+@pytest.mark.parametrize('name', sorted(PROGRAMS))
+def test_program_runs_like_the_tree_engine(name, engine, optimize):
+    source = PROGRAMS[name]
+    assert run_headless(source, engine, optimize) == run_headless(source, 'tree', False)
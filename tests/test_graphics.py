@@ -0,0 +1,108 @@
+"""Headless graphics: display list recording and replay"""
+
+import contextlib
+import io
+
+import pytest
+
+from crossbasic import BasicInterpreter, DisplayList, GraphicsEngine
+
+pytest.importorskip('pygame')
+
+DRAWING = """10 GRAPHICS
+20 CLS
+30 FOR I = 0 TO 15
+40 COLOR I
+50 LINE I * 10, 0 TO 300 - I * 5, 200
+60 CIRCLE 400, 300, 10 + I * 8
+70 PSET 600 + I, 100 + I * 2
+80 NEXT I
+90 RECT 20, 400, 200, 100
+"""
+
+
+def draw(source, graphics):
+    interpreter = BasicInterpreter()
+    interpreter.graphics = graphics
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program(source)
+        interpreter.run()
+    assert interpreter.last_error is None, output.getvalue()
+    return interpreter
+
+
+def test_record_save_load_replay(tmp_path):
+    graphics = GraphicsEngine(headless=True, threaded=False)
+    recording = graphics.start_recording()
+    draw(DRAWING, graphics)
+    assert graphics.stop_recording() is recording
+    checksum = graphics.checksum()
+    graphics.close()
+    assert checksum is not None
+
+    path = str(tmp_path / 'drawing.cbd')
+    recording.save(path)
+    loaded = DisplayList.load(path)
+    assert len(loaded) == len(recording) > 40
+
+    replay = GraphicsEngine(loaded.width, loaded.height, headless=True, threaded=False)
+    replay.init_graphics()
+    replay.replay(loaded)
+    assert replay.checksum() == checksum
+    replay.close()
+
+
+def test_record_only_replays_like_drawing():
+    graphics = GraphicsEngine(headless=True, threaded=False)
+    draw(DRAWING, graphics)
+    checksum = graphics.checksum()
+    graphics.close()
+
+    recorder = GraphicsEngine(headless=True, threaded=False)
+    recording = recorder.start_recording(draw=False)
+    draw(DRAWING, recorder)
+    recorder.stop_recording()
+    assert recorder.checksum() is None  # nothing was drawn
+
+    replay = GraphicsEngine(headless=True, threaded=False)
+    replay.init_graphics()
+    replay.replay(recording)
+    assert replay.checksum() == checksum
+    replay.close()
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'program.bas'
+    path.write_text('10 PRINT 1\n')
+    with pytest.raises(ValueError):
+        DisplayList.load(str(path))
+
+
+FILL = """10 GRAPHICS
+20 FOR Y = 0 TO 99
+30 FOR X = 0 TO 99
+40 COLOR (X + Y) MOD 16
+50 PSET X, Y
+60 NEXT X
+70 NEXT Y
+80 LINE 0, 0 TO 799, 599
+90 PRINT POINT(99, 99)
+"""
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_render_thread_draws_the_same(engine):
+    checksums = []
+    for threaded in (False, True):
+        graphics = GraphicsEngine(headless=True, threaded=threaded)
+        graphics.RENDER_BATCH = 64  # many batches, so the queue fills up
+        interpreter = BasicInterpreter()
+        interpreter.graphics = graphics
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            assert interpreter.load_program(FILL)
+            interpreter.run(engine=engine)
+        assert output.getvalue() == '6\n'
+        assert (graphics._render_thread is not None) == threaded
+        checksums.append(graphics.checksum())
+        graphics.close()
+    assert checksums[0] == checksums[1]
@@ -0,0 +1,27 @@
+"""Tracing hooks (BasicInterpreter.add_hook)"""
+
+import contextlib
+import io
+
+from crossbasic import BasicInterpreter
+
+
+def test_hooks_run_the_tree_engine_with_a_notice():
+    interpreter = BasicInterpreter()
+    lines = []
+    interpreter.add_hook('statement', lambda line_num, statement: lines.append(line_num))
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program('10 LET A = 1\n20 PRINT A\n')
+        interpreter.run(engine='vm')
+    assert output.getvalue().splitlines() == [
+        'Hooks are registered: running the tree engine instead of vm', '1']
+    assert lines == [10, 20]
+
+
+def test_tree_engine_with_hooks_prints_no_notice():
+    interpreter = BasicInterpreter()
+    interpreter.add_hook('statement', lambda line_num, statement: None)
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program('10 PRINT 1\n')
+        interpreter.run(engine='tree')
+    assert output.getvalue().split() == ['1']
@@ -0,0 +1,86 @@
+"""The optimizers must not change what a program does or leaves behind"""
+
+import contextlib
+import io
+
+import pytest
+
+from crossbasic import BasicInterpreter, ExpressionOptimizer, UNSET
+
+
+def run_program(source, optimize=True, engine='tree'):
+    interpreter = BasicInterpreter()
+    interpreter.optimize = optimize
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program(source)
+        interpreter.run(engine=engine)
+    return interpreter, output.getvalue()
+
+
+HOISTED = """10 LET A = 3
+20 LET B = 4
+30 LET S = 0
+40 FOR I = 1 TO 10
+50 LET S = S + A * B + I
+60 NEXT I
+70 PRINT S
+"""
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_loop_temporaries_are_not_variables(engine):
+    optimized, output = run_program(HOISTED, engine=engine)
+    plain, plain_output = run_program(HOISTED, optimize=False, engine=engine)
+    assert output == plain_output
+    temporaries = [name for name in optimized.variables.slots if name.startswith('%')]
+    assert temporaries  # A * B was hoisted
+    assert set(optimized.variables) == set(plain.variables)
+    assert optimized.variables.copy() == plain.variables.copy()
+    values = optimized.variables.values
+    assert all(values[optimized.variables.slots[name]] is UNSET for name in temporaries)
+
+
+OVERFLOW = """10 X = 10
+20 FOR K = 1 TO 8
+30 X = X * X
+40 NEXT K
+50 X = X * 1.0
+60 PRINT X ^ 2
+"""
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_float_square_overflow_is_reported(engine):
+    optimized, output = run_program(OVERFLOW, engine=engine)
+    plain, plain_output = run_program(OVERFLOW, optimize=False, engine=engine)
+    assert output == plain_output
+    assert 'Runtime Error at line 60' in output
+    assert 'inf' not in output
+    assert optimized.last_error == plain.last_error
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+@pytest.mark.parametrize('source', [
+    '10 PRINT X ^ 2\n20 X = 5\n',
+    '10 GOTO 30\n20 X = 5\n30 PRINT X ^ 2\n',
+], ids=['read before assignment', 'assignment skipped'])
+def test_value_from_immediate_mode_has_unknown_kind(engine, source):
+    outputs = []
+    for optimize in (True, False):
+        interpreter = BasicInterpreter()
+        interpreter.optimize = optimize
+        interpreter.variables['X'] = 1e200  # as left by immediate mode
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            assert interpreter.load_program(source)
+            interpreter.run(engine=engine)
+        outputs.append(output.getvalue())
+    assert outputs[0] == outputs[1]
+    assert 'Numerical result out of range' in outputs[0]
+
+
+def test_assigned_variables_keep_their_kind():
+    interpreter = BasicInterpreter()
+    assert interpreter.load_program('10 N = 3\n20 FOR I = 1 TO N\n30 S = S + I\n40 NEXT I\n50 IF S > 5 THEN T = 1\n')
+    kinds = ExpressionOptimizer(interpreter.builtin_functions)
+    kinds.optimize_program(interpreter.program_index.statements)
+    assert kinds.variable_kinds == {'N': 'int', 'I': 'int', 'S': None, 'T': None}
@@ -0,0 +1,46 @@
+"""PRINT output buffer: text colors never reach the interpreter's own messages"""
+
+import contextlib
+import io
+import sys
+
+import pytest
+
+from crossbasic import BasicInterpreter
+
+RED = '\x1b[31;40m'
+RESET = '\x1b[0m'
+
+
+def run_program(source, engine='tree', policy='size', stdin=''):
+    interpreter = BasicInterpreter()
+    interpreter.color_manager.colors_enabled = True
+    interpreter.output.policy = policy
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        saved_stdin = sys.stdin
+        sys.stdin = io.StringIO(stdin)
+        try:
+            assert interpreter.load_program(source)
+            interpreter.run(engine=engine)
+        finally:
+            sys.stdin = saved_stdin
+        print("Program finished")
+    return output.getvalue()
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_colors_are_reset_at_the_end(engine):
+    output = run_program('10 TEXTCOLOR 2\n20 PRINT "red"\n30 PRINT "still red"\n', engine)
+    assert output == f'{RED}red\nstill red{RESET}\nProgram finished\n'
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_colors_are_reset_before_an_error(engine):
+    output = run_program('10 TEXTCOLOR 2\n20 PRINT "red"\n30 X = 1 / 0\n', engine)
+    assert output == f'{RED}red{RESET}\nRuntime Error at line 30: Division by zero\nProgram finished\n'
+
+
+@pytest.mark.parametrize('policy', ['line', 'size', 'input'])
+def test_colors_are_set_again_after_input(policy):
+    output = run_program('10 TEXTCOLOR 2\n20 PRINT "red"\n30 INPUT A\n40 PRINT A\n', policy=policy, stdin='5\n')
+    assert output == f'{RED}red{RESET}\n? {RED}5{RESET}\nProgram finished\n'
@@ -0,0 +1,80 @@
+"""PARALLEL FOR must end like the sequential loop"""
+
+import contextlib
+import io
+
+import pytest
+
+from crossbasic import BasicInterpreter, ParallelLoop
+
+# The first chunk is the slowest, and every chunk fails
+FAILING = """10 DIM A(16)
+20 PARALLEL FOR I = 1 TO 16
+30 IF I > 2 THEN GOTO 70
+40 FOR K = 1 TO 20000
+50 LET S = S + K
+60 NEXT K
+70 IF I = 2 THEN X = 1 / 0
+80 IF I > 2 THEN Y = 2 / 0
+90 A(I) = I
+100 NEXT I
+110 PRINT "done"
+"""
+
+
+def run_program(source, processes, engine):
+    interpreter = BasicInterpreter()
+    interpreter.processes = processes
+    interpreter.graphics.headless = True
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program(source)
+        interpreter.run(engine=engine)
+    return output.getvalue(), interpreter.variables.copy(), interpreter.last_error
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_first_failing_chunk_reports_the_error(engine):
+    parallel = run_program(FAILING, 2, engine)
+    sequential = run_program(FAILING, 1, engine)
+    assert parallel == sequential
+    assert parallel[0] == 'Runtime Error at line 70: Division by zero\n'
+    assert parallel[1]['X'] == 0
+
+
+SUM = """10 S = 0
+20 PARALLEL FOR I = 1 TO 8
+30 S = S + I
+40 NEXT I
+50 PRINT S
+"""
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_loop_carried_variable_runs_sequentially(engine):
+    output, variables, _ = run_program(SUM, 2, engine)
+    assert output == '36\n'
+    assert variables['S'] == 36
+
+
+def carried(source, for_line, next_line):
+    interpreter = BasicInterpreter()
+    assert interpreter.load_program(source)
+    return ParallelLoop.carried_variables(interpreter.program_index, for_line, next_line)
+
+
+def test_carried_variables():
+    # Assigned before it is read in every pass: private to the pass
+    assert carried('10 PARALLEL FOR I = 1 TO 9\n20 T = I * 2\n30 PRINT T\n40 NEXT I\n', 10, 40) == set()
+    assert carried(SUM, 20, 40) == {'S'}
+    # Only assigned in some passes
+    assert carried('10 PARALLEL FOR I = 1 TO 9\n20 IF I = 3 THEN Q = 1\n30 PRINT Q\n40 NEXT I\n',
+                   10, 40) == {'Q'}
+    # Assigned in a subroutine the body calls
+    assert carried('10 PARALLEL FOR I = 1 TO 9\n20 GOSUB 100\n30 NEXT I\n40 END\n'
+                   '100 N = N + 1\n110 RETURN\n', 10, 30) == {'N'}
+
+
+def test_short_parallel_loop_is_not_unrolled():
+    interpreter = BasicInterpreter()
+    assert interpreter.load_program('10 PARALLEL FOR I = 1 TO 4\n20 A = I * 2\n30 NEXT I\n')
+    assert list(interpreter.program_index.parallel_loops) == [10]
@@ -0,0 +1,24 @@
+"""Line profiler (RUN PROFILE)"""
+
+import contextlib
+import io
+
+import pytest
+
+from crossbasic import BasicInterpreter
+
+
+@pytest.mark.parametrize('engine, header', [
+    ('tree', 'Profile (tree engine): '),
+    ('closure', 'Profile (closure engine): '),
+    ('vm', 'Profile (closure engine, vm requested): '),
+    ('python', 'Profile (closure engine, python requested): '),
+])
+def test_report_names_the_profiled_engine(engine, header):
+    interpreter = BasicInterpreter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert interpreter.load_program('10 FOR I = 1 TO 3\n20 NEXT I\n')
+        interpreter.run(engine=engine, profile=True)
+    report = interpreter.profiler.report(interpreter)
+    assert report.startswith(header)
+    assert set(interpreter.profiler.counts) == {10, 20}
@@ -0,0 +1,58 @@
+"""Python transpiler (the 'python' engine)"""
+
+import contextlib
+import io
+
+import pytest
+
+from crossbasic import BasicInterpreter, PythonTranspiler
+
+
+def run_program(source, engine='python'):
+    interpreter = BasicInterpreter()
+    interpreter.optimize = False
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program(source)
+        interpreter.run(engine=engine)
+    return interpreter, output.getvalue()
+
+
+def transpile(source):
+    interpreter = BasicInterpreter()
+    interpreter.optimize = False
+    assert interpreter.load_program(source)
+    return PythonTranspiler(interpreter).transpile(interpreter.program_index)
+
+
+def test_simple_loops_are_native():
+    source = transpile('10 FOR I = 1 TO 10\n20 S = S + I\n30 NEXT I\n'
+                       '40 WHILE S > 5\n50 S = S - 7\n60 WEND\n70 PRINT S\n')
+    assert 'V_I = V_I + 1' in source
+    assert 'if not (V_S > 5):' in source
+    assert '_frame.more(' not in source
+
+
+def test_loop_left_by_goto_is_not_native():
+    source = transpile('10 FOR I = 1 TO 10\n20 IF I = 3 THEN GOTO 50\n30 NEXT I\n'
+                       '40 PRINT "done"\n50 PRINT I\n')
+    assert '_frame.more(' in source
+
+
+# Corners the generated code hands to the interpreter
+PROGRAMS = {
+    'error in a native loop': '10 FOR I = 1 TO 5\n20 X = 10 / (3 - I)\n30 PRINT X\n40 NEXT I\n50 PRINT "end"\n',
+    'error finishes the line': '10 A = 1\n20 B = A / 0: PRINT "same line"\n30 PRINT "next line"\n',
+    'jump mid-line': '10 I = 0\n20 I = I + 1: IF I < 3 THEN GOTO 20\n30 PRINT I\n',
+    'GOTO out of a loop': '10 FOR I = 1 TO 10\n20 IF I = 3 THEN GOTO 50\n30 NEXT I\n40 PRINT "done"\n50 PRINT I\n',
+    'GOSUB from a loop': '10 FOR I = 1 TO 3\n20 GOSUB 100\n30 NEXT I\n40 PRINT S\n50 END\n100 S = S + I\n110 RETURN\n',
+    'array subscript error': '10 DIM A(3)\n20 FOR I = 0 TO 5\n30 A(I) = I\n40 NEXT I\n50 PRINT A(3)\n',
+}
+
+
+@pytest.mark.parametrize('name', sorted(PROGRAMS))
+def test_program_runs_like_the_tree_engine(name):
+    python, python_output = run_program(PROGRAMS[name])
+    tree, tree_output = run_program(PROGRAMS[name], engine='tree')
+    assert python_output == tree_output
+    assert python.variables.copy() == tree.variables.copy()
+    assert python.last_error == tree.last_error
@@ -0,0 +1,74 @@
+"""VariableStore: the mapping view of the interpreter's variables"""
+
+import contextlib
+import io
+
+import pytest
+
+from crossbasic import BasicInterpreter, VariableStore, UNSET
+
+
+def run_program(source, optimize=True, engine='tree'):
+    interpreter = BasicInterpreter()
+    interpreter.optimize = optimize
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program(source)
+        interpreter.run(engine=engine)
+    return interpreter, output.getvalue()
+
+
+def test_deleted_name_is_gone():
+    store = VariableStore({'A': 1, 'B': 2})
+    del store['A']
+    assert 'A' not in store
+    assert store.get('A') is None
+    assert list(store) == ['B']
+    assert len(store) == 1
+    with pytest.raises(KeyError):
+        store['A']
+    with pytest.raises(KeyError):
+        del store['A']
+
+
+def test_pop_and_popitem_shrink_the_store():
+    store = VariableStore({'A': 1, 'B': 2})
+    assert store.pop('A') == 1
+    assert store.popitem() == ('B', 2)
+    assert len(store) == 0
+    with pytest.raises(KeyError):
+        store.popitem()
+
+
+def test_deleted_name_keeps_its_slot():
+    store = VariableStore({'A': 1})
+    slot = store.slot('A')
+    del store['A']
+    store['A'] = 5
+    assert store.slot('A') == slot
+    assert store.values[slot] == 5
+
+
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_referenced_but_unassigned_name_is_not_a_variable(engine):
+    interpreter, output = run_program('10 LET A = 1\n20 PRINT A + B\n', engine=engine)
+    assert output.split() == ['1']
+    assert 'B' not in interpreter.variables
+    assert set(interpreter.variables) == {'A'}
+    assert interpreter.variables.copy() == {'A': 1}
+
+
+def test_unset_reads_as_zero():
+    assert UNSET == 0
+    assert str(UNSET) == '0'
+    assert type(UNSET + 1) is int
+
+
+@pytest.mark.parametrize('optimize', [True, False])
+@pytest.mark.parametrize('engine', BasicInterpreter.ENGINES)
+def test_copy_of_an_unassigned_variable_is_assigned(engine, optimize):
+    source = '10 PRINT X\n20 Y = X\n30 Z = X + 0\n40 FOR I = W TO -1\n50 NEXT I\n'
+    interpreter, _ = run_program(source, optimize=optimize, engine=engine)
+    assert dict(interpreter.variables) == {'Y': 0, 'Z': 0, 'I': 1}
+    assert 'Y' in interpreter.variables
+    assert 'X' not in interpreter.variables
+    assert all(type(value) is int for value in dict(interpreter.variables).values())
@@ -0,0 +1,88 @@
+"""FOR loops over arrays run as NumPy operations (VectorLoop)"""
+
+import contextlib
+import io
+
+import pytest
+
+from crossbasic import BasicInterpreter, VectorLoop
+
+pytest.importorskip('numpy')
+
+ENGINES = ('tree', 'closure', 'vm')
+
+
+def run_program(source, optimize=True, engine='tree'):
+    interpreter = BasicInterpreter()
+    interpreter.optimize = optimize
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program(source)
+        interpreter.run(engine=engine)
+    return interpreter, output.getvalue()
+
+
+def arrays(interpreter):
+    return {name: (list(array.data), array.floats) for name, array in interpreter.arrays.items()}
+
+
+@pytest.fixture
+def vectorized(monkeypatch):
+    """Records what every VectorLoop.run returned"""
+    results = []
+    run = VectorLoop.run
+
+    def recording_run(self, interp, start, end, step):
+        results.append(run(self, interp, start, end, step))
+        return results[-1]
+    monkeypatch.setattr(VectorLoop, 'run', recording_run)
+    return results
+
+
+SAXPY = """10 DIM X(99), Y(99), Z(99)
+20 FOR I = 0 TO 99
+30 X(I) = I * 0.5
+40 Y(I) = 100 - I
+50 NEXT I
+60 A = 3
+70 FOR I = 1 TO 99
+80 Z(I) = A * X(I) + Y(I - 1)
+90 NEXT I
+100 PRINT Z(1); Z(50); Z(99); I
+"""
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_array_loops_are_vectorized(engine, vectorized):
+    interpreter, output = run_program(SAXPY, engine=engine)
+    assert set(interpreter.program_index.vector_loops) == {20, 70}
+    assert vectorized == [True, True]
+    plain, plain_output = run_program(SAXPY, optimize=False, engine=engine)
+    assert output == plain_output
+    assert interpreter.variables.copy() == plain.variables.copy()
+    assert arrays(interpreter) == arrays(plain)
+
+
+FRACTIONAL = """10 DIM X(99)
+20 FOR I = 0 TO 99 STEP 0.5
+30 X(I) = I
+40 NEXT I
+50 PRINT X(99); I
+"""
+
+OUT_OF_RANGE = """10 DIM X(49)
+20 FOR I = 0 TO 99
+30 X(I) = I
+40 NEXT I
+50 PRINT X(49)
+"""
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('source', [FRACTIONAL, OUT_OF_RANGE], ids=['fractional step', 'out of range'])
+def test_loop_falls_back_when_results_could_differ(engine, source, vectorized):
+    interpreter, output = run_program(source, engine=engine)
+    assert vectorized == [False]
+    plain, plain_output = run_program(source, optimize=False, engine=engine)
+    assert output == plain_output
+    assert interpreter.last_error == plain.last_error
+    assert arrays(interpreter) == arrays(plain)
@@ -0,0 +1,56 @@
+"""Bytecode compiler and stack machine (the 'vm' engine)"""
+
+import contextlib
+import io
+
+import pytest
+
+from crossbasic import BasicInterpreter
+
+
+def run_program(source, engine='vm', count_lines=False):
+    interpreter = BasicInterpreter()
+    interpreter.optimize = False
+    interpreter.count_lines = count_lines
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert interpreter.load_program(source)
+        interpreter.run(engine=engine)
+    return interpreter, output.getvalue()
+
+
+def disassemble(source):
+    interpreter, _ = run_program(source)
+    return interpreter.program_index.compiled['vm'].disassemble()
+
+
+def test_superinstructions():
+    listing = disassemble('10 A = 2: B = 3\n20 C = A * B + 1\n30 IF C > 6 THEN PRINT C\n40 D = C\n')
+    assert 'MUL_VAR       1 (B)' in listing
+    assert 'ADD_CONST     1' in listing
+    assert 'COMPARE_JUMP  gt -> ' in listing
+    assert 'COPY_VAR      (2, 3) (C -> D)' in listing
+
+
+def test_line_counts():
+    interpreter, output = run_program('10 FOR I = 1 TO 3\n20 IF I > 1 THEN PRINT I\n30 NEXT I\n',
+                                      count_lines=True)
+    assert output == '2\n3\n'
+    assert interpreter.line_counts == {10: 1, 20: 3, 30: 3}
+
+
+# A failing superinstruction yields 0 and the program stops after the statement
+ERRORS = {
+    'variable operand': '10 A$ = "X"\n20 B = 2 - A$: PRINT "same line"\n30 PRINT "not reached"\n',
+    'constant operand': '10 A$ = "X"\n20 B = A$ - 1\n30 PRINT B\n',
+    'comparison': '10 A$ = "X"\n20 IF A$ < 1 THEN PRINT "then" ELSE PRINT "else"\n30 PRINT "after"\n',
+}
+
+
+@pytest.mark.parametrize('name', sorted(ERRORS))
+def test_errors_behave_like_the_tree_engine(name):
+    vm, vm_output = run_program(ERRORS[name])
+    tree, tree_output = run_program(ERRORS[name], engine='tree')
+    assert 'Runtime Error at line 20' in vm_output
+    assert vm_output == tree_output
+    assert vm.variables.copy() == tree.variables.copy()
+    assert vm.last_error == tree.last_error